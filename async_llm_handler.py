@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步LLM处理器
+基于 aiohttp 的 LLMHandler 异步版本，供流水线模式（async_pipeline）使用：
+数百个进行中的请求共用一个事件循环和一个连接池，不需要每个请求占用一个线程。
+
+与 LLMHandler 同名的公开方法（send_message、generate_title、
+process_with_template_and_title、get_available_models 等）均为协程，
+返回值保持一致，例如 (success, reply) 元组。
+
+aiohttp 为可选依赖，未安装时 AIOHTTP_AVAILABLE 为 False。
+"""
+
+import asyncio
+import contextvars
+import time
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    aiohttp = None
+    AIOHTTP_AVAILABLE = False
+
+from http_session import get_timeout
+from llm_handler import LLMHandler, LLMStreamError, StreamStats, STREAM_DONE, parse_stream_line
+
+# 最近一次流式调用的统计；同一事件循环上的各 asyncio 任务各自独立
+_stream_stats = contextvars.ContextVar("async_stream_stats", default=None)
+
+
+class AsyncLLMHandler(LLMHandler):
+    """处理与OpenRouter API的异步交互"""
+
+    def __init__(self, api_key, model="anthropic/claude-3.5-sonnet", settings=None):
+        if not AIOHTTP_AVAILABLE:
+            raise ImportError("AsyncLLMHandler 需要 aiohttp，请先安装: pip install aiohttp")
+        super().__init__(api_key, model, settings)
+
+        # 异步连接池上限（同时进行的请求数）
+        self.pool_limit = int(self.settings.get("async_pool_limit", 100))
+        self._session = None
+        self._session_loop = None
+
+    # ---------- 连接池 ----------
+
+    def _client_timeout(self, read_timeout=None):
+        """与同步版本一致的 (连接超时, 读取超时)；读取超时即两次数据之间的最长间隔"""
+        connect, read = get_timeout(self.settings, read_timeout=read_timeout)
+        return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+    async def _get_session(self):
+        """获取当前事件循环上的共享 ClientSession（换了事件循环时重新创建）"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_limit)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        """关闭连接池；每轮流水线结束时调用"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    # ---------- 请求 ----------
+
+    async def send_message(self, message_content, system_prompt=None, override_model=None, timeout=None, stream=None, on_delta=None):
+        """发送消息给LLM并获取回复（参数与 LLMHandler.send_message 相同）"""
+        success, message = await self._request_completion(
+            message_content, system_prompt, override_model, timeout, stream=stream, on_delta=on_delta
+        )
+        if not success:
+            return False, message
+
+        return True, self._select_reply(message)
+
+    async def _request_completion(self, message_content, system_prompt=None, override_model=None, timeout=None, stream=None, on_delta=None):
+        """
+        请求一次完整的LLM回复
+
+        Returns:
+            tuple: (True, choices[0].message 字典) 或 (False, 错误信息)
+        """
+        if stream is None:
+            stream = self.stream_responses or on_delta is not None
+        if stream:
+            return await self._stream_completion(message_content, system_prompt, override_model, timeout, on_delta)
+
+        try:
+            payload = self._build_payload(message_content, system_prompt, override_model)
+            session = await self._get_session()
+            client_timeout = self._client_timeout(timeout or self.settings.get("llm_timeout", 60))
+
+            # 发送请求（临时错误自动重试）
+            async def post(attempt):
+                async with session.post(self.base_url, json=payload, timeout=client_timeout) as response:
+                    response.raise_for_status()
+                    return await response.json(content_type=None)
+
+            data = await self.retry_policy.run_async(post, "LLM请求")
+
+            if "choices" in data and len(data["choices"]) > 0:
+                choice = data["choices"][0]
+                return True, choice.get("message") or {}
+            else:
+                return False, "LLM响应格式异常"
+
+        except asyncio.TimeoutError:
+            return False, "请求超时，请稍后重试"
+        except aiohttp.ClientResponseError as e:
+            return False, f"网络请求失败: {e.status} {e.message}"
+        except aiohttp.ClientError as e:
+            return False, f"网络请求失败: {e}"
+        except Exception as e:
+            return False, f"处理LLM响应时出错: {e}"
+
+    async def iter_stream(self, message_content, system_prompt=None, override_model=None, idle_timeout=None):
+        """
+        以流式方式请求LLM，逐个产出增量（异步生成器）
+
+        两次数据之间超过 idle_timeout 秒没有任何输出才视为超时。
+        结束后可通过 get_last_stream_stats() 读取首字延迟与生成速度。
+
+        Yields:
+            tuple: (kind, text)，kind 为 "content" 或 "reasoning"
+        """
+        payload = self._build_payload(message_content, system_prompt, override_model)
+        payload["stream"] = True
+        session = await self._get_session()
+        client_timeout = self._client_timeout(idle_timeout or self.stream_idle_timeout)
+
+        stats = StreamStats()
+        self._set_stream_stats(None)
+
+        async with session.post(self.base_url, json=payload, timeout=client_timeout) as response:
+            response.raise_for_status()
+
+            async for line in response.content:
+                event = parse_stream_line(line)
+                if event is STREAM_DONE:
+                    break
+                if event is None:
+                    continue
+
+                for kind, text in stats.deltas(event):
+                    yield kind, text
+
+        self._set_stream_stats(stats.result())
+
+    def get_last_stream_stats(self):
+        """获取当前 asyncio 任务最近一次流式调用的统计（首字延迟、tokens/秒等）"""
+        return _stream_stats.get()
+
+    def _set_stream_stats(self, stats):
+        """记录当前 asyncio 任务最近一次流式调用的统计"""
+        _stream_stats.set(stats)
+
+    async def _stream_completion(self, message_content, system_prompt=None, override_model=None, idle_timeout=None, on_delta=None):
+        """
+        流式请求并累积完整回复，content 与 reasoning 分别累积
+
+        Returns:
+            tuple: (True, {"content": ..., "reasoning": ...}) 或 (False, 错误信息)
+        """
+        content_parts = []
+        reasoning_parts = []
+        try:
+            async def consume(attempt):
+                async for kind, text in self.iter_stream(message_content, system_prompt, override_model, idle_timeout):
+                    if kind == "content":
+                        content_parts.append(text)
+                    else:
+                        reasoning_parts.append(text)
+                    if on_delta:
+                        on_delta(kind, text)
+
+            # 只有尚未收到任何输出时才重试，避免重复的增量
+            await self.retry_policy.run_async(
+                consume,
+                "LLM流式请求",
+                should_retry=lambda e: not content_parts and not reasoning_parts
+            )
+
+            return True, self._stream_result(content_parts, reasoning_parts)
+
+        except LLMStreamError as e:
+            return False, f"LLM流式响应错误: {e}"
+        except asyncio.TimeoutError:
+            return False, f"流式响应超过 {idle_timeout or self.stream_idle_timeout} 秒无输出，已中断"
+        except aiohttp.ClientResponseError as e:
+            return False, f"网络请求失败: {e.status} {e.message}"
+        except aiohttp.ClientError as e:
+            return False, f"网络请求失败: {e}"
+        except Exception as e:
+            return False, f"处理LLM响应时出错: {e}"
+
+    # ---------- 标题 ----------
+
+    async def generate_title(self, content, max_length=20, min_length=10, timeout=None):
+        """生成简洁标题"""
+        try:
+            success, title = await self.send_message(
+                self._build_title_prompt(content, max_length, min_length), timeout=timeout, stream=False
+            )
+
+            if success:
+                title = title.strip()
+                if len(title) > max_length:
+                    title = title[:max_length]
+                return True, title
+            else:
+                return False, title
+
+        except Exception as e:
+            return False, f"生成标题时出错: {e}"
+
+    async def process_with_template_and_title(self, content, system_prompt, max_title_length=20, min_title_length=10, override_model=None, title_timeout=None, on_delta=None):
+        """
+        处理消息并生成标题（标题与回复在同一事件循环上并发请求）
+
+        标题在 title_timeout 秒内未返回或生成失败时，使用 _generate_fallback_title。
+        """
+        if self.settings.get("title_generation_mode") == "combined":
+            return await self.process_with_combined_title(
+                content, system_prompt, max_title_length, min_title_length, override_model=override_model, on_delta=on_delta
+            )
+
+        if title_timeout is None:
+            title_timeout = self.title_timeout
+
+        try:
+            started = time.monotonic()
+            title_task = asyncio.create_task(
+                self.generate_title(content, max_title_length, min_title_length, title_timeout)
+            )
+
+            main_success, main_reply = await self.send_message(content, system_prompt, override_model=override_model, on_delta=on_delta)
+
+            if not main_success:
+                title_task.cancel()
+                return False, main_reply, None
+
+            # 主回复完成后，最多再等到标题自身的超时时间
+            remaining = max(0, title_timeout - (time.monotonic() - started))
+            try:
+                title_success, title = await asyncio.wait_for(title_task, timeout=remaining)
+            except asyncio.TimeoutError:
+                print(f"⏱️ 标题生成超过 {title_timeout} 秒，使用备选标题")
+                title_success, title = False, None
+            except Exception as e:
+                print(f"标题生成出错，使用备选标题: {e}")
+                title_success, title = False, None
+
+            if not title_success or not title:
+                title = self._generate_fallback_title(content, max_title_length)
+
+            return True, main_reply, title
+
+        except Exception as e:
+            return False, f"处理消息时出错: {e}", None
+
+    async def process_with_combined_title(self, content, system_prompt, max_title_length=20, min_title_length=10, override_model=None, on_delta=None):
+        """单次请求同时生成回复与标题（合并模式）"""
+        try:
+            combined_prompt = self._build_combined_prompt(system_prompt, max_title_length, min_title_length)
+            success, message = await self._request_completion(content, combined_prompt, override_model, on_delta=on_delta)
+            if not success:
+                return False, message, None
+
+            return (True,) + self._parse_combined_reply(message, content, max_title_length)
+
+        except Exception as e:
+            return False, f"处理消息时出错: {e}", None
+
+    # ---------- 其他 ----------
+
+    async def test_connection(self):
+        """测试OpenRouter连接"""
+        try:
+            success, reply = await self.send_message(
+                "请简单回复'连接测试成功'",
+                "你是一个测试助手，请简洁回复。"
+            )
+
+            if success:
+                return True, f"OpenRouter连接成功！LLM回复: {reply[:50]}..."
+            else:
+                return False, f"OpenRouter测试失败: {reply}"
+
+        except Exception as e:
+            return False, f"OpenRouter连接测试出错: {e}"
+
+    async def get_available_models(self):
+        """获取可用模型列表（可选功能）"""
+        try:
+            url = "https://openrouter.ai/api/v1/models"
+            session = await self._get_session()
+            async with session.get(url, timeout=self._client_timeout(10)) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+
+            models = []
+            for model in data.get("data", []):
+                models.append({
+                    "id": model.get("id", ""),
+                    "name": model.get("name", ""),
+                    "description": model.get("description", "")
+                })
+
+            return models
+
+        except Exception as e:
+            print(f"获取模型列表时出错: {e}")
+            return []
@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步Notion处理器
+基于 aiohttp 的 Notion 客户端，覆盖 NotionHandler 用到的查询、页面PATCH、追加/列出/删除内容块等操作，
+使原本串行的多个请求可以并发进行：
+- update_message_reply：流水线模式（async_pipeline）写入阶段写回回复
+- get_templates_from_notion：并行获取各模板页面的内容块（TemplateManager 全量同步）
+- update_template_page / _update_page_content：按内容块差异更新，改写与删除并发进行（TemplateManager 推送）
+
+包装一个已有的 NotionHandler，只负责发送请求；分批、响应核对、去重与限流退避规则
+都复用 NotionHandler 的方法，并与之共用同一个令牌桶限流器（按 API Key 共享），
+同步与异步请求合计仍不超过限流速率。
+
+aiohttp 为可选依赖，未安装时 AIOHTTP_AVAILABLE 为 False。
+"""
+
+import asyncio
+import json
+
+try:
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    aiohttp = None
+    AIOHTTP_AVAILABLE = False
+
+from http_session import get_pool_maxsize, get_timeout
+from notion_handler import PAGE_START, is_retryable_write_status
+
+NOTION_API = "https://api.notion.com/v1"
+
+
+class NotionResponse:
+    """异步请求的响应（正文已读取完毕，可在连接释放后使用）"""
+
+    def __init__(self, status, text, headers, request_info=None):
+        self.status_code = status
+        self.text = text
+        self.headers = headers
+        self.request_info = request_info
+
+    def json(self):
+        return json.loads(self.text) if self.text else {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise aiohttp.ClientResponseError(
+                self.request_info, (), status=self.status_code,
+                message=self.text[:200], headers=self.headers
+            )
+
+
+class AsyncNotionHandler:
+    """处理与Notion API的异步交互"""
+
+    def __init__(self, notion_handler):
+        """
+        Args:
+            notion_handler: 已初始化的 NotionHandler（提供配置、限流器与重试策略）
+        """
+        if not AIOHTTP_AVAILABLE:
+            raise ImportError("AsyncNotionHandler 需要 aiohttp，请先安装: pip install aiohttp")
+
+        self.notion = notion_handler
+        self.settings = notion_handler.settings
+        self.headers = notion_handler.headers
+        self.rate_limiter = notion_handler.rate_limiter
+        self.retry_policy = notion_handler.retry_policy
+
+        self.pool_limit = get_pool_maxsize(self.settings)
+        self._session = None
+        self._session_loop = None
+
+    # ---------- 连接池 ----------
+
+    async def _get_session(self):
+        """获取当前事件循环上的共享 ClientSession（换了事件循环时重新创建）"""
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            connector = aiohttp.TCPConnector(limit=self.pool_limit)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+            self._session_loop = loop
+        return self._session
+
+    async def close(self):
+        """关闭连接池；每轮流水线结束时调用"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
+
+    # ---------- 基础请求 ----------
+
+    async def _send_request(self, method, url, payload=None):
+        """
+        发送请求（与 NotionHandler._send_request 相同的限流与 429/503 退避规则）
+
+        Returns:
+            NotionResponse: 响应（由调用方检查状态码）
+        """
+        method = method.upper()
+        if method not in ("GET", "POST", "PATCH", "DELETE"):
+            raise ValueError(f"不支持的HTTP方法: {method}")
+
+        session = await self._get_session()
+        connect_timeout, read_timeout = get_timeout(self.settings)
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+
+        attempt = 0
+        while True:
+            # 与同步请求共用令牌桶：预约令牌后异步等待，不阻塞事件循环
+            wait = self.rate_limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            async with session.request(
+                method,
+                url,
+                json=payload if method in ("POST", "PATCH") else None,
+                timeout=timeout
+            ) as raw:
+                response = NotionResponse(raw.status, await raw.text(), raw.headers, raw.request_info)
+
+            delay = self.notion._rate_limit_delay(response, attempt)
+            if delay is None:
+                return response
+            self.rate_limiter.penalize(delay)
+            attempt += 1
+
+    async def _send_write_request(self, method, url, payload=None, description="Notion写入"):
+        """发送写请求：超时、连接错误和 408/5xx 按 settings.max_retries 重试（429/503 由 _send_request 处理）"""
+        responses = []
+
+        async def attempt(_):
+            response = await self._send_request(method, url, payload)
+            responses.append(response)
+            if is_retryable_write_status(response.status_code):
+                response.raise_for_status()
+            return response
+
+        try:
+            return await self.retry_policy.run_async(attempt, description)
+        except aiohttp.ClientResponseError:
+            return responses[-1]
+
+    async def query_database(self, database_id, payload=None, properties=None):
+        """
+        查询数据库并跟随 next_cursor 取回全部结果，请求失败时抛出异常
+
+        properties 为结果中需要的属性名，按 NotionHandler._query_url 生成 filter_properties；
+        属性ID缓存与同步处理器共用，首次解析需要一次同步请求，因此在线程池中进行。
+        """
+        url = f"{NOTION_API}/databases/{database_id}/query"
+        if properties:
+            loop = asyncio.get_running_loop()
+            url = await loop.run_in_executor(None, self.notion._query_url, database_id, tuple(properties))
+        payload = dict(payload or {})
+        results = []
+        while True:
+            response = await self._send_request("POST", url, payload)
+            response.raise_for_status()
+            data = response.json()
+            results.extend(data.get("results", []))
+
+            next_cursor = data.get("next_cursor")
+            if not data.get("has_more") or not next_cursor:
+                return results
+            payload["start_cursor"] = next_cursor
+
+    async def update_page(self, page_id, properties, description="更新页面属性"):
+        """更新页面属性，返回是否成功"""
+        response = await self._send_write_request(
+            "PATCH", f"{NOTION_API}/pages/{page_id}", {"properties": properties}, description
+        )
+        if response.status_code != 200:
+            print(f"❌ {description}失败: HTTP {response.status_code}")
+            print(f"错误详情: {response.text}")
+            return False
+        return True
+
+    async def list_block_children(self, block_id, page_size=100):
+        """分页获取某个块的全部子块，请求失败时抛出异常"""
+        base_url = f"{NOTION_API}/blocks/{block_id}/children?page_size={page_size}"
+        url = base_url
+        blocks = []
+        while True:
+            response = await self._send_request("GET", url)
+            response.raise_for_status()
+            data = response.json()
+            blocks.extend(data.get("results", []))
+
+            next_cursor = data.get("next_cursor")
+            if not data.get("has_more") or not next_cursor:
+                return blocks
+            url = f"{base_url}&start_cursor={next_cursor}"
+
+    async def append_blocks(self, block_id, children, after=None):
+        """
+        向页面追加内容块（指定 after 时插入到该内容块之后）
+
+        与 NotionHandler._append_blocks_at 相同：每批最多100个，依次以前一批最后一个块为锚点，
+        失败时只从该批重试；未指定 after 时先取页面当前最后一个内容块作为去重检查的锚点。
+        """
+        if after is None:
+            after = await self._page_end_anchor(block_id)
+
+        for start, batch in self.notion._iter_block_batches(children):
+            success, last_block_id = await self._append_block_batch(block_id, batch, after)
+            if not success:
+                if start:
+                    print(f"❌ 已写入 {start}/{len(children)} 个内容块，剩余部分写入失败")
+                return False
+            after = last_block_id
+
+        print("✅ 页面内容追加成功")
+        return True
+
+    async def _page_end_anchor(self, block_id):
+        """页面当前最后一个内容块的ID（见 NotionHandler._page_end_anchor）"""
+        try:
+            blocks = await self.list_block_children(block_id)
+        except Exception as e:
+            print(f"获取页面末尾位置失败: {e}")
+            return None
+        return blocks[-1]["id"] if blocks else PAGE_START
+
+    async def _append_block_batch(self, block_id, batch, after=None):
+        """发送一批内容块，返回 (是否成功, 本批最后一个内容块的ID)；重试前先检查是否已写入"""
+        url = f"{NOTION_API}/blocks/{block_id}/children"
+        payload = self.notion._append_batch_payload(batch, after)
+        responses = []
+
+        async def attempt(attempt_index):
+            if attempt_index > 0:
+                written = await self._blocks_already_appended(block_id, batch, after)
+                if written:
+                    print("ℹ️ 内容块已在上次请求中写入，跳过重复追加")
+                    return written
+            response = await self._send_request("PATCH", url, payload)
+            responses.append(response)
+            if is_retryable_write_status(response.status_code):
+                response.raise_for_status()
+            return response
+
+        try:
+            result = await self.retry_policy.run_async(attempt, "追加页面内容")
+        except aiohttp.ClientResponseError:
+            result = responses[-1]
+
+        if isinstance(result, list):
+            return True, result[-1].get("id")
+
+        success, written = self.notion._check_append_response(result, batch)
+        if success and not written and after is not None:
+            written = await self._blocks_already_appended(block_id, batch, after)
+        return success, written[-1].get("id") if written else None
+
+    async def _blocks_already_appended(self, block_id, children, after=None):
+        """检查紧跟锚点 after 的内容块是否与 children 一致，一致时返回这些已写入的块"""
+        if after is None:
+            return None
+
+        try:
+            existing = await self.list_block_children(block_id)
+        except Exception as e:
+            print(f"检查已写入内容失败: {e}")
+            return None
+
+        return self.notion._blocks_match_at(existing, children, after)
+
+    async def delete_block(self, block_id):
+        """删除（归档）一个内容块，返回是否成功"""
+        response = await self._send_write_request("DELETE", f"{NOTION_API}/blocks/{block_id}", None, "删除内容块")
+        return response.status_code == 200
+
+    async def update_paragraph_block(self, block_id, text):
+        """原地改写一个段落块的文本，返回是否成功"""
+        payload = {"paragraph": self.notion._build_paragraph_blocks([text])[0]["paragraph"]}
+        response = await self._send_write_request("PATCH", f"{NOTION_API}/blocks/{block_id}", payload, "改写内容块")
+        return response.status_code == 200
+
+    # ---------- 消息回复 ----------
+
+    async def update_message_reply(self, page_id, llm_reply, title=None):
+        """
+        更新LLM回复和标题：先追加回复内容，成功后才更新属性
+
+        与 NotionHandler 的渐进写入相同，回复属性最后才写入：内容追加失败或中途崩溃时，
+        页面仍满足待处理条件，会在下一轮被重新处理（已写入的内容块由重试前的去重检查识别）。
+        """
+        try:
+            cleaned_reply = llm_reply.strip() if llm_reply else ""
+            if not cleaned_reply:
+                cleaned_reply = "[AI未返回有效内容]"
+
+            print(f"内容清洗: 原长度={len(llm_reply) if llm_reply else 0}, 清洗后长度={len(cleaned_reply)}")
+
+            if not await self._append_content_to_page(page_id, cleaned_reply):
+                print(f"❌ 页面内容更新失败: {page_id[:8]}...")
+                return False
+
+            if not await self.update_page(page_id, self.notion._build_reply_properties(title)):
+                print(f"❌ 回复属性更新失败: {page_id[:8]}...")
+                return False
+
+            print(f"✅ 页面内容更新成功: {page_id[:8]}...")
+            return True
+
+        except Exception as e:
+            print(f"更新Notion回复时出错: {e}")
+            return False
+
+    async def _append_content_to_page(self, page_id, content):
+        """将回复内容（分割线 + 标题 + 段落 + 时间戳）追加到页面"""
+        try:
+            paragraphs = self.notion._split_content_into_paragraphs(content)
+            children = self.notion._build_reply_header_blocks()
+            children.extend(self.notion._build_paragraph_blocks(paragraphs))
+            children.append(self.notion._build_timestamp_block())
+            return await self.append_blocks(page_id, children)
+        except Exception as e:
+            print(f"追加页面内容时出错: {e}")
+            return False
+
+    # ---------- 模板库 ----------
+
+    async def _get_page_content(self, page_id):
+        """获取页面的文本内容，请求失败时抛出异常"""
+        blocks = await self.list_block_children(page_id)
+        texts = (self.notion._extract_text_from_block(block) for block in blocks)
+        return "\n\n".join(text for text in texts if text)
+
+    async def get_templates_from_notion(self):
+        """
+        从Notion模板库数据库获取所有启用的模板，各页面内容块并行获取
+
+        返回格式与 NotionHandler.get_templates_from_notion 相同；任一页面内容获取失败时返回空字典，
+        避免以空提示词覆盖本地模板。
+        """
+        notion = self.notion
+        if not notion.template_database_id:
+            print("⚠️  未配置模板库数据库ID")
+            return {}
+
+        try:
+            pages = await self.query_database(
+                notion.template_database_id, notion._enabled_templates_payload(),
+                properties=(notion.template_name_prop, notion.template_category_prop, notion.template_description_prop)
+            )
+            entries = notion._template_entries(pages)
+
+            contents = await asyncio.gather(*(self._get_page_content(page_id) for page_id, _ in entries))
+            prompts = {page_id: content for (page_id, _), content in zip(entries, contents)}
+            return notion._build_templates_result(entries, prompts)
+
+        except Exception as e:
+            print(f"❌ 从Notion获取模板失败: {e}")
+            return {}
+
+    async def sync_template_to_notion(self, name, template_data, page_id=None):
+        """
+        将模板同步到Notion：已有页面（page_id）时异步更新，否则在线程池中用 NotionHandler 创建
+        """
+        if not self.notion.template_database_id:
+            print("⚠️  未配置模板库数据库ID")
+            return False
+
+        if page_id:
+            return await self.update_template_page(page_id, name, template_data)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.notion._create_template_page, name, template_data)
+
+    async def update_template_page(self, page_id, name, template_data):
+        """更新现有的模板页面：属性 PATCH 与内容块差异更新同时进行，两者都成功才算成功"""
+        try:
+            properties_ok, content_ok = await asyncio.gather(
+                self.update_page(page_id, self.notion._build_template_properties(template_data), "更新模板属性"),
+                self._update_page_content(page_id, template_data.get("prompt", ""))
+            )
+        except Exception as e:
+            print(f"更新模板页面失败: {e}")
+            return False
+
+        if not content_ok:
+            print(f"❌ 更新模板内容失败: {name}")
+        if properties_ok and content_ok:
+            print(f"✅ 更新模板成功: {name}")
+            return True
+        return False
+
+    async def _update_page_content(self, page_id, content):
+        """
+        更新页面内容（按内容块差异更新，计划与 NotionHandler._update_page_content 相同）
+
+        各块的原地改写并发进行，插入按顺序进行，删除最后并发进行。
+        """
+        try:
+            existing_blocks = await self.list_block_children(page_id)
+            paragraphs = self.notion._split_content_into_paragraphs(content)
+            layout, deletions = self.notion._plan_block_diff(existing_blocks, paragraphs)
+
+            updates = [(block["id"], text) for block, text, action in layout if action == "update"]
+            results = await asyncio.gather(*(self.update_paragraph_block(block_id, text) for block_id, text in updates))
+            if not all(results):
+                print(f"❌ 有 {results.count(False)} 个内容块改写失败")
+                return False
+
+            # 连续的新段落作为一组，插入到前一个保留的块之后；没有保留的块时追加到现有内容块（最后才删除）之后
+            anchor = existing_blocks[-1]["id"] if existing_blocks else PAGE_START
+            pending = []
+            runs = []
+            for block, text, action in layout:
+                if action == "insert":
+                    pending.append(text)
+                    continue
+                if pending:
+                    runs.append((anchor, pending))
+                    pending = []
+                anchor = block["id"]
+            if pending:
+                runs.append((anchor, pending))
+
+            for after, texts in runs:
+                if not await self.append_blocks(page_id, self.notion._build_paragraph_blocks(texts), after):
+                    return False
+
+            results = await asyncio.gather(*(self.delete_block(block_id) for block_id in deletions))
+            if not all(results):
+                print(f"⚠️ 有 {results.count(False)} 个旧内容块删除失败")
+                return False
+
+            return True
+
+        except Exception as e:
+            print(f"更新页面内容失败: {e}")
+            return False
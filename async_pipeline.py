@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio 流水线处理引擎
+把单条消息的处理拆成四个阶段，各阶段独立并发、以有界队列相连：
+
+    获取消息 → 准备上下文 → LLM生成 → 写回Notion
+
+- 队列容量（settings.pipeline_queue_size）提供背压：下游忙不过来时上游自动等待
+- 各阶段并发数可单独配置（如 8 个 LLM 调用、2 个 Notion 写入）
+- Notion 写入在独立阶段进行，不会占用 LLM 调用的并发名额
+
+阶段函数由调度器提供（prepare_message / generate_reply / finish_message）；
+普通函数在线程池中执行，协程函数直接在事件循环中等待。
+每个周期用 asyncio.run() 运行一次，可在 cloud_main 或 GUI 调度线程中使用。
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from retry_policy import message_deadline
+
+_DONE = object()
+
+
+class MessagePipeline:
+    """fetch → context → LLM → write 四阶段流水线"""
+
+    def __init__(self, prepare, generate, finish, settings=None, log=None, on_close=None):
+        """
+        Args:
+            prepare: 准备阶段 prepare(message) -> job
+            generate: LLM阶段 generate(job) -> job
+            finish: 写入阶段 finish(job)
+            settings: 配置的 settings 部分
+            log: 日志函数 log(message, level="info")
+            on_close: 每轮结束时在事件循环内等待的清理协程函数（如关闭 aiohttp 连接池）
+        """
+        settings = settings or {}
+        self.prepare = prepare
+        self.generate = generate
+        self.finish = finish
+        self.on_close = on_close
+        self.log = log or (lambda message, level="info": print(message))
+
+        self.queue_size = max(1, int(settings.get("pipeline_queue_size", 10)))
+        self.context_workers = max(1, int(settings.get("pipeline_context_workers", 2)))
+        self.llm_workers = max(1, int(settings.get("pipeline_llm_workers", 8)))
+        self.writer_workers = max(1, int(settings.get("pipeline_writer_workers", 2)))
+        self.message_deadline = settings.get("message_deadline", 300)
+
+        # 阻塞调用使用的线程池：每个阶段工人各占一个线程，外加获取消息的一个
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.context_workers + self.llm_workers + self.writer_workers + 1,
+            thread_name_prefix="pipeline"
+        )
+
+    def run(self, messages, should_continue=lambda: True):
+        """同步入口：运行一轮流水线直到所有消息处理完，返回派发的消息数"""
+        return asyncio.run(self.run_async(messages, should_continue))
+
+    async def run_async(self, messages, should_continue=lambda: True):
+        """
+        运行一轮流水线
+
+        Args:
+            messages: 消息的可迭代对象（可以是逐页查询的生成器）
+            should_continue: 返回False时停止获取新消息，已进入流水线的消息不再开始新阶段
+
+        Returns:
+            int: 进入流水线的消息数
+        """
+        context_queue = asyncio.Queue(self.queue_size)
+        llm_queue = asyncio.Queue(self.queue_size)
+        write_queue = asyncio.Queue(self.queue_size)
+
+        workers = []
+        workers += self._start_stage("准备", self.context_workers, self._prepare_stage,
+                                     context_queue, llm_queue, should_continue)
+        workers += self._start_stage("LLM", self.llm_workers, self._generate_stage,
+                                     llm_queue, write_queue, should_continue)
+        workers += self._start_stage("写入", self.writer_workers, self._finish_stage,
+                                     write_queue, None, should_continue)
+
+        try:
+            dispatched = await self._fetch_stage(messages, context_queue, should_continue)
+            # 按阶段顺序等待队列清空
+            for queue in (context_queue, llm_queue, write_queue):
+                await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self.on_close:
+                await self.on_close()
+
+        return dispatched
+
+    def shutdown(self):
+        """释放线程池"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---------- 阶段实现 ----------
+
+    async def _fetch_stage(self, messages, out_queue, should_continue):
+        """获取阶段：逐条取出消息（翻页查询在线程池中进行），队列满时等待"""
+        loop = asyncio.get_running_loop()
+        iterator = iter(messages)
+        dispatched = 0
+        while should_continue():
+            message = await loop.run_in_executor(self._executor, next, iterator, _DONE)
+            if message is _DONE:
+                break
+            job = {"message": message, "deadline": time.monotonic() + self.message_deadline}
+            await out_queue.put(job)
+            dispatched += 1
+        return dispatched
+
+    async def _prepare_stage(self, job):
+        prepared = await self._call(self.prepare, job, job["message"])
+        prepared["deadline"] = job["deadline"]
+        return prepared
+
+    async def _generate_stage(self, job):
+        return await self._call(self.generate, job, job)
+
+    async def _finish_stage(self, job):
+        await self._call(self.finish, job, job)
+
+    def _start_stage(self, name, count, handler, in_queue, out_queue, should_continue):
+        return [
+            asyncio.create_task(self._stage_worker(name, handler, in_queue, out_queue, should_continue))
+            for _ in range(count)
+        ]
+
+    async def _stage_worker(self, name, handler, in_queue, out_queue, should_continue):
+        """阶段工人：从上游队列取任务，处理后放入下游队列"""
+        while True:
+            job = await in_queue.get()
+            try:
+                if not should_continue():
+                    continue  # 已停止：丢弃尚未开始本阶段的任务
+                result = await handler(job)
+                if out_queue is not None and result is not None:
+                    await out_queue.put(result)
+            except Exception as e:
+                page_id = job.get("page_id") or job.get("message", {}).get("page_id", "")
+                self.log(f"{name}阶段处理消息 {page_id[:8]}... 时出错: {e}", level="error")
+            finally:
+                in_queue.task_done()
+
+    async def _call(self, func, job, *args):
+        """调用阶段函数：协程直接等待，普通函数在线程池中执行并套用消息截止时间"""
+        remaining = max(0.001, job["deadline"] - time.monotonic())
+
+        if asyncio.iscoroutinefunction(func):
+            with message_deadline(remaining):
+                return await func(*args)
+
+        def run():
+            with message_deadline(remaining):
+                return func(*args)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, run)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+filter_properties 传输量基准测试
+在本地启动一个模拟 Notion 的HTTP服务（带公式、关联、汇总等宽属性的消息数据库，
+并像 Notion 一样按 filter_properties 裁剪返回的属性），统计 get_pending_messages
+完整遍历一次积压时接收的响应字节数：不带 filter_properties 与只请求所需属性的对比。
+
+用法: python benchmarks/bench_filter_properties.py [积压消息条数]
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import HTTPAdapter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from notion_handler import NotionHandler  # noqa: E402
+from bench_message_memory import CONFIG, build_page  # noqa: E402
+
+PAGES = []
+
+
+class StandInNotion(BaseHTTPRequestHandler):
+    """模拟 Notion 的数据库Schema与分页查询接口"""
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, data):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # 数据库Schema：属性名 -> {id, type}
+        properties = {
+            name: {"id": prop["id"], "type": prop["type"]}
+            for name, prop in build_page(0)["properties"].items()
+        }
+        self._send_json({"object": "database", "properties": properties})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        wanted = set(parse_qs(urlsplit(self.path).query).get("filter_properties", []))
+
+        start = int(payload.get("start_cursor") or 0)
+        size = payload.get("page_size", 100)
+        results = []
+        for page in PAGES[start:start + size]:
+            if wanted:
+                page = dict(page, properties={
+                    name: prop for name, prop in page["properties"].items() if prop["id"] in wanted
+                })
+            results.append(page)
+
+        has_more = start + size < len(PAGES)
+        self._send_json({
+            "object": "list",
+            "results": results,
+            "has_more": has_more,
+            "next_cursor": str(start + size) if has_more else None
+        })
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RedirectAdapter(HTTPAdapter):
+    """把发往 api.notion.com 的请求转到本地模拟服务"""
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace("https://api.notion.com", self.base_url)
+        return super().send(request, **kwargs)
+
+
+def run_poll(handler, use_filter):
+    """完整遍历一次积压，返回 (接收字节数, 消息数)"""
+    handler.invalidate_schema()
+    if not use_filter:
+        handler._schema_cache[handler.database_id] = (time.monotonic(), {})  # 空Schema：不加 filter_properties
+    handler.bytes_received = 0
+    messages = handler.get_pending_messages(max_backlog=0, full_sweep=True)
+    return handler.bytes_received, len(messages)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    PAGES.extend(build_page(index) for index in range(count))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInNotion)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        config = dict(CONFIG, settings={"notion_rate_limit": 1000, "notion_rate_burst": 1000})
+        handler = NotionHandler(config)
+        handler.session.mount("https://api.notion.com", RedirectAdapter(f"http://127.0.0.1:{server.server_address[1]}"))
+
+        full_bytes, full_count = run_poll(handler, use_filter=False)
+        filtered_bytes, filtered_count = run_poll(handler, use_filter=True)
+        assert full_count == filtered_count == count
+
+        print(f"📊 积压 {count} 条消息，每页 {len(PAGES[0]['properties'])} 个属性")
+        print(f"   返回全部属性:        {full_bytes / 1024:.1f} KB")
+        print(f"   filter_properties:   {filtered_bytes / 1024:.1f} KB（含一次Schema请求）")
+        print(f"   传输量减少:          {(1 - filtered_bytes / full_bytes) * 100:.1f}%")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTTP连接池基准测试
+在本地启动一个模拟 Notion / OpenRouter 的HTTP服务，对比
+「每次调用 requests.* 新建连接」与「共享连接池 Session」处理一条消息的耗时。
+
+一条消息按真实流程计为 5 次请求：查询数据库、生成回复、生成标题、更新属性、追加内容块。
+
+用法: python benchmarks/bench_http_pool.py [消息条数]
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from http_session import create_session  # noqa: E402
+
+CALLS_PER_MESSAGE = [
+    ("POST", "/v1/databases/db/query"),
+    ("POST", "/api/v1/chat/completions"),
+    ("POST", "/api/v1/chat/completions"),
+    ("PATCH", "/v1/pages/page"),
+    ("PATCH", "/v1/blocks/page/children"),
+]
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """返回固定JSON的模拟API，支持HTTP/1.1长连接"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # 避免头与正文分两次写入时触发延迟ACK
+
+    def _reply(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        body = json.dumps({"object": "list", "results": [], "choices": []}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = do_PATCH = do_DELETE = _reply
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_messages(send, base_url, messages):
+    """按真实调用序列处理 messages 条消息，返回每条消息的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(messages):
+        for method, path in CALLS_PER_MESSAGE:
+            response = send(method, base_url + path, json={"k": "v"}, timeout=(5, 5))
+            response.raise_for_status()
+    return (time.perf_counter() - start) * 1000 / messages
+
+
+def main():
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        # 预热
+        run_messages(requests.request, base_url, 5)
+
+        per_call = run_messages(requests.request, base_url, messages)
+
+        session = create_session()
+        pooled = run_messages(session.request, base_url, messages)
+        session.close()
+
+        print(f"📊 每条消息 {len(CALLS_PER_MESSAGE)} 次请求，共 {messages} 条消息")
+        print(f"   每次新建连接: {per_call:.2f} ms/条")
+        print(f"   共享连接池:   {pooled:.2f} ms/条")
+        print(f"   延迟降低:     {(1 - pooled / per_call) * 100:.1f}%")
+        print("   注：本地明文HTTP不含TLS握手，线上 HTTPS 的差距会更大")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+待处理消息内存基准测试
+模拟逐页查询得到的积压消息（每个页面带公式、汇总、关联等宽属性），对比
+「旧版字典 + _raw_page_data 保存整个页面JSON」与「PendingMessage 只保留所需字段」
+在整个处理周期内常驻的内存（tracemalloc 统计）。
+
+用法: python benchmarks/bench_message_memory.py [消息条数]
+"""
+
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from notion_handler import NotionHandler  # noqa: E402
+
+CONFIG = {
+    "notion": {
+        "api_key": "secret_benchmark",
+        "database_id": "benchmark-db",
+        "input_property_name": "输入",
+        "output_property_name": "回复",
+        "template_property_name": "模板选择",
+        "knowledge_base_property_name": "背景",
+        "model_property_name": "模型",
+        "title_property_name": "标题"
+    },
+    "settings": {}
+}
+
+
+def rich_text(text):
+    return [{
+        "type": "text",
+        "text": {"content": text, "link": None},
+        "annotations": {"bold": False, "italic": False, "strikethrough": False,
+                        "underline": False, "code": False, "color": "default"},
+        "plain_text": text,
+        "href": None
+    }]
+
+
+def select(name):
+    return {"id": "opt-" + name, "name": name, "color": "blue"}
+
+
+def build_page(index):
+    """构造一个与Notion查询结果结构一致的页面JSON"""
+    properties = {
+        "标题": {"id": "title", "type": "title", "title": rich_text(f"问题 {index}")},
+        "输入": {"id": "in", "type": "rich_text", "rich_text": rich_text("请分析这段需求并给出实现建议。" * 20)},
+        "回复": {"id": "out", "type": "rich_text", "rich_text": []},
+        "模板选择": {"id": "tpl", "type": "select", "select": select("通用助手")},
+        "背景": {"id": "kb", "type": "select", "select": select("产品")},
+        "模型": {"id": "model", "type": "select", "select": select("claude")},
+        "会话ID": {"id": "sid", "type": "rich_text", "rich_text": rich_text(f"session-{index}")},
+        "对话轮次": {"id": "turn", "type": "number", "number": index % 7},
+    }
+    # 宽数据库中与处理无关的列
+    for column in range(4):
+        properties[f"公式{column}"] = {"id": f"f{column}", "type": "formula",
+                                      "formula": {"type": "string", "string": "计算结果" * 10}}
+        properties[f"关联{column}"] = {"id": f"r{column}", "type": "relation", "has_more": False,
+                                      "relation": [{"id": f"{index:08d}-0000-0000-0000-{n:012d}"} for n in range(5)]}
+        properties[f"汇总{column}"] = {"id": f"u{column}", "type": "rollup",
+                                      "rollup": {"type": "array", "function": "show_original",
+                                                 "array": [{"type": "rich_text", "rich_text": rich_text("汇总值")}] * 3}}
+    return {
+        "object": "page",
+        "id": f"{index:08d}-aaaa-bbbb-cccc-dddddddddddd",
+        "created_time": "2024-05-01T08:00:00.000Z",
+        "last_edited_time": "2024-05-01T08:05:00.000Z",
+        "created_by": {"object": "user", "id": "user-1"},
+        "last_edited_by": {"object": "user", "id": "user-1"},
+        "cover": None,
+        "icon": None,
+        "parent": {"type": "database_id", "database_id": "benchmark-db"},
+        "archived": False,
+        "in_trash": False,
+        "properties": properties,
+        "url": f"https://www.notion.so/page-{index}",
+        "public_url": None
+    }
+
+
+def legacy_extract(handler, page):
+    """旧版 _extract_message_data 的返回值：字段字典 + 整个原始页面"""
+    message = handler._extract_message_data(page).to_dict()
+    message["_raw_page_data"] = page
+    return message
+
+
+def measure(extract, handler, pages_json):
+    """逐条解析（与逐页查询时一样，每个页面都是新解析出的对象），返回常驻内存字节数"""
+    gc.collect()
+    tracemalloc.start()
+    messages = [extract(handler, json.loads(page)) for page in pages_json]
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert len(messages) == len(pages_json)
+    return current
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    handler = NotionHandler(CONFIG)
+    pages_json = [json.dumps(build_page(index), ensure_ascii=False) for index in range(count)]
+
+    legacy = measure(legacy_extract, handler, pages_json)
+    compact = measure(lambda h, page: h._extract_message_data(page), handler, pages_json)
+
+    print(f"📊 {count} 条待处理消息（每页 {len(build_page(0)['properties'])} 个属性）")
+    print(f"   字典 + _raw_page_data: {legacy / 1024 / 1024:.1f} MB")
+    print(f"   PendingMessage:       {compact / 1024 / 1024:.1f} MB")
+    print(f"   内存减少:             {(1 - compact / legacy) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+段落切分基准测试
+对比旧版 _split_content_into_paragraphs（字符串反复拼接、只按"。"切分）与当前实现
+在 100KB 以上长文本上的耗时与段数，并检查输出中是否有超过 Notion 长度上限的段落。
+新版在旧版能正确处理的输入（段落均不超限）上不应产生更多的段（即更多的Notion块）。
+
+输入包括：中文长文（按"。"断句）、无"。"的英文长段落、无空行的代码、无任何分隔的长串。
+
+用法: python benchmarks/bench_split_paragraphs.py [输入大小KB]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from notion_handler import NotionHandler  # noqa: E402
+
+MAX_LENGTH = 1900
+
+
+def legacy_split(content, max_length=MAX_LENGTH):
+    """旧版实现（原样保留，用于对比）"""
+    if not content:
+        return []
+    if len(content) <= max_length:
+        return [content]
+
+    paragraphs = content.split('\n\n')
+    result = []
+    current_chunk = ""
+
+    for paragraph in paragraphs:
+        if len(paragraph) > max_length:
+            if current_chunk:
+                result.append(current_chunk.strip())
+                current_chunk = ""
+
+            sentences = paragraph.split('。')
+            temp_chunk = ""
+
+            for sentence in sentences:
+                if sentence:
+                    sentence = sentence + '。' if not sentence.endswith('。') else sentence
+                    if len(temp_chunk + sentence) <= max_length:
+                        temp_chunk += sentence
+                    else:
+                        if temp_chunk:
+                            result.append(temp_chunk.strip())
+                        temp_chunk = sentence
+
+            if temp_chunk:
+                result.append(temp_chunk.strip())
+        else:
+            if len(current_chunk + '\n\n' + paragraph) <= max_length:
+                if current_chunk:
+                    current_chunk += '\n\n' + paragraph
+                else:
+                    current_chunk = paragraph
+            else:
+                if current_chunk:
+                    result.append(current_chunk.strip())
+                current_chunk = paragraph
+
+    if current_chunk:
+        result.append(current_chunk.strip())
+
+    return result
+
+
+def build_inputs(size):
+    """生成约 size 个字符的各类输入"""
+    chinese = "模型在长上下文中需要保持前后一致。" * 3 + "\n\n"
+    english = "The scheduler polls the database and dispatches each message to a worker; "
+    code = "    result = process(item, retries=3)  # keep order\n"
+    return {
+        "中文长文": (chinese * (size // len(chinese) + 1))[:size],
+        "多个短段落": (("短段落内容。" * 20 + "\n\n") * (size // 122 + 1))[:size],
+        "中文短句": ("好。" * (size // 2 + 1))[:size],
+        "英文无句号": (english * (size // len(english) + 1))[:size],
+        "代码无空行": (code * (size // len(code) + 1))[:size],
+        "无分隔长串": "x" * size,
+    }
+
+
+def measure(split, content, repeat=3):
+    """返回 (最快耗时毫秒, 段数, 最长段长度)"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = split(content)
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(chunks), max((len(chunk) for chunk in chunks), default=0)
+
+
+def main():
+    size = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 200 * 1024
+
+    # 切分只依赖实例方法本身，不需要Notion配置
+    handler = NotionHandler.__new__(NotionHandler)
+
+    def current(content):
+        return handler._split_content_into_paragraphs(content, MAX_LENGTH)
+
+    print(f"📊 输入约 {size // 1024} KB，段落上限 {MAX_LENGTH} 字符")
+    print(f"   {'输入':<10}{'旧版耗时':>12}{'新版耗时':>12}{'旧版段数':>10}{'新版段数':>10}"
+          f"{'旧版最长段':>12}{'新版最长段':>12}")
+    for name, content in build_inputs(size).items():
+        old_ms, old_count, old_max = measure(legacy_split, content)
+        new_ms, new_count, new_max = measure(current, content)
+        flag = "  ⚠️ 旧版超限" if old_max > MAX_LENGTH else ""
+        print(f"   {name:<10}{old_ms:>10.2f}ms{new_ms:>10.2f}ms{old_count:>10}{new_count:>10}"
+              f"{old_max:>12}{new_max:>12}{flag}")
+        assert new_max <= MAX_LENGTH, f"{name}: 新版输出了超过上限的段落"
+        if old_max <= MAX_LENGTH:
+            assert new_count <= old_count, f"{name}: 新版比旧版多切出了 {new_count - old_count} 段"
+
+
+if __name__ == "__main__":
+    main()
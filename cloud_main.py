@@ -7,14 +7,21 @@ Notion-LLM 云端版本 (简化版)
 
 import os
 import json
-import time
 import logging
+import hmac
+import uuid
 from datetime import datetime
 from flask import Flask, jsonify, request
 import threading
 from notion_handler import NotionHandler
 from llm_handler import LLMHandler
+from async_llm_handler import AsyncLLMHandler, AIOHTTP_AVAILABLE
+from async_notion_handler import AsyncNotionHandler
 from template_manager import TemplateManager
+from worker_pool import MessageWorkerPool, CompletedPages
+from async_pipeline import MessagePipeline
+from poll_timer import AdaptivePollTimer
+from retry_policy import message_deadline
 
 # 配置日志
 logging.basicConfig(
@@ -38,17 +45,68 @@ class CloudScheduler:
         self.notion_handler = NotionHandler(self.config)
         self.llm_handler = LLMHandler(
             self.config["openrouter"]["api_key"],
-            self.config["openrouter"]["model"]
+            self.config["openrouter"]["model"],
+            settings=self.config["settings"]
         )
         
-        # 初始化TemplateManager
-        self.template_manager = TemplateManager(notion_handler=self.notion_handler)
-        
         # 运行状态
         self.is_running = False
         self.message_count = 0
+        self.waiting_count = 0
         self.last_check = None
         self.last_template_sync = None
+        self._stats_lock = threading.Lock()
+        
+        # 调度循环的唤醒计时器：支持立即触发、立即停止与自适应轮询间隔
+        self.poll_timer = AdaptivePollTimer.from_settings(self.config["settings"])
+        
+        # 推送通知：/notify 收到的页面排队后立即唤醒调度循环，定时轮询仅作兜底
+        self._notify_lock = threading.Lock()
+        self._notified_pages = []
+        
+        # 异步客户端（USE_ASYNC_LLM / USE_ASYNC_NOTION）：基于 aiohttp，在流水线的事件循环上并发请求
+        self.async_llm_handler = None
+        self.async_notion_handler = None
+        if self.config["settings"]["use_async_llm"] or self.config["settings"]["use_async_notion"]:
+            if AIOHTTP_AVAILABLE:
+                if self.config["settings"]["use_async_llm"]:
+                    self.async_llm_handler = AsyncLLMHandler(
+                        self.config["openrouter"]["api_key"],
+                        self.config["openrouter"]["model"],
+                        settings=self.config["settings"]
+                    )
+                if self.config["settings"]["use_async_notion"]:
+                    self.async_notion_handler = AsyncNotionHandler(self.notion_handler)
+                self.config["settings"]["pipeline_mode"] = True  # 异步客户端只在流水线中使用
+            else:
+                logger.warning("⚠️ 未安装 aiohttp，USE_ASYNC_LLM / USE_ASYNC_NOTION 不生效，继续使用同步客户端")
+        
+        # 初始化TemplateManager（USE_ASYNC_NOTION 时模板同步使用专用的异步客户端，与流水线的事件循环互不影响）
+        self.template_manager = TemplateManager(
+            notion_handler=self.notion_handler,
+            async_notion_handler=AsyncNotionHandler(self.notion_handler) if self.async_notion_handler else None
+        )
+        
+        # 流水线模式（PIPELINE_MODE）：准备/LLM/写入分阶段并发处理
+        self.pipeline = None
+        if self.config["settings"]["pipeline_mode"]:
+            self.pipeline = MessagePipeline(
+                self.prepare_message,
+                self.generate_reply_async if self.async_llm_handler else self.generate_reply,
+                self.finish_message_async if self.async_notion_handler else self.finish_message,
+                self.config["settings"], log=self._log, on_close=self._close_async_clients
+            )
+        
+        # 最近处理完成的页面：过期的待处理列表中再次出现时跳过（settings.completed_page_ttl）
+        self.completed_pages = CompletedPages.from_settings(self.config["settings"])
+        
+        # 并发处理池（max_concurrency > 1 时启用，否则逐条处理；流水线模式下不使用）
+        self.worker_pool = None
+        max_concurrency = self.config["settings"]["max_concurrency"]
+        if max_concurrency > 1 and not self.pipeline:
+            self.worker_pool = MessageWorkerPool(
+                self.process_single_message, max_concurrency, self._emit_log, completed=self.completed_pages
+            )
         
         logger.info("☁️ 云端调度器初始化完成")
         logger.info("🎯 [版本标识] 简化云端版本 v3.0 - 专注核心功能")
@@ -81,14 +139,49 @@ class CloudScheduler:
             },
             "settings": {
                 "check_interval": int(os.getenv("CHECK_INTERVAL", "120")),
+                "min_check_interval": int(os.getenv("MIN_CHECK_INTERVAL", "5")),
+                "max_check_interval": int(os.getenv("MAX_CHECK_INTERVAL", "600")),
                 "max_retries": int(os.getenv("MAX_RETRIES", "3")),
+                "message_deadline": int(os.getenv("MESSAGE_DEADLINE", "300")),
                 "request_timeout": int(os.getenv("REQUEST_TIMEOUT", "30")),
+                "connect_timeout": int(os.getenv("CONNECT_TIMEOUT", "10")),
+                "llm_timeout": int(os.getenv("LLM_TIMEOUT", "60")),
+                "stream_responses": os.getenv("STREAM_RESPONSES", "false").lower() == "true",
+                "stream_idle_timeout": int(os.getenv("STREAM_IDLE_TIMEOUT", "30")),
+                "progressive_write": os.getenv("PROGRESSIVE_WRITE", "false").lower() == "true",
+                "stream_flush_interval": float(os.getenv("STREAM_FLUSH_INTERVAL", "1.0")),
+                "http_pool_maxsize": int(os.getenv("HTTP_POOL_MAXSIZE", "0")),
+                "http_keep_alive": os.getenv("HTTP_KEEP_ALIVE", "true").lower() == "true",
+                "notion_rate_limit": float(os.getenv("NOTION_RATE_LIMIT", "3")),
+                "rate_limit_retries": int(os.getenv("RATE_LIMIT_RETRIES", "5")),
                 "auto_generate_title": os.getenv("AUTO_TITLE", "true").lower() == "true",
                 "title_max_length": int(os.getenv("TITLE_MAX_LENGTH", "20")),
                 "title_min_length": int(os.getenv("TITLE_MIN_LENGTH", "10")),
+                "title_timeout": int(os.getenv("TITLE_TIMEOUT", "15")),
+                "title_generation_mode": os.getenv("TITLE_MODE", "parallel"),
                 "model_mapping": self.load_model_mapping(),
                 "auto_sync_templates": os.getenv("AUTO_SYNC_TEMPLATES", "true").lower() == "true",
-                "sync_interval_hours": int(os.getenv("SYNC_INTERVAL_HOURS", "24"))
+                "sync_interval_hours": int(os.getenv("SYNC_INTERVAL_HOURS", "24")),
+                "template_fetch_concurrency": int(os.getenv("TEMPLATE_FETCH_CONCURRENCY", "3")),
+                "template_full_sync_hours": float(os.getenv("TEMPLATE_FULL_SYNC_HOURS", "24")),
+                "template_push_concurrency": int(os.getenv("TEMPLATE_PUSH_CONCURRENCY", "3")),
+                "query_page_size": int(os.getenv("QUERY_PAGE_SIZE", "100")),
+                "max_backlog": int(os.getenv("MAX_BACKLOG", "500")),
+                "schema_cache_ttl": int(os.getenv("SCHEMA_CACHE_TTL", "300")),
+                "max_concurrency": int(os.getenv("MAX_CONCURRENCY", "1")),
+                "completed_page_ttl": int(os.getenv("COMPLETED_PAGE_TTL", "600")),
+                "pipeline_mode": os.getenv("PIPELINE_MODE", "false").lower() == "true",
+                "pipeline_context_workers": int(os.getenv("PIPELINE_CONTEXT_WORKERS", "2")),
+                "pipeline_llm_workers": int(os.getenv("PIPELINE_LLM_WORKERS", "8")),
+                "pipeline_writer_workers": int(os.getenv("PIPELINE_WRITER_WORKERS", "2")),
+                "pipeline_queue_size": int(os.getenv("PIPELINE_QUEUE_SIZE", "10")),
+                "use_async_llm": os.getenv("USE_ASYNC_LLM", "false").lower() == "true",
+                "async_pool_limit": int(os.getenv("ASYNC_POOL_LIMIT", "100")),
+                "use_async_notion": os.getenv("USE_ASYNC_NOTION", "false").lower() == "true",
+                "incremental_poll": os.getenv("INCREMENTAL_POLL", "false").lower() == "true",
+                "full_sweep_interval": int(os.getenv("FULL_SWEEP_INTERVAL", "600")),
+                "poll_state_file": os.getenv("POLL_STATE_FILE", "poll_state.json"),
+                "notify_token": os.getenv("NOTIFY_TOKEN", "")
             }
         }
         
@@ -138,67 +231,205 @@ class CloudScheduler:
         self.is_running = True
         logger.info("☁️ 云端调度器启动")
         
+        self.poll_timer.reset()
         while self.is_running:
             try:
-                self.check_and_process_messages()
-                time.sleep(self.config["settings"]["check_interval"])
+                # 推送的页面优先处理；轮询进行中收到的推送会穿插在积压消息之间
+                self.process_notified_messages()
+                if self.poll_timer.poll_due():
+                    processed = self.check_and_process_messages()
+                    # 有积压时缩短间隔，空闲时逐步拉长
+                    self.poll_timer.schedule_next(has_backlog=bool(processed))
+                
+                # 等待下次检查；trigger()、推送通知或 stop() 会立即唤醒
+                if not self.poll_timer.wait():
+                    break
             except KeyboardInterrupt:
                 logger.info("收到停止信号")
                 break
             except Exception as e:
                 logger.error(f"运行时错误: {e}")
-                time.sleep(30)  # 出错后等待30秒再重试
+                self.poll_timer.schedule_next(delay=30)  # 出错后等待30秒再重试
+        
+        if self.pipeline:
+            self.pipeline.shutdown()
+    
+    def trigger(self):
+        """立即发起一轮检查"""
+        self.poll_timer.trigger()
+    
+    def notify(self, page_id):
+        """
+        接收页面推送通知，加入待处理队列并唤醒调度循环
+        
+        Returns:
+            bool: 是否新加入队列（已在队列、处理中或刚处理完时返回False）
+        """
+        if self._is_handled(page_id):
+            return False
+        with self._notify_lock:
+            if page_id in self._notified_pages:
+                return False
+            self._notified_pages.append(page_id)
+        self.poll_timer.wake()
+        return True
+    
+    def process_notified_messages(self):
+        """处理推送通知排队的页面（调度循环空闲时）"""
+        return self._dispatch_messages(self._take_notified_messages())
+    
+    def _take_notified_messages(self):
+        """取出推送通知排队的页面，逐个读取最新状态，产出仍需处理的消息（生成器）"""
+        with self._notify_lock:
+            page_ids, self._notified_pages = self._notified_pages, []
+        
+        for page_id in page_ids:
+            if not self.is_running:
+                break
+            if self._is_handled(page_id):
+                continue
+            
+            message = self.notion_handler.get_message(page_id)
+            if not message:
+                self._log(f"推送的页面无需处理: {page_id[:8]}...")
+                continue
+            
+            self._log(f"📨 收到推送，立即处理: {page_id[:8]}...")
+            yield message
+    
+    def _with_notified(self, messages):
+        """
+        在积压消息之间穿插推送通知排队的页面（生成器）
+        
+        取下一条积压消息（可能要翻页查询）之前，先产出期间收到推送的页面，
+        推送的页面不必等整轮积压处理完。
+        """
+        iterator = iter(messages)
+        while True:
+            yield from self._take_notified_messages()
+            message = next(iterator, None)
+            if message is None:
+                return
+            yield message
+    
+    def _is_handled(self, page_id):
+        """页面正在处理或刚处理完成（不应再次处理）"""
+        if self.worker_pool:
+            return self.worker_pool.is_handled(page_id)
+        return page_id in self.completed_pages
+    
+    def _unhandled(self, messages):
+        """
+        跳过本轮已出现过、正在处理或刚处理完成的页面（生成器）
+        
+        推送与积压列表可能包含同一页面；列表也可能早于回复写入，
+        页面处理完后仍会出现在稍后取到的列表中。
+        """
+        seen = set()
+        for message in messages:
+            page_id = message["page_id"]
+            if page_id in seen or self._is_handled(page_id):
+                continue
+            seen.add(page_id)
+            yield message
     
     def check_and_process_messages(self):
-        """检查并处理消息"""
+        """检查并处理消息，返回本轮派发/处理的消息数"""
         try:
             self.last_check = datetime.now()
             
             # 检查模板库定期同步
             self.check_template_sync_schedule()
             
-            # 获取等待处理的消息
-            pending_messages = self.notion_handler.get_pending_messages()
-            waiting_count = self.notion_handler.get_waiting_count()
+            # 边翻页边处理：拿到第一页结果即开始处理，无需等待整个积压列表
+            processed = self._dispatch_messages(self._with_notified(self.notion_handler.iter_pending_messages()))
             
-            if not pending_messages:
-                if waiting_count > 0:
-                    logger.info(f"等待条件满足: {waiting_count}条")
-                else:
-                    logger.info("没有待处理的消息")
-                return
+            # 等待数量与待处理消息来自同一次查询（增量轮询时按本轮看到的页面增减，全量核对时整体校正）
+            self.waiting_count = self.notion_handler.last_waiting_count
             
-            logger.info(f"等待条件满足: {waiting_count}条，待处理: {len(pending_messages)}条")
+            if not processed:
+                if self.waiting_count > 0:
+                    self._log(f"等待条件满足: {self.waiting_count}条")
+                else:
+                    self._log("没有待处理的消息")
+                return 0
             
-            # 处理消息
-            for message in pending_messages:
-                if not self.is_running:
-                    break
-                self.process_single_message(message)
+            if self.worker_pool:
+                self._log(f"本轮共派发: {processed}条（处理中: {self.worker_pool.in_flight_count}条）")
+            else:
+                self._log(f"本轮共处理: {processed}条")
+            return processed
                 
         except Exception as e:
-            logger.error(f"检查消息时出错: {e}")
+            self._log(f"检查消息时出错: {e}", level="error")
+            return 0
+    
+    def _dispatch_messages(self, messages):
+        """处理一批消息（流水线、并发池或逐条），返回派发/处理的消息数"""
+        messages = self._unhandled(messages)
+        if self.pipeline:
+            # 流水线模式：各阶段并发执行，本批消息全部处理完后返回
+            return self.pipeline.run(messages, lambda: self.is_running)
+        
+        processed = 0
+        for message in messages:
+            if not self.is_running:
+                break
+            if processed == 0:
+                self._log("发现待处理消息，开始处理")
+            if self.worker_pool:
+                # 并发模式：派发给工人，全忙时在此等待空位
+                if not self.worker_pool.dispatch(message, lambda: self.is_running):
+                    continue
+            else:
+                self.process_single_message(message)
+            processed += 1
+        return processed
     
     def process_single_message(self, message):
+        """处理单条消息（所有重试都受单条消息截止时间 settings.message_deadline 约束）"""
+        with message_deadline(self.config["settings"]["message_deadline"]):
+            self._process_single_message(message)
+    
+    def _process_single_message(self, message):
         """处理单条消息"""
         try:
-            page_id = message["page_id"]
-            content = message["content"]
-            template_choice = message.get("template_choice", "")
-            tags = message.get("tags", [])
-            model_choice = message.get("model_choice", "")
-            
-            logger.info(f"处理消息: {template_choice} - {content[:50]}...")
+            job = self.prepare_message(message)
             
-            # 获取知识库上下文
-            knowledge_context = self.notion_handler.get_context_from_knowledge_base(tags)
+            # 渐进写入：模型生成过程中即把完整段落写入页面（使用流式输出）
+            if self.config["settings"]["progressive_write"]:
+                job["writer"] = self.notion_handler.begin_incremental_reply(job["page_id"])
             
-            # 获取基础系统提示词
-            base_system_prompt = self._get_system_prompt(template_choice)
+            self.generate_reply(job)
+            self.finish_message(job)
             
-            # 组合系统提示词
-            if knowledge_context:
-                system_prompt = f"""{base_system_prompt}
+        except Exception as e:
+            self._log(f"处理消息时出错: {e}", level="error")
+    
+    def prepare_message(self, message):
+        """
+        准备阶段：加载知识库上下文、组合系统提示词并确定模型
+        
+        Returns:
+            dict: 处理任务，供 generate_reply / finish_message 继续使用
+        """
+        page_id = message["page_id"]
+        content = message["content"]
+        template_choice = message.get("template_choice", "")
+        tags = message.get("tags", [])
+        model_choice = message.get("model_choice", "")
+        
+        self._log(f"处理消息: {template_choice} - {content[:50]}...")
+        
+        # 获取知识库上下文
+        knowledge_context = self.notion_handler.get_context_from_knowledge_base(tags)
+        
+        # 获取基础系统提示词
+        base_system_prompt = self._get_system_prompt(template_choice)
+        
+        # 组合系统提示词
+        if knowledge_context:
+            system_prompt = f"""{base_system_prompt}
 
 ---
 
@@ -209,52 +440,134 @@ class CloudScheduler:
 
 ## 执行指令
 请在严格遵循上述角色设定和输出格式的前提下，充分利用补充背景知识来增强回答质量。"""
-            else:
-                system_prompt = base_system_prompt
-            
-            # 确定模型
-            model_mapping = self.config["settings"]["model_mapping"]
-            override_model_id = model_mapping.get(model_choice)
+        else:
+            system_prompt = base_system_prompt
+        
+        # 确定模型
+        model_mapping = self.config["settings"]["model_mapping"]
+        override_model_id = model_mapping.get(model_choice)
+        
+        return {
+            "page_id": page_id,
+            "content": content,
+            "template_choice": template_choice,
+            "system_prompt": system_prompt,
+            "override_model": override_model_id,
+            "writer": None
+        }
+    
+    def generate_reply(self, job):
+        """LLM阶段：生成回复与标题，结果写回 job 的 success / reply / title"""
+        writer = job["writer"]
+        on_delta = writer.on_delta if writer else None
+        
+        # 处理消息
+        auto_title = self.config["settings"]["auto_generate_title"]
+        if auto_title:
+            success, llm_reply, generated_title = self.llm_handler.process_with_template_and_title(
+                job["content"], 
+                job["system_prompt"],
+                self.config["settings"]["title_max_length"],
+                self.config["settings"]["title_min_length"],
+                override_model=job["override_model"],
+                on_delta=on_delta
+            )
+        else:
+            success, llm_reply = self.llm_handler.send_message(
+                job["content"], 
+                job["system_prompt"],
+                override_model=job["override_model"],
+                on_delta=on_delta
+            )
+            generated_title = None
+        
+        job["success"] = success
+        job["reply"] = llm_reply
+        job["title"] = generated_title
+        return job
+    
+    async def generate_reply_async(self, job):
+        """LLM阶段的异步版本（USE_ASYNC_LLM）：在事件循环上并发请求，不占用线程"""
+        if self.config["settings"]["auto_generate_title"]:
+            success, llm_reply, generated_title = await self.async_llm_handler.process_with_template_and_title(
+                job["content"], 
+                job["system_prompt"],
+                self.config["settings"]["title_max_length"],
+                self.config["settings"]["title_min_length"],
+                override_model=job["override_model"]
+            )
+        else:
+            success, llm_reply = await self.async_llm_handler.send_message(
+                job["content"], 
+                job["system_prompt"],
+                override_model=job["override_model"]
+            )
+            generated_title = None
+        
+        job["success"] = success
+        job["reply"] = llm_reply
+        job["title"] = generated_title
+        return job
+    
+    def finish_message(self, job):
+        """写入阶段：把回复（或错误信息）写回Notion"""
+        page_id = job["page_id"]
+        template_choice = job["template_choice"]
+        llm_reply = job["reply"]
+        writer = job["writer"]
+        
+        if job["success"]:
+            # 更新Notion页面
+            update_success = self.notion_handler.update_message_reply(
+                page_id, llm_reply, job["title"], writer=writer
+            )
             
-            # 处理消息
-            auto_title = self.config["settings"]["auto_generate_title"]
-            if auto_title:
-                success, llm_reply, generated_title = self.llm_handler.process_with_template_and_title(
-                    content, 
-                    system_prompt,
-                    self.config["settings"]["title_max_length"],
-                    self.config["settings"]["title_min_length"],
-                    override_model=override_model_id
-                )
+            if update_success:
+                self._increment_message_count()
+                self._log(f"✅ 消息处理成功: {template_choice}")
             else:
-                success, llm_reply = self.llm_handler.send_message(
-                    content, 
-                    system_prompt,
-                    override_model=override_model_id
-                )
-                generated_title = None
-            
-            if success:
-                # 更新Notion页面
-                update_success = self.notion_handler.update_message_reply(
-                    page_id, llm_reply, generated_title
-                )
-                
-                if update_success:
-                    self.message_count += 1
-                    logger.info(f"✅ 消息处理成功: {template_choice}")
-                else:
-                    logger.error(f"❌ 更新Notion失败: {template_choice}")
+                self._log(f"❌ 更新Notion失败: {template_choice}", level="error")
+        else:
+            self._log(f"❌ LLM处理失败: {llm_reply}", level="error")
+            # 写入错误信息
+            error_reply = f"处理失败：{llm_reply}"
+            self.notion_handler.update_message_reply(page_id, error_reply, "处理失败", writer=writer)
+        self.completed_pages.add(page_id)
+    
+    async def finish_message_async(self, job):
+        """写入阶段的异步版本（USE_ASYNC_NOTION）：先追加回复内容，成功后再更新属性"""
+        notion = self.async_notion_handler
+        if job["success"]:
+            if await notion.update_message_reply(job["page_id"], job["reply"], job["title"]):
+                self._increment_message_count()
+                self._log(f"✅ 消息处理成功: {job['template_choice']}")
             else:
-                logger.error(f"❌ LLM处理失败: {llm_reply}")
-                # 写入错误信息
-                error_reply = f"处理失败：{llm_reply}"
-                self.notion_handler.update_message_reply(page_id, error_reply, "处理失败")
-            
-            time.sleep(2)  # 避免API限制
-            
-        except Exception as e:
-            logger.error(f"处理消息时出错: {e}")
+                self._log(f"❌ 更新Notion失败: {job['template_choice']}", level="error")
+        else:
+            self._log(f"❌ LLM处理失败: {job['reply']}", level="error")
+            await notion.update_message_reply(job["page_id"], f"处理失败：{job['reply']}", "处理失败")
+        self.completed_pages.add(job["page_id"])
+    
+    async def _close_async_clients(self):
+        """每轮流水线结束时关闭异步客户端的连接池"""
+        for client in (self.async_llm_handler, self.async_notion_handler):
+            if client:
+                await client.close()
+    
+    def _increment_message_count(self):
+        """线程安全地累加已处理消息数"""
+        with self._stats_lock:
+            self.message_count += 1
+    
+    def _log(self, message, level="info"):
+        """输出日志；并发模式下按消息派发顺序输出"""
+        if self.worker_pool:
+            self.worker_pool.log(level, message)
+        else:
+            self._emit_log(level, message)
+    
+    def _emit_log(self, level, message):
+        getattr(logger, level)(message)
     
     def _get_system_prompt(self, template_choice):
         """获取系统提示词"""
@@ -320,6 +633,9 @@ class CloudScheduler:
     def stop(self):
         """停止调度器"""
         self.is_running = False
+        self.poll_timer.cancel()
+        if self.worker_pool:
+            self.worker_pool.shutdown(wait=False)
         logger.info("调度器已停止")
     
     def get_status(self):
@@ -327,6 +643,12 @@ class CloudScheduler:
         return {
             "is_running": self.is_running,
             "message_count": self.message_count,
+            "waiting_count": self.waiting_count,
+            "notified_pending": len(self._notified_pages),
+            "next_check_in": round(self.poll_timer.seconds_until_next_poll, 1),
+            "in_flight": self.worker_pool.in_flight_count if self.worker_pool else 0,
+            "notion_rate_limit": self.notion_handler.rate_limiter.get_stats(),
+            "notion_bytes_received": self.notion_handler.bytes_received,
             "last_check": self.last_check.isoformat() if self.last_check else None,
             "last_template_sync": self.last_template_sync.isoformat() if self.last_template_sync else None
         }
@@ -350,7 +672,8 @@ def start_scheduler():
     global scheduler
     try:
         if scheduler and scheduler.is_running:
-            return jsonify({"success": False, "message": "调度器已在运行"})
+            scheduler.trigger()
+            return jsonify({"success": True, "message": "调度器已在运行，已触发立即检查"})
         
         scheduler = CloudScheduler()
         
@@ -375,6 +698,47 @@ def stop_scheduler():
         return jsonify({"success": True, "message": "调度器已停止"})
     return jsonify({"success": False, "message": "调度器未运行"})
 
+@app.route('/trigger', methods=['POST'])
+def trigger_check():
+    """立即触发一轮消息检查"""
+    global scheduler
+    if scheduler and scheduler.is_running:
+        scheduler.trigger()
+        return jsonify({"success": True, "message": "已触发立即检查"})
+    return jsonify({"success": False, "message": "调度器未运行"})
+
+@app.route('/notify', methods=['POST'])
+def notify_page():
+    """
+    接收页面变更通知（Notion 自动化 webhook 或本地转发），立即处理该页面
+    
+    请求体支持 {"page_id": "..."} 或 Notion webhook 格式 {"data": {"id": "..."}}；
+    配置了 NOTIFY_TOKEN 时需通过 X-Notify-Token 请求头或 token 查询参数提供。
+    """
+    global scheduler
+    if not scheduler or not scheduler.is_running:
+        return jsonify({"success": False, "message": "调度器未运行"}), 503
+    
+    token = scheduler.config["settings"]["notify_token"]
+    if token:
+        provided = request.headers.get("X-Notify-Token") or request.args.get("token", "")
+        if not hmac.compare_digest(provided, token):
+            return jsonify({"success": False, "message": "令牌无效"}), 401
+    
+    data = request.get_json(silent=True) or {}
+    raw_page_id = data.get("page_id") or (data.get("data") or {}).get("id") or data.get("id")
+    try:
+        page_id = str(uuid.UUID(str(raw_page_id).strip()))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "无效的 page_id"}), 400
+    
+    queued = scheduler.notify(page_id)
+    return jsonify({
+        "success": True,
+        "queued": queued,
+        "message": "已加入处理队列" if queued else "该页面已在队列或处理中"
+    }), 202
+
 @app.route('/status', methods=['GET'])
 def get_status():
     """获取状态"""
@@ -596,7 +596,8 @@ class NotionLLMGUI:
                 from llm_handler import LLMHandler
                 llm = LLMHandler(
                     self.config["openrouter"]["api_key"],
-                    self.config["openrouter"]["model"]
+                    self.config["openrouter"]["model"],
+                    settings=self.config.get("settings", {})
                 )
                 llm_success, llm_msg = llm.test_connection()
                 
@@ -748,6 +749,10 @@ class NotionLLMGUI:
                     if success:
                         self.root.after(0, lambda: self.add_log(f"模板同步成功: {message}"))
                         self.root.after(0, lambda: messagebox.showinfo("成功", message))
+                        # 模板选项已更新，立即检查一轮待处理消息
+                        scheduler = getattr(self, 'scheduler', None)
+                        if self.is_running and scheduler and hasattr(scheduler, 'trigger'):
+                            scheduler.trigger()
                     else:
                         self.root.after(0, lambda: self.add_log(f"模板同步失败: {message}"))
                         self.root.after(0, lambda: messagebox.showerror("失败", message))
@@ -1123,7 +1128,11 @@ class NotionLLMGUI:
         """将本地模板同步到Notion"""
         def sync_thread():
             try:
-                success, message = self.template_manager.sync_to_notion()
+                def on_progress(done, total, name, ok):
+                    status = "✅" if ok else "❌"
+                    self.root.after(0, lambda: self.add_log(f"{status} 推送模板 ({done}/{total}): {name}"))
+                
+                success, message = self.template_manager.sync_to_notion(progress_callback=on_progress)
                 if success:
                     self.root.after(0, lambda: messagebox.showinfo("同步成功", message))
                     self.root.after(0, lambda: self.add_log(f"向Notion同步模板成功"))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共享HTTP连接池
+为 NotionHandler 与 LLMHandler 提供复用 TCP/TLS 连接的 requests.Session，
+避免每次API调用都重新建立连接和握手。
+"""
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+# 默认连接池参数
+DEFAULT_POOL_CONNECTIONS = 4    # 缓存的主机连接池数量（api.notion.com、openrouter.ai ...）
+DEFAULT_POOL_MAXSIZE = 10       # 每个主机最多保持的连接数（下限；未配置时按并发数计算，见 get_pool_maxsize）
+DEFAULT_CONNECT_TIMEOUT = 10    # 建立连接的超时（秒）
+DEFAULT_READ_TIMEOUT = 30       # 读取响应的超时（秒）
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def create_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+                   pool_block=True, keep_alive=True):
+    """
+    创建一个带连接池的Session
+
+    Args:
+        pool_connections: 缓存的主机连接池数量
+        pool_maxsize: 每个主机的最大连接数
+        pool_block: 连接数达到上限时是否等待空闲连接（即强制每主机连接上限）
+        keep_alive: 是否保持长连接
+
+    Returns:
+        requests.Session: 配置好的Session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    if not keep_alive:
+        session.headers["Connection"] = "close"
+
+    return session
+
+
+def get_pool_maxsize(settings=None):
+    """
+    每个主机的最大连接数：settings.http_pool_maxsize，未配置（或为0）时按并发数计算
+
+    pool_block=True 时连接数达到上限的请求会一直等待空闲连接，因此上限不能小于同时进行的请求数：
+    回复请求（流水线模式下为各阶段工人数之和，否则为 settings.max_concurrency）
+    加上标题线程池（LLMHandler._get_title_executor，回复数的2倍），且不低于 DEFAULT_POOL_MAXSIZE。
+    """
+    settings = settings or {}
+    configured = int(settings.get("http_pool_maxsize") or 0)
+    if configured > 0:
+        return configured
+
+    if settings.get("pipeline_mode", False):
+        concurrent_replies = int(settings.get("pipeline_llm_workers", 8))
+        workers = (concurrent_replies + int(settings.get("pipeline_context_workers", 2))
+                   + int(settings.get("pipeline_writer_workers", 2)))
+    else:
+        concurrent_replies = workers = int(settings.get("max_concurrency", 1))
+    title_workers = max(2, concurrent_replies * 2)
+    return max(DEFAULT_POOL_MAXSIZE, workers + title_workers)
+
+
+def get_session(settings=None):
+    """
+    获取按配置共享的Session（同一组连接池参数在进程内只创建一次）
+
+    读取的配置项（均位于 settings 下，可选）：
+        http_pool_connections, http_pool_maxsize（见 get_pool_maxsize）, http_pool_block, http_keep_alive
+    """
+    settings = settings or {}
+    key = (
+        int(settings.get("http_pool_connections", DEFAULT_POOL_CONNECTIONS)),
+        get_pool_maxsize(settings),
+        bool(settings.get("http_pool_block", True)),
+        bool(settings.get("http_keep_alive", True))
+    )
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = create_session(*key)
+            _sessions[key] = session
+        return session
+
+
+def get_timeout(settings=None, read_timeout=None):
+    """
+    根据配置计算 (连接超时, 读取超时)
+
+    Args:
+        settings: 配置中的 settings 部分
+        read_timeout: 显式指定的读取超时；为空时使用 settings.request_timeout
+
+    Returns:
+        tuple: requests 可直接使用的 (connect, read) 超时
+    """
+    settings = settings or {}
+    connect_timeout = settings.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+    if read_timeout is None:
+        read_timeout = settings.get("request_timeout", DEFAULT_READ_TIMEOUT)
+    return (connect_timeout, read_timeout)
+
+
+def close_all_sessions():
+    """关闭所有共享Session（释放连接池）"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
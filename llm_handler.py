@@ -1,10 +1,103 @@
 import requests
+import contextvars
 import json
+import re
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from http_session import get_session, get_timeout
+from retry_policy import RetryPolicy
+
+# 合并模式下，标题行的分隔标记
+TITLE_MARKER = "【标题】"
+_TITLE_LINE_PATTERN = re.compile(
+    r"^[ \t>*#_`]*" + re.escape(TITLE_MARKER) + r"[*_`]*[ \t]*[:：]?[ \t]*(?P<title>.*)$",
+    re.MULTILINE
+)
+
+# parse_stream_line 遇到 "data: [DONE]" 时的返回值
+STREAM_DONE = object()
+
+class LLMStreamError(Exception):
+    """流式响应中返回的错误事件"""
+
+
+def parse_stream_line(line):
+    """
+    解析 server-sent events 中的一行（同步与异步流式请求共用）
+    
+    Returns:
+        dict: 事件数据；空行、保活注释与无法解析的行返回 None，流结束时返回 STREAM_DONE
+    
+    Raises:
+        LLMStreamError: 流中返回了错误事件
+    """
+    line = line.strip()
+    # 空行为事件分隔，":"开头为保活注释（如 ": OPENROUTER PROCESSING"）
+    if not line or line.startswith(b":") or not line.startswith(b"data:"):
+        return None
+    
+    data = line[5:].strip()
+    if data == b"[DONE]":
+        return STREAM_DONE
+    
+    try:
+        event = json.loads(data.decode("utf-8"))
+    except ValueError:
+        return None
+    
+    if event.get("error"):
+        error = event["error"]
+        raise LLMStreamError(error.get("message", str(error)) if isinstance(error, dict) else str(error))
+    return event
+
+
+class StreamStats:
+    """一次流式调用的统计：首字延迟、总耗时与生成速度（同步与异步流式请求共用）"""
+    
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_token_at = None
+        self.chunk_count = 0
+        self.usage = None
+    
+    def deltas(self, event):
+        """取出事件中的增量 (kind, text)，kind 为 "content" 或 "reasoning"，并计入统计"""
+        if event.get("usage"):
+            self.usage = event["usage"]
+        
+        choices = event.get("choices") or []
+        if not choices:
+            return
+        delta = choices[0].get("delta") or {}
+        
+        for kind in ("reasoning", "content"):
+            text = delta.get(kind)
+            if text:
+                if self.first_token_at is None:
+                    self.first_token_at = time.monotonic()
+                self.chunk_count += 1
+                yield kind, text
+    
+    def result(self):
+        """流结束时的统计字典"""
+        finished = time.monotonic()
+        # 优先使用服务端统计的token数，缺失时以增量块数近似
+        tokens = (self.usage or {}).get("completion_tokens") or self.chunk_count
+        generation_time = finished - (self.first_token_at or finished)
+        return {
+            "time_to_first_token": round(self.first_token_at - self.started, 3) if self.first_token_at else None,
+            "total_time": round(finished - self.started, 3),
+            "completion_tokens": tokens,
+            "tokens_estimated": not (self.usage or {}).get("completion_tokens"),
+            "tokens_per_second": round(tokens / generation_time, 2) if generation_time > 0 else None
+        }
+
 
 class LLMHandler:
     """处理与OpenRouter API的所有交互"""
     
-    def __init__(self, api_key, model="anthropic/claude-3.5-sonnet"):
+    def __init__(self, api_key, model="anthropic/claude-3.5-sonnet", settings=None):
         self.api_key = api_key
         self.model = model
         self.base_url = "https://openrouter.ai/api/v1/chat/completions"
@@ -12,66 +105,106 @@ class LLMHandler:
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        
+        # 共享连接池：复用到 openrouter.ai 的长连接
+        self.settings = settings or {}
+        self.session = get_session(self.settings)
+        self.timeout = get_timeout(self.settings, read_timeout=self.settings.get("llm_timeout", 60))
+        self.short_timeout = get_timeout(self.settings, read_timeout=10)
+        
+        # 流式输出（SSE）：按空闲超时而非总超时判断失败
+        self.stream_responses = self.settings.get("stream_responses", False)
+        self.stream_idle_timeout = self.settings.get("stream_idle_timeout", 30)
+        self._local = threading.local()
+        
+        # 对超时、429与5xx按 settings.max_retries 重试
+        self.retry_policy = RetryPolicy.from_settings(self.settings)
+        
+        # 标题生成与回复并行执行所用的线程池（按需创建）
+        self.title_timeout = self.settings.get("title_timeout", 15)
+        self._title_executor = None
+        self._title_executor_lock = threading.Lock()
     
-    def send_message(self, message_content, system_prompt=None, override_model=None):
-        """发送消息给LLM并获取回复"""
-        try:
-            # 确定本次调用使用的模型
-            current_model = override_model or self.model
+    def send_message(self, message_content, system_prompt=None, override_model=None, timeout=None, stream=None, on_delta=None):
+        """
+        发送消息给LLM并获取回复
+        
+        Args:
+            timeout: 本次调用的读取超时，默认 settings.llm_timeout（流式模式下为空闲超时）
+            stream: 是否使用流式输出，默认 settings.stream_responses；传入 on_delta 时自动启用
+            on_delta: 流式增量回调 on_delta(kind, text)，kind 为 "content" 或 "reasoning"
+        """
+        success, message = self._request_completion(
+            message_content, system_prompt, override_model, timeout, stream=stream, on_delta=on_delta
+        )
+        if not success:
+            return False, message
+        
+        return True, self._select_reply(message)
+    
+    def _build_payload(self, message_content, system_prompt=None, override_model=None):
+        """构建 chat/completions 请求数据"""
+        # 确定本次调用使用的模型
+        current_model = override_model or self.model
 
-            # 构建消息
-            messages = []
-            
-            # 如果有系统提示，添加系统消息
-            if system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": system_prompt
-                })
-            
-            # 添加用户消息
+        # 构建消息
+        messages = []
+        
+        # 如果有系统提示，添加系统消息
+        if system_prompt:
             messages.append({
-                "role": "user",
-                "content": message_content
+                "role": "system",
+                "content": system_prompt
             })
-            
+        
+        # 添加用户消息
+        messages.append({
+            "role": "user",
+            "content": message_content
+        })
+        
+        return {
+            "model": current_model,
+            "messages": messages,
+            "temperature": 0.7,
+            "max_tokens": 2000
+        }
+    
+    def _request_completion(self, message_content, system_prompt=None, override_model=None, timeout=None, stream=None, on_delta=None):
+        """
+        请求一次完整的LLM回复
+        
+        Returns:
+            tuple: (True, choices[0].message 字典) 或 (False, 错误信息)
+        """
+        if stream is None:
+            stream = self.stream_responses or on_delta is not None
+        if stream:
+            return self._stream_completion(message_content, system_prompt, override_model, timeout, on_delta)
+        
+        try:
             # 准备请求数据
-            payload = {
-                "model": current_model,
-                "messages": messages,
-                "temperature": 0.7,
-                "max_tokens": 2000
-            }
-            
-            # 发送请求
-            response = requests.post(
-                self.base_url, 
-                headers=self.headers, 
-                json=payload, 
-                timeout=60
-            )
-            response.raise_for_status()
+            payload = self._build_payload(message_content, system_prompt, override_model)
+            
+            # 发送请求（临时错误自动重试）
+            def post(attempt):
+                response = self.session.post(
+                    self.base_url, 
+                    headers=self.headers, 
+                    json=payload, 
+                    timeout=get_timeout(self.settings, read_timeout=timeout) if timeout else self.timeout
+                )
+                response.raise_for_status()
+                return response
+            
+            response = self.retry_policy.run(post, "LLM请求")
             
             # 解析响应
             data = response.json()
             
             if "choices" in data and len(data["choices"]) > 0:
                 choice = data["choices"][0]
-                message = choice.get("message", {})
-                
-                # 优先获取推理内容（适用于Gemini 2.5 Pro等推理模型）
-                reasoning = message.get("reasoning", "")
-                content = message.get("content", "")
-                
-                # 如果有推理内容且主要内容为空或只是换行，使用推理内容
-                if reasoning and (not content.strip() or content.strip() == ""):
-                    reply = reasoning
-                    print(f"📝 使用推理模式内容 (长度: {len(reasoning)})")
-                else:
-                    reply = content
-                    print(f"📝 使用标准内容 (长度: {len(content)})")
-                
-                return True, reply
+                return True, choice.get("message") or {}
             else:
                 return False, "LLM响应格式异常"
                 
@@ -82,10 +215,142 @@ class LLMHandler:
         except Exception as e:
             return False, f"处理LLM响应时出错: {e}"
     
-    def generate_title(self, content, max_length=20, min_length=10):
+    def iter_stream(self, message_content, system_prompt=None, override_model=None, idle_timeout=None):
+        """
+        以流式方式请求LLM，逐个产出增量（生成器）
+        
+        消费 OpenRouter 的 server-sent events（stream: true），两次数据之间超过
+        idle_timeout 秒没有任何输出才视为超时，长回复不会因总时长被中断。
+        结束后可通过 get_last_stream_stats() 读取首字延迟与生成速度。
+        
+        Yields:
+            tuple: (kind, text)，kind 为 "content" 或 "reasoning"
+        
+        Raises:
+            requests.exceptions.RequestException: 网络错误或空闲超时
+            LLMStreamError: 流中返回了错误事件
+        """
+        payload = self._build_payload(message_content, system_prompt, override_model)
+        payload["stream"] = True
+        timeout = get_timeout(self.settings, read_timeout=idle_timeout or self.stream_idle_timeout)
+        
+        stats = StreamStats()
+        self._set_stream_stats(None)
+        
+        with self.session.post(self.base_url, headers=self.headers, json=payload, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            
+            # chunk_size=None：分块到达即处理，不等凑满缓冲区
+            for line in response.iter_lines(chunk_size=None):
+                event = parse_stream_line(line)
+                if event is STREAM_DONE:
+                    break
+                if event is None:
+                    continue
+                
+                for kind, text in stats.deltas(event):
+                    yield kind, text
+        
+        self._set_stream_stats(stats.result())
+    
+    def get_last_stream_stats(self):
+        """获取当前线程最近一次流式调用的统计（首字延迟、tokens/秒等）"""
+        return getattr(self._local, "stream_stats", None)
+    
+    def _set_stream_stats(self, stats):
+        """记录当前线程最近一次流式调用的统计"""
+        self._local.stream_stats = stats
+    
+    def _stream_completion(self, message_content, system_prompt=None, override_model=None, idle_timeout=None, on_delta=None):
+        """
+        流式请求并累积完整回复，content 与 reasoning 分别累积
+        
+        建立连接或首个输出前失败时按重试策略重试；已有输出后中断则直接返回失败。
+        
+        Returns:
+            tuple: (True, {"content": ..., "reasoning": ...}) 或 (False, 错误信息)
+        """
+        content_parts = []
+        reasoning_parts = []
+        try:
+            def consume(attempt):
+                for kind, text in self.iter_stream(message_content, system_prompt, override_model, idle_timeout):
+                    if kind == "content":
+                        content_parts.append(text)
+                    else:
+                        reasoning_parts.append(text)
+                    if on_delta:
+                        on_delta(kind, text)
+            
+            # 只有尚未收到任何输出时才重试，避免重复的增量
+            self.retry_policy.run(
+                consume,
+                "LLM流式请求",
+                should_retry=lambda e: not content_parts and not reasoning_parts
+            )
+            
+            return True, self._stream_result(content_parts, reasoning_parts)
+            
+        except LLMStreamError as e:
+            return False, f"LLM流式响应错误: {e}"
+        except requests.exceptions.Timeout:
+            return False, "请求超时，请稍后重试"
+        except requests.exceptions.ConnectionError as e:
+            if "timed out" in str(e).lower():
+                return False, f"流式响应超过 {idle_timeout or self.stream_idle_timeout} 秒无输出，已中断"
+            return False, f"网络请求失败: {e}"
+        except requests.exceptions.RequestException as e:
+            return False, f"网络请求失败: {e}"
+        except Exception as e:
+            return False, f"处理LLM响应时出错: {e}"
+    
+    def _stream_result(self, content_parts, reasoning_parts):
+        """输出本次流式调用的统计，返回与非流式 choices[0].message 相同结构的回复"""
+        stats = self.get_last_stream_stats() or {}
+        print(f"⚡ 流式完成: 首字延迟 {stats.get('time_to_first_token')}s, "
+              f"总耗时 {stats.get('total_time')}s, {stats.get('tokens_per_second')} tokens/s")
+        
+        return {
+            "content": "".join(content_parts),
+            "reasoning": "".join(reasoning_parts)
+        }
+    
+    def _select_reply(self, message):
+        """在标准内容与推理内容之间选择最终回复"""
+        # 优先获取推理内容（适用于Gemini 2.5 Pro等推理模型）
+        reasoning = message.get("reasoning") or ""
+        content = message.get("content") or ""
+        
+        # 如果有推理内容且主要内容为空或只是换行，使用推理内容
+        if reasoning and not content.strip():
+            print(f"📝 使用推理模式内容 (长度: {len(reasoning)})")
+            return reasoning
+        
+        print(f"📝 使用标准内容 (长度: {len(content)})")
+        return content
+    
+    def generate_title(self, content, max_length=20, min_length=10, timeout=None):
         """生成简洁标题"""
         try:
-            title_prompt = f"""
+            success, title = self.send_message(
+                self._build_title_prompt(content, max_length, min_length), timeout=timeout, stream=False
+            )
+            
+            if success:
+                # 确保标题不超过限制长度
+                title = title.strip()
+                if len(title) > max_length:
+                    title = title[:max_length]
+                return True, title
+            else:
+                return False, title
+                
+        except Exception as e:
+            return False, f"生成标题时出错: {e}"
+    
+    def _build_title_prompt(self, content, max_length=20, min_length=10):
+        """单独生成标题时的提示词（只使用 content 的前200字）"""
+        return f"""
 为以下内容生成一个非常简洁的中文标题。
 
 要求:
@@ -99,34 +364,50 @@ class LLMHandler:
 {content[:200]}
 ---
 """
-            
-            success, title = self.send_message(title_prompt)
-            
-            if success:
-                # 确保标题不超过限制长度
-                title = title.strip()
-                if len(title) > max_length:
-                    title = title[:max_length]
-                return True, title
-            else:
-                return False, title
-                
-        except Exception as e:
-            return False, f"生成标题时出错: {e}"
     
-    def process_with_template_and_title(self, content, system_prompt, max_title_length=20, min_title_length=10, override_model=None):
-        """处理消息并生成标题（并行处理）"""
+    def process_with_template_and_title(self, content, system_prompt, max_title_length=20, min_title_length=10, override_model=None, title_timeout=None, on_delta=None):
+        """
+        处理消息并生成标题（并行处理）
+        
+        标题只依赖 content[:200]，因此与主回复同时发起请求。
+        标题在 title_timeout 秒内未返回或生成失败时，使用 _generate_fallback_title，
+        不会拖慢回复的写入。
+        """
+        if self.settings.get("title_generation_mode") == "combined":
+            return self.process_with_combined_title(
+                content, system_prompt, max_title_length, min_title_length, override_model=override_model, on_delta=on_delta
+            )
+        
+        if title_timeout is None:
+            title_timeout = self.title_timeout
+        
         try:
-            # 生成主要回复
-            main_success, main_reply = self.send_message(content, system_prompt, override_model=override_model)
+            started = time.monotonic()
+            # 在当前上下文的副本中运行，标题请求同样受 message_deadline 约束
+            title_future = self._get_title_executor().submit(
+                contextvars.copy_context().run,
+                self.generate_title, content, max_title_length, min_title_length, title_timeout
+            )
+            
+            # 生成主要回复（与标题请求同时进行）
+            main_success, main_reply = self.send_message(content, system_prompt, override_model=override_model, on_delta=on_delta)
             
             if not main_success:
+                title_future.cancel()
                 return False, main_reply, None
             
-            # 生成标题
-            title_success, title = self.generate_title(content, max_title_length, min_title_length)
+            # 主回复完成后，最多再等到标题自身的超时时间
+            remaining = max(0, title_timeout - (time.monotonic() - started))
+            try:
+                title_success, title = title_future.result(timeout=remaining)
+            except FuturesTimeoutError:
+                print(f"⏱️ 标题生成超过 {title_timeout} 秒，使用备选标题")
+                title_success, title = False, None
+            except Exception as e:
+                print(f"标题生成出错，使用备选标题: {e}")
+                title_success, title = False, None
             
-            if not title_success:
+            if not title_success or not title:
                 # 如果标题生成失败，使用备选方案
                 title = self._generate_fallback_title(content, max_title_length)
             
@@ -135,6 +416,124 @@ class LLMHandler:
         except Exception as e:
             return False, f"处理消息时出错: {e}", None
     
+    def process_with_combined_title(self, content, system_prompt, max_title_length=20, min_title_length=10, override_model=None, on_delta=None):
+        """
+        单次请求同时生成回复与标题（合并模式，settings.title_generation_mode = "combined"）
+        
+        在系统提示词末尾要求模型把标题放在最后一行的 【标题】 标记之后，
+        省去单独的标题请求。标题缺失时使用 _generate_fallback_title。
+        """
+        try:
+            combined_prompt = self._build_combined_prompt(system_prompt, max_title_length, min_title_length)
+            success, message = self._request_completion(content, combined_prompt, override_model, on_delta=on_delta)
+            if not success:
+                return False, message, None
+            
+            return (True,) + self._parse_combined_reply(message, content, max_title_length)
+            
+        except Exception as e:
+            return False, f"处理消息时出错: {e}", None
+    
+    def _build_combined_prompt(self, system_prompt, max_title_length=20, min_title_length=10):
+        """合并模式的系统提示词：在原提示词末尾追加标题行的输出格式要求"""
+        format_instruction = f"""## 输出格式要求
+完成全部回答后，另起一行，以"{TITLE_MARKER}"开头输出一个{min_title_length}到{max_title_length}个汉字的中文标题，精准概括用户问题的核心主题。
+标题行必须是全部输出的最后一行，标题行之后不要再输出任何内容。"""
+        if system_prompt:
+            return f"{system_prompt}\n\n---\n\n{format_instruction}"
+        return format_instruction
+    
+    def _parse_combined_reply(self, message, content, max_title_length=20):
+        """
+        从合并模式的回复中拆出正文与标题
+        
+        Returns:
+            tuple: (回复, 标题)；标题缺失时使用 _generate_fallback_title
+        """
+        # 与 send_message 相同的规则选择回复来源，并从同一来源中解析标题
+        reply_text = self._select_reply(message)
+        reply, title = self._split_reply_and_title(reply_text)
+        
+        title = self._clean_title(title, max_title_length) if title else ""
+        if not title:
+            print("⚠️ 回复中未找到标题，使用备选标题")
+            title = self._generate_fallback_title(content, max_title_length)
+        
+        return reply, title
+    
+    def _split_reply_and_title(self, text):
+        """
+        从合并输出中拆分回复与标题
+        
+        支持两种格式：
+        1. 回复正文 + 最后一行 "【标题】xxx"（取最后一个标记）
+        2. JSON 对象 {"reply": "...", "title": "..."}（可包在 ```json 代码块中）
+        
+        Returns:
+            tuple: (回复, 标题)；未找到标题时标题为空字符串
+        """
+        if not text:
+            return "", ""
+        
+        stripped = text.strip()
+        
+        # JSON 格式
+        json_text = re.sub(r"^```(?:json)?\s*|\s*```$", "", stripped)
+        if json_text.startswith("{") and json_text.endswith("}"):
+            try:
+                data = json.loads(json_text)
+                if isinstance(data, dict) and isinstance(data.get("reply"), str):
+                    return data["reply"].strip(), str(data.get("title") or "")
+            except ValueError:
+                pass
+        
+        # 分隔标记格式：取最后一个标题行
+        matches = list(_TITLE_LINE_PATTERN.finditer(stripped))
+        if not matches:
+            return stripped, ""
+        
+        last = matches[-1]
+        reply = stripped[:last.start()].rstrip()
+        # 去掉模型在标题行前补的分隔线
+        if reply.endswith("---"):
+            reply = reply[:-3].rstrip()
+        title = last.group("title")
+        # 标题写在标记的下一行时
+        if not title.strip():
+            title = stripped[last.end():].strip().split("\n", 1)[0]
+        return reply, title
+    
+    def _clean_title(self, title, max_length=20):
+        """清理标题中的引号、前缀与Markdown符号并限制长度"""
+        title = title.strip().strip("*_`#").strip()
+        title = title.strip("\"'“”‘’「」《》").strip()
+        if title.startswith("标题") and title[2:3] in (":", "："):
+            title = title[3:].strip()
+        if len(title) > max_length:
+            title = title[:max_length]
+        return title
+    
+    def _get_title_executor(self):
+        """
+        获取标题生成线程池（按需创建，供多个并发消息共用）
+        
+        大小按同时进行的回复请求数计算：流水线模式下为 LLM 阶段的工人数
+        （settings.pipeline_llm_workers），否则为 settings.max_concurrency，
+        使每个进行中的回复都有一个标题线程，标题请求不必排队等待。
+        """
+        with self._title_executor_lock:
+            if self._title_executor is None:
+                if self.settings.get("pipeline_mode", False):
+                    concurrent_replies = int(self.settings.get("pipeline_llm_workers", 8))
+                else:
+                    concurrent_replies = int(self.settings.get("max_concurrency", 1))
+                max_workers = max(2, concurrent_replies * 2)
+                self._title_executor = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix="title-worker"
+                )
+            return self._title_executor
+    
     def _generate_fallback_title(self, content, max_length=10):
         """AI生成标题失败时的备选方案"""
         # 方法1：提取前N字
@@ -171,7 +570,7 @@ class LLMHandler:
         """获取可用模型列表（可选功能）"""
         try:
             url = "https://openrouter.ai/api/v1/models"
-            response = requests.get(url, headers=self.headers, timeout=10)
+            response = self.session.get(url, headers=self.headers, timeout=self.short_timeout)
             response.raise_for_status()
             
             data = response.json()
@@ -107,16 +107,47 @@ def check_config_file():
             },
             "settings": {
                 "check_interval": 120,
+                "min_check_interval": 5,
+                "max_check_interval": 600,
                 "max_retries": 3,
+                "message_deadline": 300,
                 "request_timeout": 30,
+                "connect_timeout": 10,
+                "llm_timeout": 60,
+                "stream_responses": False,
+                "stream_idle_timeout": 30,
+                "progressive_write": False,
+                "stream_flush_interval": 1.0,
+                "http_pool_maxsize": 0,
+                "http_keep_alive": True,
+                "notion_rate_limit": 3,
+                "rate_limit_retries": 5,
                 "system_prompt": "你是一个智能助手，请认真回答用户的问题。请用中文回复。",
                 "require_template_selection": True,
                 "auto_generate_title": True,
                 "title_max_length": 20,
                 "title_min_length": 10,
+                "title_timeout": 15,
+                "title_generation_mode": "parallel",
                 "auto_sync_templates": True,
                 "sync_on_startup": True,
                 "sync_interval_hours": 24,
+                "template_fetch_concurrency": 3,
+                "template_full_sync_hours": 24,
+                "template_push_concurrency": 3,
+                "query_page_size": 100,
+                "max_backlog": 500,
+                "schema_cache_ttl": 300,
+                "max_concurrency": 1,
+                "completed_page_ttl": 600,
+                "pipeline_mode": False,
+                "pipeline_context_workers": 2,
+                "pipeline_llm_workers": 8,
+                "pipeline_writer_workers": 2,
+                "pipeline_queue_size": 10,
+                "incremental_poll": False,
+                "full_sweep_interval": 600,
+                "poll_state_file": "poll_state.json",
                 "model_mapping": {
                     "Gemini 2.5 pro": "google/gemini-2.5-pro",
                     "Gemini 2.5 flash": "google/gemini-2.5-flash",
@@ -1,7 +1,70 @@
 import requests
 import json
-from datetime import datetime, timezone
+import difflib
+from datetime import datetime, timezone, timedelta
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from http_session import get_session, get_timeout
+from rate_limiter import get_rate_limiter, parse_retry_after, backoff_delay
+from retry_policy import RetryPolicy, is_retryable_status, remaining_time
+
+# Notion 每次追加/创建请求最多接受的子块数
+MAX_CHILDREN_PER_REQUEST = 100
+
+# 追加锚点：页面原本没有内容块，新块从页面开头写起（请求中不带 after）
+PAGE_START = ""
+
+# 限流/暂不可用状态码：只由 _send_request 按 Retry-After 退避重试，RetryPolicy 不再重复重试
+RATE_LIMIT_STATUS_CODES = (429, 503)
+
+# 超长段落的逐级切分边界：换行 → 句末标点（中英文）→ 空白；都没有时按长度硬切
+PARAGRAPH_BOUNDARIES = (
+    ("\n",),
+    ("。", "！", "？", "；", "…", ". ", "! ", "? ", "; "),
+    (" ", "\t"),
+)
+
+# 配置项 -> 该属性在消息数据库中应有的类型
+MESSAGE_PROPERTY_TYPES = {
+    "title_property_name": "title",
+    "input_property_name": "rich_text",
+    "output_property_name": "rich_text",
+    "template_property_name": "select",
+    "knowledge_base_property_name": "select",
+    "model_property_name": "select",
+}
+
+
+def is_retryable_write_status(status_code):
+    """写请求的响应是否交给 RetryPolicy 重试（429/503 已在 _send_request 中退避过）"""
+    return is_retryable_status(status_code) and status_code not in RATE_LIMIT_STATUS_CODES
+
+
+def find_property_type_issues(notion_config, schema_properties):
+    """
+    对照数据库Schema检查配置的属性是否存在、类型是否正确
+    
+    Args:
+        notion_config: 配置的 notion 部分
+        schema_properties: 数据库Schema中的 properties（属性名 -> {"id", "type", ...}）
+        
+    Returns:
+        list: 问题描述，全部正确时为空列表
+    """
+    issues = []
+    for field, expected_type in MESSAGE_PROPERTY_TYPES.items():
+        name = notion_config.get(field)
+        if not name:
+            continue
+        prop = schema_properties.get(name)
+        if prop is None:
+            issues.append(f"数据库中没有属性「{name}」（{field}）")
+        elif prop.get("type") != expected_type:
+            issues.append(f"属性「{name}」的类型为 {prop.get('type')}，应为 {expected_type}（{field}）")
+    return issues
 
 class NotionHandler:
     """处理与Notion API的所有交互"""
@@ -35,6 +98,14 @@ class NotionHandler:
             raise ValueError("配置文件中缺少 'input_property_name'，请检查 config.json")
         if not self.output_prop:
             raise ValueError("配置文件中缺少 'output_property_name'，请检查 config.json")
+        
+        # 连续对话字段
+        self.session_id_prop = notion_config.get('session_id_property', '会话ID')
+        self.parent_id_prop = notion_config.get('parent_id_property', '父消息ID')
+        self.session_status_prop = notion_config.get('session_status_property', '会话状态')
+        self.conversation_turn_prop = notion_config.get('conversation_turn_property', '对话轮次')
+        self.session_title_prop = notion_config.get('session_title_property', '会话标题')
+        self.context_length_prop = notion_config.get('context_length_property', '上下文长度')
 
         # 模板库数据库配置
         self.template_database_id = notion_config.get('template_database_id')
@@ -49,69 +120,412 @@ class NotionHandler:
             "Content-Type": "application/json",
             "Notion-Version": "2022-06-28"
         }
+        
+        # 共享连接池：复用到 api.notion.com 的长连接
+        self.settings = config.get('settings', {})
+        self.session = get_session(self.settings)
+        self.timeout = get_timeout(self.settings)
+        self.test_timeout = get_timeout(self.settings, read_timeout=10)
+        
+        # 同一集成共用的令牌桶限流器（Notion约3次/秒）
+        self.rate_limiter = get_rate_limiter(
+            self.api_key,
+            rate=self.settings.get("notion_rate_limit", 3),
+            capacity=self.settings.get("notion_rate_burst", 3)
+        )
+        self.rate_limit_retries = self.settings.get("rate_limit_retries", 5)
+        
+        # 写操作的重试策略（settings.max_retries）
+        self.retry_policy = RetryPolicy.from_settings(self.settings)
+        
+        # 增量轮询：只查询上次轮询之后编辑过的页面，并定期做一次全量核对
+        self.incremental_poll = self.settings.get("incremental_poll", False)
+        self.full_sweep_interval = self.settings.get("full_sweep_interval", 600)
+        self.watermark_margin = self.settings.get("watermark_margin", 120)  # last_edited_time 只精确到分钟
+        self.poll_state_file = self.settings.get("poll_state_file", "poll_state.json")
+        self._poll_state = self._load_poll_state() if self.incremental_poll else {}
+        self.last_poll_was_full = True
+        self.last_waiting_count = 0  # 等待选择模板/模型/背景的记录数（每轮查询后刷新）
+        self._waiting_pages = set()  # 等待选择的页面ID：完整的全量查询整体替换，其余查询按看到的页面增减
+        
+        # 数据库Schema缓存：database_id -> (获取时间, properties)，超过 settings.schema_cache_ttl 秒后重新获取
+        self.schema_cache_ttl = self.settings.get("schema_cache_ttl", 300)
+        self._schema_cache = {}
+        self.bytes_received = 0  # 累计接收的Notion响应字节数
     
-    def get_pending_messages(self):
-        """获取待处理的消息"""
+    def _send_request(self, method, url, payload=None, timeout=None):
+        """
+        通过共享连接池发送请求（所有Notion API调用的统一出口）
+        
+        每次请求前从令牌桶取令牌；遇到 429/503 时按 Retry-After 指数退避（带抖动）重试，
+        并暂停同一集成的其它请求。这是 429/503 唯一的重试层，退避不会超过单条消息截止时间。
+        
+        Args:
+            method: HTTP方法 (GET, POST, PATCH, DELETE)
+            url: 请求URL
+            payload: JSON请求体
+            timeout: 超时设置，默认使用 settings.request_timeout
+            
+        Returns:
+            requests.Response: 原始响应（由调用方检查状态码）
+        """
+        method = method.upper()
+        if method not in ("GET", "POST", "PATCH", "DELETE"):
+            raise ValueError(f"不支持的HTTP方法: {method}")
+        
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            response = self.session.request(
+                method,
+                url,
+                headers=self.headers,
+                json=payload if method in ("POST", "PATCH") else None,
+                timeout=timeout or self.timeout
+            )
+            
+            self.bytes_received += len(response.content)
+            
+            delay = self._rate_limit_delay(response, attempt)
+            if delay is None:
+                return response
+            self.rate_limiter.penalize(delay)
+            attempt += 1
+    
+    def _rate_limit_delay(self, response, attempt):
+        """
+        限流响应的退避秒数（同步与异步请求共用）
+        
+        Returns:
+            float: 重试前应等待的秒数；不是 429/503、重试次数用尽或会超过消息截止时间时返回 None
+        """
+        if response.status_code not in RATE_LIMIT_STATUS_CODES or attempt >= self.rate_limit_retries:
+            return None
+        
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        delay = backoff_delay(attempt, retry_after)
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            print(f"❌ Notion限流 (HTTP {response.status_code})，已接近消息处理截止时间，不再重试")
+            return None
+        
+        print(f"⏳ Notion限流 (HTTP {response.status_code})，{delay:.1f} 秒后重试 ({attempt + 1}/{self.rate_limit_retries})")
+        return delay
+    
+    def _send_write_request(self, method, url, payload=None, description="Notion写入"):
+        """
+        发送写请求：超时、连接错误和 408/5xx 按 settings.max_retries 重试（429/503 由 _send_request 处理）
+        
+        Returns:
+            requests.Response: 最后一次响应（重试用尽时为最后一次失败的响应）
+        """
+        def attempt(_):
+            response = self._send_request(method, url, payload)
+            if is_retryable_write_status(response.status_code):
+                response.raise_for_status()
+            return response
+        
         try:
-            url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
+            return self.retry_policy.run(attempt, description)
+        except requests.exceptions.HTTPError as e:
+            return e.response
+    
+    def get_pending_messages(self, page_size=None, max_backlog=None, full_sweep=None):
+        """获取待处理的消息"""
+        return list(self.iter_pending_messages(page_size=page_size, max_backlog=max_backlog,
+                                               full_sweep=full_sweep))
+    
+    def iter_pending_messages(self, page_size=None, max_backlog=None, full_sweep=None):
+        """
+        逐页获取待处理的消息（生成器）
+        
+        跟随Notion的 has_more / next_cursor 翻页，每拿到一页结果就立即产出解析好的消息，
+        调用方无需等整个积压列表下载完即可开始处理第一条。
+        
+        查询条件只有"输出为空"，模板、模型、背景尚未选齐的记录在本地计入 last_waiting_count：
+        完整遍历的全量查询得到准确数量；增量查询或中途停止（含达到积压上限）时，按本轮看到的页面
+        增减上次的统计，每轮都会刷新。
+        
+        开启 settings.incremental_poll 后，只查询 last_edited_time 不早于水位线的页面；
+        完整遍历结束后水位线推进到本次轮询开始的时间并写入 poll_state_file。
+        每隔 settings.full_sweep_interval 秒做一次不带时间条件的全量核对，兜底漏掉的页面。
+        
+        Args:
+            page_size: 每页查询条数（1-100），默认读取 settings.query_page_size
+            max_backlog: 单轮最多产出的消息数，默认读取 settings.max_backlog（0 表示不限）
+            full_sweep: 是否全量查询，默认由 is_full_sweep_due() 决定
             
-            # 更新查询逻辑：当输出为空，且另外三个关键字段都已选择时，触发任务
-            payload = {
-                "filter": {
-                    "and": [
-                        {
-                            "property": self.output_prop,
-                            "rich_text": {
-                                "is_empty": True
-                            }
-                        },
-                        {
-                            "property": self.template_prop,
-                            "select": {
-                                "is_not_empty": True
-                            }
-                        },
-                        {
-                            "property": self.model_prop,
-                            "select": {
-                                "is_not_empty": True
-                            }
-                        },
-                        {
-                            "property": self.knowledge_prop,
-                            "select": {
-                                "is_not_empty": True
-                            }
-                        }
-                    ]
-                },
-                "sorts": [
+        Yields:
+            PendingMessage: 与 _extract_message_data 返回值相同的消息
+        """
+        settings = self.config.get("settings", {})
+        if page_size is None:
+            page_size = settings.get("query_page_size", 100)
+        page_size = max(1, min(int(page_size), 100))  # Notion单页上限为100
+        if max_backlog is None:
+            max_backlog = settings.get("max_backlog", 0)
+        
+        url = self._query_url(
+            self.database_id,
+            required=(self.title_prop, self.input_prop, self.template_prop, self.knowledge_prop, self.model_prop),
+            optional=(self.session_id_prop, self.parent_id_prop, self.session_status_prop,
+                      self.conversation_turn_prop, self.session_title_prop, self.context_length_prop)
+        )
+        
+        # 只按"输出为空"查询一次，再在本地分为可处理（模板、模型、背景都已选择）与等待选择两类，
+        # 等待数量与待处理消息来自同一次分页查询
+        payload = {
+            "filter": {
+                "and": [
                     {
-                        "timestamp": "created_time",
-                        "direction": "ascending"
+                        "property": self.output_prop,
+                        "rich_text": {
+                            "is_empty": True
+                        }
                     }
                 ]
-            }
+            },
+            "sorts": [
+                {
+                    "timestamp": "created_time",
+                    "direction": "ascending"
+                }
+            ],
+            "page_size": page_size
+        }
+        
+        if full_sweep is None:
+            full_sweep = self.is_full_sweep_due()
+        watermark = self._poll_state.get("watermark")
+        if not full_sweep and watermark:
+            payload["filter"]["and"].append({
+                "timestamp": "last_edited_time",
+                "last_edited_time": {
+                    "on_or_after": watermark
+                }
+            })
+        self.last_poll_was_full = full_sweep
+        poll_started = datetime.now(timezone.utc)
+        
+        yielded = 0
+        waiting_pages = set()
+        ready_pages = set()
+        completed = False
+        try:
+            while True:
+                response = self._send_request("POST", url, payload)
+                response.raise_for_status()
+                
+                data = response.json()
+                
+                for page in data.get("results", []):
+                    if not self._has_required_selections(page):
+                        waiting_pages.add(page["id"])
+                        continue
+                    ready_pages.add(page["id"])
+                    message = self._extract_message_data(page)
+                    if message:
+                        yield message
+                        yielded += 1
+                        if max_backlog and yielded >= max_backlog:
+                            print(f"⚠️ 已达到单轮积压上限 {max_backlog} 条，剩余消息留待下一轮")
+                            return
+                
+                next_cursor = data.get("next_cursor")
+                if not data.get("has_more") or not next_cursor:
+                    completed = True
+                    break
+                payload["start_cursor"] = next_cursor
+                
+        except Exception as e:
+            print(f"获取Notion消息时出错: {e}")
+            return
+        finally:
+            # 达到积压上限、查询出错或调用方提前停止迭代时同样刷新等待数量
+            self._update_waiting_pages(waiting_pages, ready_pages, full_sweep and completed)
+        
+        # 只有完整遍历后才推进水位线（中途停止或达到积压上限时保留原值）
+        if self.incremental_poll:
+            self._advance_watermark(poll_started, full_sweep)
+    
+    def _update_waiting_pages(self, waiting_pages, ready_pages, complete):
+        """
+        根据一轮查询看到的页面刷新等待数量
+        
+        Args:
+            waiting_pages: 本轮看到的尚未选齐的页面ID
+            ready_pages: 本轮看到的已选齐的页面ID（不再等待）
+            complete: 本轮是否为完整遍历的全量查询（是则整体替换）
+        """
+        if complete:
+            self._waiting_pages = set(waiting_pages)
+        else:
+            self._waiting_pages = (self._waiting_pages - ready_pages) | waiting_pages
+        self.last_waiting_count = len(self._waiting_pages)
+    
+    def _query_url(self, database_id, required, optional=()):
+        """
+        数据库查询URL，附带 filter_properties，使结果只包含需要的属性
+        
+        属性ID由 _get_property_ids 从数据库Schema解析；required 中有属性在Schema里找不到时
+        （如刚改名）不加过滤，返回全部属性，避免漏掉需要的字段。optional 中找不到的属性直接忽略。
+        """
+        url = f"https://api.notion.com/v1/databases/{database_id}/query"
+        property_ids = self._get_property_ids(database_id)
+        
+        required = [name for name in required if name]
+        if not property_ids or any(name not in property_ids for name in required):
+            return url
+        
+        names = dict.fromkeys(required + [name for name in optional if name in property_ids])
+        query = "&".join(f"filter_properties={quote(property_ids[name], safe='%')}" for name in names)
+        return f"{url}?{query}"
+    
+    def _get_property_ids(self, database_id):
+        """数据库的 属性名 -> 属性ID 映射（来自Schema缓存）；获取失败时返回空字典"""
+        try:
+            properties = self.get_database_schema(database_id)
+        except Exception as e:
+            print(f"获取数据库属性ID失败，查询将返回全部属性: {e}")
+            return {}
+        return {name: prop["id"] for name, prop in properties.items() if prop.get("id")}
+    
+    def get_database_schema(self, database_id=None, refresh=False, timeout=None):
+        """
+        获取数据库Schema（属性名 -> {"id", "type", ...}）
+        
+        settings.schema_cache_ttl 秒内复用缓存；修改数据库属性后应调用 invalidate_schema。
+        
+        Args:
+            database_id: 数据库ID，默认为消息数据库
+            refresh: 忽略缓存重新获取
+            timeout: 请求超时设置
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
+        Raises:
+            请求失败时抛出异常
+        """
+        database_id = database_id or self.database_id
+        cached = self._schema_cache.get(database_id)
+        if cached and not refresh and time.monotonic() - cached[0] < self.schema_cache_ttl:
+            return cached[1]
+        
+        response = self._send_request("GET", f"https://api.notion.com/v1/databases/{database_id}", timeout=timeout)
+        response.raise_for_status()
+        properties = response.json().get("properties", {})
+        self._schema_cache[database_id] = (time.monotonic(), properties)
+        return properties
+    
+    def invalidate_schema(self, database_id=None):
+        """使Schema缓存失效；不指定 database_id 时清空全部"""
+        if database_id:
+            self._schema_cache.pop(database_id, None)
+        else:
+            self._schema_cache.clear()
+    
+    def get_property_info(self, name, database_id=None):
+        """
+        按配置的属性名查询属性ID与类型
+        
+        Returns:
+            tuple: (属性ID, 类型)；属性不存在时返回 None
+        """
+        prop = self.get_database_schema(database_id).get(name)
+        if prop is None:
+            return None
+        return prop.get("id"), prop.get("type")
+    
+    def _template_query_url(self, *extra_props):
+        """模板库查询URL（只返回名称、分类、描述及 extra_props）"""
+        return self._query_url(
+            self.template_database_id,
+            required=(self.template_name_prop, self.template_category_prop,
+                      self.template_description_prop) + extra_props
+        )
+    
+    def get_message(self, page_id):
+        """
+        按 page_id 获取单条待处理消息（用于推送通知）
+        
+        页面不属于消息数据库、已归档、已有回复或尚未选齐模板/模型/背景时返回 None。
+        """
+        try:
+            response = self._send_request("GET", f"https://api.notion.com/v1/pages/{page_id}")
             response.raise_for_status()
-            
-            data = response.json()
-            messages = []
-            
-            for page in data.get("results", []):
-                message = self._extract_message_data(page)
-                if message:
-                    messages.append(message)
-            
-            return messages
-            
+            page = response.json()
         except Exception as e:
-            print(f"获取Notion消息时出错: {e}")
-            return []
+            print(f"获取页面 {page_id[:8]}... 时出错: {e}")
+            return None
+        
+        parent_id = page.get("parent", {}).get("database_id", "")
+        if parent_id.replace("-", "") != self.database_id.replace("-", ""):
+            print(f"⚠️ 页面 {page_id[:8]}... 不属于消息数据库，已忽略")
+            return None
+        if page.get("archived") or page.get("in_trash"):
+            return None
+        if self._extract_text_from_property(page.get("properties", {}), self.output_prop):
+            return None  # 已回复
+        if not self._has_required_selections(page):
+            return None
+        return self._extract_message_data(page)
+    
+    def _has_required_selections(self, page):
+        """模板、模型、背景三个选择字段是否都已填写"""
+        properties = page.get("properties", {})
+        return all(
+            self._extract_select_from_property(properties, prop)
+            for prop in (self.template_prop, self.model_prop, self.knowledge_prop)
+        )
     
-    def update_message_reply(self, page_id, llm_reply, title=None):
-        """更新LLM回复和标题 - 将回复写入页面内容而不是属性栏"""
+    def is_full_sweep_due(self):
+        """本轮是否需要全量查询（未开启增量轮询、没有水位线或距上次全量核对已超过间隔）"""
+        if not self.incremental_poll or not self._poll_state.get("watermark"):
+            return True
+        last_full_sweep = self._poll_state.get("last_full_sweep")
+        if not last_full_sweep:
+            return True
+        try:
+            elapsed = datetime.now(timezone.utc) - datetime.fromisoformat(last_full_sweep)
+        except ValueError:
+            return True
+        return elapsed.total_seconds() >= self.full_sweep_interval
+    
+    def _advance_watermark(self, poll_started, full_sweep):
+        """将水位线推进到本次轮询开始时间（减去安全余量），并持久化"""
+        watermark = poll_started - timedelta(seconds=self.watermark_margin)
+        self._poll_state["watermark"] = watermark.isoformat()
+        if full_sweep:
+            self._poll_state["last_full_sweep"] = poll_started.isoformat()
+        self._save_poll_state()
+    
+    def _load_poll_state(self):
+        """读取持久化的轮询水位线"""
+        try:
+            if os.path.exists(self.poll_state_file):
+                with open(self.poll_state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+                if state.get("database_id") == self.database_id:
+                    return state
+        except Exception as e:
+            print(f"读取轮询状态失败: {e}")
+        return {"database_id": self.database_id}
+    
+    def _save_poll_state(self):
+        """保存轮询水位线"""
+        try:
+            with open(self.poll_state_file, 'w', encoding='utf-8') as f:
+                json.dump(self._poll_state, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存轮询状态失败: {e}")
+    
+    def update_message_reply(self, page_id, llm_reply, title=None, writer=None):
+        """
+        更新LLM回复和标题 - 将回复写入页面内容而不是属性栏
+        
+        Args:
+            writer: 渐进写入时由 begin_incremental_reply 返回的写入器；
+                    提供时先补写剩余内容，最后才更新回复属性，
+                    这样中途崩溃的页面仍会被待处理查询再次选中
+        """
         try:
             # --- 改进的内容清洗逻辑 ---
             # 1. 基本清理：去除首尾空白
@@ -123,48 +537,17 @@ class NotionHandler:
             
             print(f"内容清洗: 原长度={len(llm_reply) if llm_reply else 0}, 清洗后长度={len(cleaned_reply)}")
             # --- 清洗结束 ---
+            
+            if writer is not None:
+                # 渐进写入：先补完剩余内容，再更新属性
+                if not writer.finish(cleaned_reply):
+                    print(f"❌ 页面内容更新失败: {page_id[:8]}...")
+                    return False
+                print(f"✅ 页面内容更新成功: {page_id[:8]}...")
+                return self._update_reply_properties(page_id, title)
 
             # 第一步：更新标题和清空回复属性栏
-            properties = {}
-            
-            # 清空回复属性栏，因为内容将存储在页面内容中
-            properties[self.output_prop] = {
-                "rich_text": [
-                    {
-                        "text": {
-                            "content": "✅ 已回复 (查看页面内容)"
-                        }
-                    }
-                ]
-            }
-            
-            # 如果提供了标题，同时更新标题
-            if title:
-                # 确保标题长度不超过限制
-                title = title.strip()
-                if len(title) > 100:  # Notion标题限制
-                    title = title[:100]
-                    
-                properties[self.title_prop] = {
-                    "title": [
-                        {
-                            "text": {
-                                "content": title
-                            }
-                        }
-                    ]
-                }
-            
-            # 更新页面属性
-            page_url = f"https://api.notion.com/v1/pages/{page_id}"
-            payload = {"properties": properties}
-            
-            print(f"准备更新页面属性: {page_id}")
-            response = requests.patch(page_url, headers=self.headers, json=payload, timeout=30)
-            
-            if response.status_code != 200:
-                print(f"❌ 页面属性更新失败: HTTP {response.status_code}")
-                print(f"错误详情: {response.text}")
+            if not self._update_reply_properties(page_id, title):
                 return False
             
             # 第二步：将LLM回复内容写入页面内容块
@@ -183,28 +566,287 @@ class NotionHandler:
         except Exception as e:
             print(f"更新Notion回复时出错: {e}")
             return False
+    
+    def _update_reply_properties(self, page_id, title=None):
+        """标记回复属性栏为已回复，并更新标题"""
+        # 更新页面属性
+        page_url = f"https://api.notion.com/v1/pages/{page_id}"
+        payload = {"properties": self._build_reply_properties(title)}
+        
+        print(f"准备更新页面属性: {page_id}")
+        response = self._send_write_request("PATCH", page_url, payload, "更新页面属性")
+        
+        if response.status_code != 200:
+            print(f"❌ 页面属性更新失败: HTTP {response.status_code}")
+            print(f"错误详情: {response.text}")
+            return False
+        
+        return True
+    
+    def _build_reply_properties(self, title=None):
+        """构建"已回复"状态与标题的属性更新内容"""
+        properties = {}
+        
+        # 清空回复属性栏，因为内容将存储在页面内容中
+        properties[self.output_prop] = {
+            "rich_text": [
+                {
+                    "text": {
+                        "content": "✅ 已回复 (查看页面内容)"
+                    }
+                }
+            ]
+        }
+        
+        # 如果提供了标题，同时更新标题
+        if title:
+            # 确保标题长度不超过限制
+            title = title.strip()
+            if len(title) > 100:  # Notion标题限制
+                title = title[:100]
+                
+            properties[self.title_prop] = {
+                "title": [
+                    {
+                        "text": {
+                            "content": title
+                        }
+                    }
+                ]
+            }
+        
+        return properties
+
+    def begin_incremental_reply(self, page_id):
+        """开始渐进写入回复，返回 IncrementalReplyWriter（见 _append_content_to_page）"""
+        return self._append_content_to_page(page_id, "", incremental=True)
 
-    def _append_content_to_page(self, page_id, content):
-        """将内容追加到页面内容块中"""
+    def _append_content_to_page(self, page_id, content, incremental=False):
+        """
+        将内容追加到页面内容块中
+        
+        incremental=True 时立即追加分割线和"🤖 AI 回复"标题，返回 IncrementalReplyWriter，
+        之后随模型输出逐段写入；否则一次性写入全部内容并返回是否成功。
+        """
+        if incremental:
+            writer = IncrementalReplyWriter(self, page_id)
+            writer.start()
+            if content:
+                writer.feed(content)
+            return writer
+        
         try:
-            # 首先获取页面现有的内容块
-            blocks_url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-            
             # 将长文本分割成多个段落，因为Notion对单个文本块有长度限制
             paragraphs = self._split_content_into_paragraphs(content)
             
-            # 构建要添加的内容块
-            children = []
+            # 构建要添加的内容块：分割线 + 标题 + 内容段落 + 时间戳
+            children = self._build_reply_header_blocks()
+            children.extend(self._build_paragraph_blocks(paragraphs))
+            children.append(self._build_timestamp_block())
+            
+            return self._append_blocks(page_id, children)
+                
+        except Exception as e:
+            print(f"追加页面内容时出错: {e}")
+            return False
+
+    def _append_blocks(self, page_id, children, after=None):
+        """
+        向页面追加内容块（指定 after 时插入到该内容块之后），返回是否成功
+        
+        见 _append_blocks_at
+        """
+        return self._append_blocks_at(page_id, children, after)[0]
+    
+    def _append_blocks_at(self, page_id, children, after=None):
+        """
+        向页面追加内容块（指定 after 时插入到该内容块之后）
+        
+        Notion每次请求最多接受100个子块：超出时按100个一批依次发送，
+        后一批以前一批最后一个块为 after 锚点，整体顺序与 children 一致。
+        某一批失败时只从该批重试，已写入的批次不会重发。
+        
+        未指定 after 时先取页面当前最后一个内容块作为锚点：重试前的去重检查只比较锚点之后的内容块，
+        页面末尾原本就有相同内容（如上次中断留下的回复标题）时不会被误认为本次已写入。
+        
+        Returns:
+            tuple: (是否成功, 最后写入的内容块ID)；无法确定ID时为 None
+        """
+        if after is None:
+            after = self._page_end_anchor(page_id)
+        
+        for start, batch in self._iter_block_batches(children):
+            success, last_block_id = self._append_block_batch(page_id, batch, after)
+            if not success:
+                if start:
+                    print(f"❌ 已写入 {start}/{len(children)} 个内容块，剩余部分写入失败")
+                return False, None
+            after = last_block_id
+        
+        print(f"✅ 页面内容追加成功")
+        return True, after
+    
+    def _page_end_anchor(self, page_id):
+        """
+        页面当前最后一个内容块的ID，作为追加的锚点
+        
+        Returns:
+            str: 最后一个内容块的ID；页面没有内容块时为 PAGE_START；获取失败时为 None（位置未知，重试前不做去重检查）
+        """
+        try:
+            last_block = None
+            for last_block in self._iter_block_children(page_id):
+                pass
+        except Exception as e:
+            print(f"获取页面末尾位置失败: {e}")
+            return None
+        return last_block["id"] if last_block else PAGE_START
+    
+    @staticmethod
+    def _iter_block_batches(children):
+        """按Notion单次请求上限切分内容块，产出 (起始序号, 本批内容块)"""
+        for start in range(0, len(children), MAX_CHILDREN_PER_REQUEST):
+            yield start, children[start:start + MAX_CHILDREN_PER_REQUEST]
+    
+    @staticmethod
+    def _append_batch_payload(batch, after=None):
+        """追加一批内容块的请求体（指定 after 时插入到该内容块之后）"""
+        payload = {"children": batch}
+        if after:
+            payload["after"] = after
+        return payload
+    
+    def _append_block_batch(self, page_id, batch, after=None):
+        """
+        发送一批（不超过100个）内容块
+        
+        失败重试前会先检查目标位置是否已有这批内容块（上次请求实际已成功但响应丢失），
+        已存在则不再重复追加。
+        
+        Returns:
+            tuple: (是否成功, 本批最后一个内容块的ID)；追加到末尾且无法确定ID时为 None
+        """
+        blocks_url = f"https://api.notion.com/v1/blocks/{page_id}/children"
+        payload = self._append_batch_payload(batch, after)
+        
+        def attempt(attempt_index):
+            if attempt_index > 0:
+                written = self._blocks_already_appended(page_id, batch, after)
+                if written:
+                    print("ℹ️ 内容块已在上次请求中写入，跳过重复追加")
+                    return written
+            response = self._send_request("PATCH", blocks_url, payload)
+            if is_retryable_write_status(response.status_code):
+                response.raise_for_status()
+            return response
+        
+        try:
+            result = self.retry_policy.run(attempt, "追加页面内容")
+        except requests.exceptions.HTTPError as e:
+            result = e.response
+        
+        if isinstance(result, list):
+            return True, result[-1].get("id")
+        
+        success, written = self._check_append_response(result, batch)
+        if success and not written and after is not None:
+            written = self._blocks_already_appended(page_id, batch, after)
+        return success, written[-1].get("id") if written else None
+    
+    def _check_append_response(self, response, batch):
+        """
+        检查一次追加请求的响应（同步与异步追加共用）
+        
+        Returns:
+            tuple: (是否成功, 响应中与本批一致的新建内容块)；无法从响应中核对时内容块为 None
+        """
+        if response.status_code == 200:
+            # 响应中为新建的内容块；核对无误后以最后一个作为下一批的锚点
+            return True, self._blocks_match_at(response.json().get("results", []), batch, PAGE_START)
+        
+        print(f"❌ 页面内容追加失败: HTTP {response.status_code}")
+        print(f"错误详情: {response.text}")
+        
+        # 尝试解析错误信息
+        try:
+            error_data = response.json()
+            if 'message' in error_data:
+                print(f"Notion错误信息: {error_data['message']}")
+        except:
+            pass
+        
+        return False, None
+
+    def _blocks_already_appended(self, page_id, children, after=None):
+        """检查紧跟锚点 after 的内容块是否与 children 一致，一致时返回这些已写入的块"""
+        if after is None:
+            return None
+        
+        try:
+            existing = list(self._iter_block_children(page_id))
+        except Exception as e:
+            print(f"检查已写入内容失败: {e}")
+            return None
+        
+        return self._blocks_match_at(existing, children, after)
+    
+    def _blocks_match_at(self, existing, children, after=None):
+        """
+        existing 中紧跟 after 的一段内容块是否与 children 一致（按类型与文本比较）
+        
+        Args:
+            after: 锚点内容块ID；为 PAGE_START 时从 existing 开头比较，为 None（位置未知）时不认为一致
+        
+        Returns:
+            list: 一致时返回 existing 中对应的内容块，否则返回 None
+        """
+        if after is None:
+            return None
+        if after == PAGE_START:
+            start = 0
+        else:
+            ids = [block.get("id") for block in existing]
+            if after not in ids:
+                return None
+            start = ids.index(after) + 1
+        candidates = existing[start:start + len(children)]
+        
+        if not children or len(candidates) < len(children):
+            return None
+        
+        for old_block, new_block in zip(candidates, children):
+            if old_block.get("type") != new_block.get("type"):
+                return None
+            if self._extract_text_from_block(old_block) != self._extract_text_from_block(new_block):
+                return None
+        return candidates
+
+    def _iter_block_children(self, block_id, page_size=100):
+        """分页遍历某个块的全部子块（生成器），请求失败时抛出异常"""
+        base_url = f"https://api.notion.com/v1/blocks/{block_id}/children?page_size={page_size}"
+        url = base_url
+        while True:
+            response = self._send_request("GET", url)
+            response.raise_for_status()
+            data = response.json()
+            
+            for block in data.get("results", []):
+                yield block
             
-            # 添加分割线
-            children.append({
+            next_cursor = data.get("next_cursor")
+            if not data.get("has_more") or not next_cursor:
+                return
+            url = f"{base_url}&start_cursor={next_cursor}"
+
+    def _build_reply_header_blocks(self):
+        """回复区域开头的分割线与标题块"""
+        return [
+            {
                 "object": "block",
                 "type": "divider",
                 "divider": {}
-            })
-            
-            # 添加标题
-            children.append({
+            },
+            {
                 "object": "block",
                 "type": "heading_2",
                 "heading_2": {
@@ -217,74 +859,58 @@ class NotionHandler:
                         }
                     ]
                 }
-            })
-            
-            # 添加内容段落
-            for paragraph in paragraphs:
-                if paragraph.strip():  # 只添加非空段落
-                    children.append({
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [
-                                {
-                                    "type": "text",
-                                    "text": {
-                                        "content": paragraph
-                                    }
+            }
+        ]
+
+    def _build_paragraph_blocks(self, paragraphs):
+        """将段落文本转换为段落块（跳过空段落）"""
+        blocks = []
+        for paragraph in paragraphs:
+            if paragraph.strip():  # 只添加非空段落
+                blocks.append({
+                    "object": "block",
+                    "type": "paragraph",
+                    "paragraph": {
+                        "rich_text": [
+                            {
+                                "type": "text",
+                                "text": {
+                                    "content": paragraph
                                 }
-                            ]
-                        }
-                    })
-            
-            # 添加时间戳
-            timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
-            children.append({
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": f"📅 生成时间：{timestamp}"
-                            },
-                            "annotations": {
-                                "color": "gray"
                             }
+                        ]
+                    }
+                })
+        return blocks
+
+    def _build_timestamp_block(self):
+        """回复末尾的生成时间块"""
+        timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+        return {
+            "object": "block",
+            "type": "paragraph",
+            "paragraph": {
+                "rich_text": [
+                    {
+                        "type": "text",
+                        "text": {
+                            "content": f"📅 生成时间：{timestamp}"
+                        },
+                        "annotations": {
+                            "color": "gray"
                         }
-                    ]
-                }
-            })
-            
-            # 发送请求添加内容块
-            payload = {"children": children}
-            
-            response = requests.patch(blocks_url, headers=self.headers, json=payload, timeout=30)
-            
-            if response.status_code == 200:
-                print(f"✅ 页面内容追加成功")
-                return True
-            else:
-                print(f"❌ 页面内容追加失败: HTTP {response.status_code}")
-                print(f"错误详情: {response.text}")
-                
-                # 尝试解析错误信息
-                try:
-                    error_data = response.json()
-                    if 'message' in error_data:
-                        print(f"Notion错误信息: {error_data['message']}")
-                except:
-                    pass
-                
-                return False
-                
-        except Exception as e:
-            print(f"追加页面内容时出错: {e}")
-            return False
+                    }
+                ]
+            }
+        }
 
     def _split_content_into_paragraphs(self, content, max_length=1900):
-        """将长文本分割成适合Notion的段落"""
+        """
+        将长文本分割成适合Notion的段落，每段都不超过 max_length 个字符
+        
+        按双换行分段后贪心合并相邻段落（以列表累积并维护当前长度，不反复拼接字符串）；
+        单个段落超长时由 _split_long_text 按边界逐级回退切分。整体为线性时间。
+        """
         if not content:
             return []
         
@@ -292,53 +918,62 @@ class NotionHandler:
         if len(content) <= max_length:
             return [content]
         
-        # 按段落分割（双换行符）
-        paragraphs = content.split('\n\n')
         result = []
-        current_chunk = ""
-        
-        for paragraph in paragraphs:
-            # 如果当前段落本身就很长，需要进一步分割
-            if len(paragraph) > max_length:
-                # 先保存当前chunk
-                if current_chunk:
-                    result.append(current_chunk.strip())
-                    current_chunk = ""
-                
-                # 分割长段落
-                sentences = paragraph.split('。')
-                temp_chunk = ""
-                
-                for sentence in sentences:
-                    if sentence:
-                        sentence = sentence + '。' if not sentence.endswith('。') else sentence
-                        if len(temp_chunk + sentence) <= max_length:
-                            temp_chunk += sentence
-                        else:
-                            if temp_chunk:
-                                result.append(temp_chunk.strip())
-                            temp_chunk = sentence
-                
-                if temp_chunk:
-                    result.append(temp_chunk.strip())
-            else:
-                # 检查添加这个段落是否会超出长度限制
-                if len(current_chunk + '\n\n' + paragraph) <= max_length:
-                    if current_chunk:
-                        current_chunk += '\n\n' + paragraph
-                    else:
-                        current_chunk = paragraph
-                else:
-                    # 保存当前chunk并开始新的
-                    if current_chunk:
-                        result.append(current_chunk.strip())
-                    current_chunk = paragraph
+        parts = []
+        length = 0
         
-        # 添加最后的chunk
-        if current_chunk:
-            result.append(current_chunk.strip())
+        for paragraph in content.split('\n\n'):
+            # 单个段落超长：先保存当前chunk，再切分该段落
+            if len(paragraph) > max_length:
+                if parts:
+                    result.append('\n\n'.join(parts).strip())
+                    parts = []
+                    length = 0
+                result.extend(self._split_long_text(paragraph, max_length))
+                continue
+            
+            # 加上这个段落会超出长度限制时，保存当前chunk并开始新的
+            added = len(paragraph) + (2 if parts else 0)
+            if length + added > max_length:
+                result.append('\n\n'.join(parts).strip())
+                parts = []
+                length = 0
+                added = len(paragraph)
+            parts.append(paragraph)
+            length += added
+        
+        if parts:
+            result.append('\n\n'.join(parts).strip())
+        
+        return [chunk for chunk in result if chunk]
+    
+    def _split_long_text(self, text, max_length):
+        """
+        切分单个超长段落
+        
+        每次取 max_length 长的窗口，在窗口内从后往前找 PARAGRAPH_BOUNDARIES 中最高一级的边界
+        （换行 → 中英文句末标点 → 空白）并在其后切开；窗口内没有任何边界时按长度硬切。
+        """
+        chunks = []
+        start = 0
+        while len(text) - start > max_length:
+            end = start + max_length
+            cut = end
+            for delimiters in PARAGRAPH_BOUNDARIES:
+                position = max(text.rfind(delimiter, start, end) for delimiter in delimiters)
+                if position > start:
+                    cut = position + 1
+                    break
+            
+            chunk = text[start:cut].strip()
+            if chunk:
+                chunks.append(chunk)
+            start = cut
         
-        return result
+        chunk = text[start:].strip()
+        if chunk:
+            chunks.append(chunk)
+        return chunks
     
     def _extract_message_data(self, page):
         """从Notion页面中提取消息数据"""
@@ -378,89 +1013,69 @@ class NotionHandler:
             if not content:  # 如果没有内容，跳过这条记录
                 return None
             
-            return {
-                "page_id": page["id"],
-                "title": title,
-                "content": content,
-                "template_choice": template_choice,
-                "tags": tags,
-                "model_choice": model_choice,
-                "created_time": page.get("created_time", ""),
-                "_raw_page_data": page  # 保存原始页面数据供连续对话功能使用
-            }
+            # 只保留调度器用到的字段和连续对话字段，不再持有整个原始页面JSON
+            return PendingMessage(
+                self,
+                page_id=page["id"],
+                title=title,
+                content=content,
+                template_choice=template_choice,
+                tags=tags,
+                model_choice=model_choice,
+                created_time=page.get("created_time", ""),
+                conversation=self._extract_conversation_fields(properties)
+            )
             
         except Exception as e:
             print(f"解析Notion数据时出错: {e}")
             return None
     
     def get_waiting_count(self):
-        """获取等待模板选择的记录数量"""
-        try:
-            url = f"https://api.notion.com/v1/databases/{self.database_id}/query"
-            
-            # 查询条件：LLM回复为空 AND (模板选择为空 OR 模型选择为空 or 背景为空)
-            payload = {
-                "filter": {
-                    "and": [
-                        {
-                            "property": self.output_prop,
-                            "rich_text": {
-                                "is_empty": True
-                            }
-                        },
-                        {
-                            "or": [
-                                {
-                                    "property": self.template_prop,
-                                    "select": {
-                                        "is_empty": True
-                                    }
-                                },
-                                {
-                                    "property": self.model_prop,
-                                    "select": {
-                                        "is_empty": True
-                                    }
-                                },
-                                {
-                                    "property": self.knowledge_prop,
-                                    "select": {
-                                        "is_empty": True
-                                    }
-                                }
-                            ]
-                        }
-                    ]
-                }
-            }
-            
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
-            return len(data.get("results", []))
-            
-        except Exception as e:
-            print(f"获取等待数量时出错: {e}")
-            return 0
+        """
+        获取等待模板选择的记录数量
+        
+        等待数量由 iter_pending_messages 的全量查询顺带统计；调度器应直接读取
+        last_waiting_count，此方法仅为单独查询时保留（会完整遍历一次）。
+        """
+        for _ in self.iter_pending_messages(max_backlog=0, full_sweep=True):
+            pass
+        return self.last_waiting_count
     
     def sync_template_options(self, template_names):
-        """同步模板选项到Notion数据库"""
+        """
+        同步模板选项到Notion数据库的模板选择属性（template_property_name）
+        
+        与Schema缓存中的现有选项比较，选项集合相同时不发送PATCH；
+        已有选项保留原ID与颜色，只为新选项指定颜色。
+        """
         try:
-            url = f"https://api.notion.com/v1/databases/{self.database_id}"
+            if not self.template_prop:
+                return False, "未配置 template_property_name"
+            
+            prop = self.get_database_schema(self.database_id).get(self.template_prop)
+            if prop is None:
+                return False, f"数据库中没有属性「{self.template_prop}」"
+            if prop.get("type") != "select":
+                return False, f"属性「{self.template_prop}」不是单选（select）类型"
+            
+            existing = {option.get("name"): option for option in prop.get("select", {}).get("options", [])}
+            names = list(dict.fromkeys(template_names))
+            if set(existing) == set(names):
+                return True, f"模板选项已是最新（{len(names)}个），无需更新"
             
             # 构建模板选项
             options = []
-            for name in template_names:
-                options.append({
-                    "name": name,
-                    "color": "default"
-                })
+            for name in names:
+                if name in existing:
+                    options.append({"id": existing[name].get("id"), "name": name})
+                else:
+                    options.append({"name": name, "color": "default"})
             
             # 更新数据库Schema
+            url = f"https://api.notion.com/v1/databases/{self.database_id}"
             payload = {
                 "properties": {
-                    "模板选择": {
+                    self.template_prop: {
                         "select": {
                             "options": options
                         }
@@ -468,24 +1083,27 @@ class NotionHandler:
                 }
             }
             
-            response = requests.patch(url, headers=self.headers, json=payload, timeout=30)
+            response = self._send_write_request("PATCH", url, payload, "同步模板选项")
             response.raise_for_status()
+            self.invalidate_schema(self.database_id)
             
-            return True, f"已同步{len(template_names)}个模板选项到Notion"
+            return True, f"已同步{len(names)}个模板选项到Notion"
             
         except Exception as e:
             print(f"同步模板选项时出错: {e}")
             return False, f"同步失败: {e}"
 
     def test_connection(self):
-        """测试Notion连接"""
+        """测试Notion连接，并检查配置的属性类型（使用Schema缓存）"""
         try:
-            url = f"https://api.notion.com/v1/databases/{self.database_id}"
-            response = requests.get(url, headers=self.headers, timeout=10)
-            response.raise_for_status()
-            return True, "Notion连接成功！"
+            properties = self.get_database_schema(self.database_id, timeout=self.test_timeout)
         except Exception as e:
             return False, f"Notion连接失败: {e}"
+        
+        issues = find_property_type_issues(self.config.get("notion", {}), properties)
+        if issues:
+            return True, "Notion连接成功，但属性配置有问题：\n" + "\n".join(issues)
+        return True, "Notion连接成功！"
 
     def get_context_from_knowledge_base(self, tags: list[str]) -> str:
         """
@@ -618,61 +1236,163 @@ class NotionHandler:
         return content[:max_length] + '\n\n（... 内容过长已截断）'
 
     def get_templates_from_notion(self):
-        """从Notion模板库数据库获取所有模板"""
+        """
+        从Notion模板库数据库获取所有模板
+        
+        查询结果跟随 next_cursor 翻页；各模板的提示词内容块由有界线程池并发获取
+        （settings.template_fetch_concurrency，仍受共享限流器约束），不再逐个串行请求。
+        """
         if not self.template_database_id:
             print("⚠️  未配置模板库数据库ID")
             return {}
         
         try:
-            url = f"https://api.notion.com/v1/databases/{self.template_database_id}/query"
+            url = self._template_query_url()
             
-            # 只获取启用状态的模板
-            payload = {
-                "filter": {
-                    "property": self.template_status_prop,
-                    "select": {
-                        "equals": "启用"
-                    }
-                },
-                "sorts": [
-                    {
-                        "property": self.template_name_prop,
-                        "direction": "ascending"
-                    }
-                ]
-            }
+            pages = self._query_all(url, self._enabled_templates_payload())
+            entries = self._template_entries(pages)
+            prompts = self._fetch_page_contents([page_id for page_id, _ in entries])
+            return self._build_templates_result(entries, prompts)
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
+        except Exception as e:
+            print(f"❌ 从Notion获取模板失败: {e}")
+            return {}
+
+    def _enabled_templates_payload(self):
+        """查询启用状态模板的请求体（按名称排序）"""
+        return {
+            "filter": {
+                "property": self.template_status_prop,
+                "select": {
+                    "equals": "启用"
+                }
+            },
+            "sorts": [
+                {
+                    "property": self.template_name_prop,
+                    "direction": "ascending"
+                }
+            ],
+            "page_size": 100
+        }
+    
+    def _template_entries(self, pages):
+        """从查询结果提取 (page_id, 模板数据) 列表（不含提示词内容）"""
+        entries = []
+        for page in pages:
+            template_data = self._extract_template_data(page, fetch_content=False)
+            if template_data:
+                entries.append((page["id"], template_data))
+        return entries
+    
+    def _build_templates_result(self, entries, prompts):
+        """
+        组合模板数据与提示词内容
+        
+        Args:
+            entries: (page_id, 模板数据) 列表
+            prompts: page_id -> 提示词内容
+        """
+        templates = {}
+        categories = set()
+        
+        for page_id, template_data in entries:
+            name = template_data['name']
+            templates[name] = {
+                'category': template_data['category'],
+                'prompt': prompts.get(page_id, ""),
+                'description': template_data['description'],
+                'updated': template_data['updated'],
+                'notion_page_id': page_id
+            }
+            categories.add(template_data['category'])
+        
+        print(f"✅ 从Notion同步了 {len(templates)} 个模板")
+        return {
+            'templates': templates,
+            'categories': list(categories)
+        }
+    
+    def get_template_changes(self, since):
+        """
+        获取 since 之后编辑过的模板页面，用于增量同步
+
+        不按状态过滤，以便发现被停用的模板；只有启用的模板才获取提示词内容。
+
+        Args:
+            since: ISO格式时间，按 last_edited_time 过滤（on_or_after）
+
+        Returns:
+            list: 每项为 {page_id, name, category, description, updated, enabled, prompt}
+
+        Raises:
+            查询或任一页面内容获取失败时抛出异常，调用方据此保留原有同步游标与本地模板
+        """
+        url = self._template_query_url(self.template_status_prop)
+        payload = {
+            "filter": {
+                "timestamp": "last_edited_time",
+                "last_edited_time": {"on_or_after": since}
+            },
+            "page_size": 100
+        }
+
+        changes = []
+        for page in self._query_all(url, payload):
+            template_data = self._extract_template_data(page, fetch_content=False)
+            if not template_data:
+                continue
+            template_data['page_id'] = page["id"]
+            status = self._extract_select_from_property(page.get("properties", {}), self.template_status_prop)
+            template_data['enabled'] = status == "启用"
+            changes.append(template_data)
+
+        prompts = self._fetch_page_contents([c['page_id'] for c in changes if c['enabled']])
+        for change in changes:
+            change['prompt'] = prompts.get(change['page_id'], "")
+
+        return changes
+
+    def _query_all(self, url, payload):
+        """执行数据库查询并跟随 next_cursor 取回全部结果，请求失败时抛出异常"""
+        payload = dict(payload)
+        results = []
+        while True:
+            response = self._send_request("POST", url, payload)
             response.raise_for_status()
-            
             data = response.json()
-            templates = {}
-            categories = set()
-            
-            for page in data.get("results", []):
-                template_data = self._extract_template_data(page)
-                if template_data:
-                    name = template_data['name']
-                    templates[name] = {
-                        'category': template_data['category'],
-                        'prompt': template_data['prompt'],
-                        'description': template_data['description'],
-                        'updated': template_data['updated']
-                    }
-                    categories.add(template_data['category'])
-            
-            print(f"✅ 从Notion同步了 {len(templates)} 个模板")
-            return {
-                'templates': templates,
-                'categories': list(categories)
-            }
+            results.extend(data.get("results", []))
             
-        except Exception as e:
-            print(f"❌ 从Notion获取模板失败: {e}")
+            next_cursor = data.get("next_cursor")
+            if not data.get("has_more") or not next_cursor:
+                return results
+            payload["start_cursor"] = next_cursor
+    
+    def _fetch_page_contents(self, page_ids):
+        """
+        并发获取多个页面的文本内容
+        
+        Returns:
+            dict: page_id -> 文本内容
+        
+        Raises:
+            任一页面获取失败时抛出异常
+        """
+        if not page_ids:
             return {}
+        
+        max_workers = max(1, int(self.settings.get("template_fetch_concurrency", 3)))
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(page_ids)),
+                                thread_name_prefix="template-fetch") as executor:
+            contents = executor.map(self._get_page_content, page_ids)
+            return dict(zip(page_ids, contents))
     
-    def _extract_template_data(self, page):
-        """从Notion页面提取模板数据"""
+    def _extract_template_data(self, page, fetch_content=True):
+        """
+        从Notion页面提取模板数据
+        
+        fetch_content=False 时不请求页面内容块，prompt 留空由调用方另行获取
+        """
         try:
             properties = page.get("properties", {})
             
@@ -707,7 +1427,7 @@ class NotionHandler:
             updated = page.get("last_edited_time", datetime.now().isoformat())
             
             # 获取提示词内容（从页面内容块中获取）
-            prompt = self._get_page_content(page["id"])
+            prompt = self._get_page_content(page["id"]) if fetch_content else ""
             
             return {
                 'name': name,
@@ -722,25 +1442,20 @@ class NotionHandler:
             return None
     
     def _get_page_content(self, page_id):
-        """获取页面的文本内容"""
-        try:
-            url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-            response = requests.get(url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
-            content_parts = []
-            
-            for block in data.get("results", []):
-                text = self._extract_text_from_block(block)
-                if text:
-                    content_parts.append(text)
-            
-            return "\n\n".join(content_parts)
-            
-        except Exception as e:
-            print(f"获取页面内容失败: {e}")
-            return ""
+        """
+        获取页面的文本内容（跟随分页，超过100个内容块的提示词不会被截断）
+        
+        Raises:
+            请求失败时抛出异常，不返回空字符串，避免以空提示词覆盖已有模板
+        """
+        content_parts = []
+        
+        for block in self._iter_block_children(page_id):
+            text = self._extract_text_from_block(block)
+            if text:
+                content_parts.append(text)
+        
+        return "\n\n".join(content_parts)
     
     def _extract_text_from_block(self, block):
         """从Notion块中提取文本"""
@@ -772,15 +1487,23 @@ class NotionHandler:
         
         return "".join(text_parts)
     
-    def sync_template_to_notion(self, name, template_data):
-        """将模板同步到Notion（创建或更新）"""
+    def sync_template_to_notion(self, name, template_data, page_id=None, lookup=True):
+        """
+        将模板同步到Notion（创建或更新）
+        
+        Args:
+            page_id: 已知的模板页面ID（如来自 get_template_page_ids）
+            lookup: 未提供 page_id 时是否按名称查询；为False时直接创建新页面
+        """
         if not self.template_database_id:
             print("⚠️  未配置模板库数据库ID")
             return False
         
         try:
             # 检查模板是否已存在
-            existing_page_id = self._find_template_page(name)
+            existing_page_id = page_id
+            if existing_page_id is None and lookup:
+                existing_page_id = self._find_template_page(name)
             
             if existing_page_id:
                 # 更新现有模板
@@ -793,10 +1516,35 @@ class NotionHandler:
             print(f"同步模板到Notion失败: {e}")
             return False
     
+    def get_template_page_ids(self):
+        """
+        一次（分页）查询模板库，返回 模板名称 -> 页面ID 的映射
+
+        Raises:
+            查询失败时抛出异常，避免误把已存在的模板当作新模板重复创建
+        """
+        url = self._template_query_url()
+        page_ids = {}
+        for page in self._query_all(url, {"page_size": 100}):
+            template_data = self._extract_template_data(page, fetch_content=False)
+            if template_data:
+                page_ids.setdefault(template_data['name'], page["id"])
+        return page_ids
+    
+    def get_template_page_id_set(self):
+        """
+        模板库中现存全部页面（任意状态）的ID集合；已删除（移入回收站）的页面不会出现在查询结果中
+
+        Raises:
+            查询失败时抛出异常，避免误把本地模板当作已在Notion中删除
+        """
+        url = self._template_query_url()
+        return {page["id"] for page in self._query_all(url, {"page_size": 100})}
+    
     def _find_template_page(self, name):
         """查找指定名称的模板页面"""
         try:
-            url = f"https://api.notion.com/v1/databases/{self.template_database_id}/query"
+            url = self._query_url(self.template_database_id, required=(self.template_name_prop,))
             
             payload = {
                 "filter": {
@@ -807,7 +1555,7 @@ class NotionHandler:
                 }
             }
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
+            response = self._send_request("POST", url, payload)
             response.raise_for_status()
             
             data = response.json()
@@ -884,12 +1632,18 @@ class NotionHandler:
                         }
                     }
                 },
-                "children": content_blocks
+                # 创建请求同样最多带100个子块，其余在创建后分批追加
+                "children": content_blocks[:MAX_CHILDREN_PER_REQUEST]
             }
             
-            response = requests.post(url, headers=self.headers, json=payload, timeout=30)
+            response = self._send_request("POST", url, payload)
             response.raise_for_status()
             
+            remaining_blocks = content_blocks[MAX_CHILDREN_PER_REQUEST:]
+            if remaining_blocks and not self._append_blocks(response.json()["id"], remaining_blocks):
+                print(f"❌ 模板 {name} 已创建，但提示词内容未完整写入")
+                return False
+            
             print(f"✅ 创建模板成功: {name}")
             return True
             
@@ -903,35 +1657,15 @@ class NotionHandler:
             # 更新页面属性
             url = f"https://api.notion.com/v1/pages/{page_id}"
             
-            payload = {
-                "properties": {
-                    self.template_category_prop: {
-                        "select": {
-                            "name": template_data.get("category", "基础")
-                        }
-                    },
-                    self.template_description_prop: {
-                        "rich_text": [
-                            {
-                                "text": {
-                                    "content": template_data.get("description", "")
-                                }
-                            }
-                        ]
-                    },
-                    self.template_status_prop: {
-                        "select": {
-                            "name": "启用"
-                        }
-                    }
-                }
-            }
+            payload = {"properties": self._build_template_properties(template_data)}
             
-            response = requests.patch(url, headers=self.headers, json=payload, timeout=30)
+            response = self._send_write_request("PATCH", url, payload, "更新模板属性")
             response.raise_for_status()
             
-            # 更新页面内容（清空并重新写入）
-            self._update_page_content(page_id, template_data.get("prompt", ""))
+            # 更新页面内容（按内容块差异更新）；失败时不能记为已推送
+            if not self._update_page_content(page_id, template_data.get("prompt", "")):
+                print(f"❌ 更新模板内容失败: {name}")
+                return False
             
             print(f"✅ 更新模板成功: {name}")
             return True
@@ -940,55 +1674,137 @@ class NotionHandler:
             print(f"更新模板页面失败: {e}")
             return False
     
+    def _build_template_properties(self, template_data):
+        """更新模板页面时写入的属性（分类、描述，并设为启用）"""
+        return {
+            self.template_category_prop: {
+                "select": {
+                    "name": template_data.get("category", "基础")
+                }
+            },
+            self.template_description_prop: {
+                "rich_text": [
+                    {
+                        "text": {
+                            "content": template_data.get("description", "")
+                        }
+                    }
+                ]
+            },
+            self.template_status_prop: {
+                "select": {
+                    "name": "启用"
+                }
+            }
+        }
+    
     def _update_page_content(self, page_id, content):
-        """更新页面内容"""
+        """
+        更新页面内容（按内容块差异更新，不再清空后重写）
+        
+        现有内容块的文本与新内容的段落逐一比较：未变化的块保留，改动的段落块原地改写，
+        只删除多余的块、只在正确位置（after）插入新增的段落。
+        先改写与插入、最后删除，更新过程中页面不会出现空白。
+        """
         try:
-            # 先获取现有的内容块
-            blocks_url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-            response = requests.get(blocks_url, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            
-            data = response.json()
-            existing_blocks = data.get("results", [])
-            
-            # 删除现有的内容块
-            for block in existing_blocks:
-                block_id = block["id"]
-                delete_url = f"https://api.notion.com/v1/blocks/{block_id}"
-                requests.delete(delete_url, headers=self.headers, timeout=30)
-            
-            # 添加新的内容
+            existing_blocks = list(self._iter_block_children(page_id))
             paragraphs = self._split_content_into_paragraphs(content)
-            children = []
-            
-            for paragraph in paragraphs:
-                if paragraph.strip():
-                    children.append({
-                        "object": "block",
-                        "type": "paragraph",
-                        "paragraph": {
-                            "rich_text": [
-                                {
-                                    "type": "text",
-                                    "text": {
-                                        "content": paragraph
-                                    }
-                                }
-                            ]
-                        }
-                    })
+            layout, deletions = self._plan_block_diff(existing_blocks, paragraphs)
+            
+            counts = {"keep": 0, "update": 0, "insert": 0}
+            # 没有保留的块时，新段落整体追加到现有内容块（最后才删除）之后
+            anchor = existing_blocks[-1]["id"] if existing_blocks else PAGE_START
+            pending = []
+            for block, text, action in layout:
+                counts[action] += 1
+                if action == "insert":
+                    pending.append(text)
+                    continue
+                
+                if pending:
+                    if not self._append_blocks(page_id, self._build_paragraph_blocks(pending), anchor):
+                        return False
+                    pending = []
+                if action == "update" and not self._update_paragraph_block(block["id"], text):
+                    return False
+                anchor = block["id"]
+            
+            if pending and not self._append_blocks(page_id, self._build_paragraph_blocks(pending), anchor):
+                return False
             
-            if children:
-                append_url = f"https://api.notion.com/v1/blocks/{page_id}/children"
-                payload = {"children": children}
-                response = requests.patch(append_url, headers=self.headers, json=payload, timeout=30)
-                response.raise_for_status()
+            failed = 0
+            for block_id in deletions:
+                response = self._send_write_request("DELETE", f"https://api.notion.com/v1/blocks/{block_id}",
+                                                    None, "删除内容块")
+                if response.status_code != 200:
+                    failed += 1
+            
+            print(f"✅ 页面内容已更新：保留 {counts['keep']} 个，改写 {counts['update']} 个，"
+                  f"新增 {counts['insert']} 个，删除 {len(deletions) - failed} 个内容块")
+            if failed:
+                print(f"⚠️ 有 {failed} 个旧内容块删除失败")
+                return False
             
             return True
             
         except Exception as e:
             print(f"更新页面内容失败: {e}")
             return False
+    
+    def _plan_block_diff(self, existing_blocks, paragraphs):
+        """
+        比较现有内容块与新段落，生成改动最少的更新计划
+        
+        Returns:
+            tuple: (layout, deletions)
+                layout: 按最终顺序排列的 (block, text, action)；action 为 "keep"（保留）、
+                        "update"（原地改写该块文本）或 "insert"（新建，block 为 None）
+                deletions: 需要删除的内容块ID列表
+        """
+        paragraphs = [paragraph for paragraph in paragraphs if paragraph.strip()]
+        # 只有段落块能原地改写为新段落，其它类型的块即使文本相同也不视为一致
+        old_keys = [(block.get("type"), self._extract_text_from_block(block)) for block in existing_blocks]
+        new_keys = [("paragraph", paragraph) for paragraph in paragraphs]
+        
+        layout = []
+        deletions = []
+        matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            old_blocks = existing_blocks[i1:i2]
+            new_texts = paragraphs[j1:j2]
+            
+            if tag == "equal":
+                layout.extend((block, text, "keep") for block, text in zip(old_blocks, new_texts))
+                continue
+            
+            for index, text in enumerate(new_texts):
+                block = old_blocks[index] if index < len(old_blocks) else None
+                if block is not None and block.get("type") == "paragraph":
+                    layout.append((block, text, "update"))
+                else:
+                    if block is not None:
+                        deletions.append(block["id"])
+                    layout.append((None, text, "insert"))
+            deletions.extend(block["id"] for block in old_blocks[len(new_texts):])
+        
+        # Notion只能在某个块之后插入：开头需要插入时，把第一个保留的块改写为第一段，原文本改为插入
+        first_reused = next((index for index, (block, _, _) in enumerate(layout) if block is not None), None)
+        if first_reused:
+            block, text, _ = layout[first_reused]
+            layout[first_reused] = (None, text, "insert")
+            layout[0] = (block, layout[0][1], "update")
+        
+        return layout, deletions
+    
+    def _update_paragraph_block(self, block_id, text):
+        """原地改写一个段落块的文本"""
+        url = f"https://api.notion.com/v1/blocks/{block_id}"
+        payload = {"paragraph": self._build_paragraph_blocks([text])[0]["paragraph"]}
+        response = self._send_write_request("PATCH", url, payload, "改写内容块")
+        if response.status_code != 200:
+            print(f"❌ 改写内容块失败: HTTP {response.status_code}")
+            return False
+        return True
 
     def test_template_database_connection(self):
         """测试模板库数据库连接"""
@@ -996,9 +1812,7 @@ class NotionHandler:
             return False, "未配置模板库数据库ID"
         
         try:
-            url = f"https://api.notion.com/v1/databases/{self.template_database_id}"
-            response = requests.get(url, headers=self.headers, timeout=10)
-            response.raise_for_status()
+            self.get_database_schema(self.template_database_id, timeout=self.test_timeout)
             return True, "模板库数据库连接成功！"
         except Exception as e:
             return False, f"模板库数据库连接失败: {e}"
@@ -1018,17 +1832,10 @@ class NotionHandler:
             dict: 响应数据
         """
         try:
-            if method.upper() == "GET":
-                response = requests.get(url, headers=self.headers, timeout=30)
-            elif method.upper() == "POST":
-                response = requests.post(url, headers=self.headers, json=payload, timeout=30)
-            elif method.upper() == "PATCH":
-                response = requests.patch(url, headers=self.headers, json=payload, timeout=30)
-            elif method.upper() == "DELETE":
-                response = requests.delete(url, headers=self.headers, timeout=30)
+            if method.upper() == "PATCH":
+                response = self._send_write_request(method, url, payload)
             else:
-                raise ValueError(f"不支持的HTTP方法: {method}")
-            
+                response = self._send_request(method, url, payload)
             response.raise_for_status()
             return response.json()
             
@@ -1061,45 +1868,32 @@ class NotionHandler:
             print(f"更新页面属性失败: {e}")
             return False
     
-    def extract_conversation_fields_from_message(self, message_data: dict) -> dict:
+    def extract_conversation_fields_from_message(self, message_data) -> dict:
         """
         从消息数据中提取连续对话字段（为向后兼容添加的方法）
         
         Args:
-            message_data: 来自_extract_message_data的消息数据
+            message_data: 来自_extract_message_data的消息（PendingMessage，字段已在解析时提取），
+                          或带 _raw_page_data 的旧式消息字典
             
         Returns:
             dict: 连续对话字段
         """
-        # 从原始页面数据中提取连续对话字段
-        page_data = message_data.get("_raw_page_data", {})
-        if not page_data:
-            return {
-                "session_id": "",
-                "parent_id": "",
-                "session_status": "",
-                "conversation_turn": 0,
-                "session_title": "",
-                "context_length": 0
-            }
-        
-        properties = page_data.get("properties", {})
-        
-        # 获取字段名称（使用配置或默认值）
-        session_id_prop = getattr(self, 'session_id_prop', 'session_id_property')
-        parent_id_prop = getattr(self, 'parent_id_prop', 'parent_id_property')
-        session_status_prop = getattr(self, 'session_status_prop', 'session_status_property')
-        conversation_turn_prop = getattr(self, 'conversation_turn_prop', 'conversation_turn_property')
-        session_title_prop = getattr(self, 'session_title_prop', 'session_title_property')
-        context_length_prop = getattr(self, 'context_length_prop', 'context_length_property')
+        if isinstance(message_data, PendingMessage):
+            return message_data.conversation_fields
         
+        page_data = message_data.get("_raw_page_data", {})
+        return self._extract_conversation_fields(page_data.get("properties", {}))
+    
+    def _extract_conversation_fields(self, properties: dict) -> dict:
+        """从页面属性中提取连续对话字段"""
         return {
-            "session_id": self._extract_text_from_property(properties, session_id_prop),
-            "parent_id": self._extract_text_from_property(properties, parent_id_prop),
-            "session_status": self._extract_select_from_property(properties, session_status_prop),
-            "conversation_turn": self._extract_number_from_property(properties, conversation_turn_prop),
-            "session_title": self._extract_text_from_property(properties, session_title_prop),
-            "context_length": self._extract_number_from_property(properties, context_length_prop)
+            "session_id": self._extract_text_from_property(properties, self.session_id_prop),
+            "parent_id": self._extract_text_from_property(properties, self.parent_id_prop),
+            "session_status": self._extract_select_from_property(properties, self.session_status_prop),
+            "conversation_turn": self._extract_number_from_property(properties, self.conversation_turn_prop),
+            "session_title": self._extract_text_from_property(properties, self.session_title_prop),
+            "context_length": self._extract_number_from_property(properties, self.context_length_prop)
         }
     
     def _extract_text_from_property(self, properties: dict, prop_name: str) -> str:
@@ -1159,12 +1953,12 @@ class NotionHandler:
             
             # 映射字段（使用配置中的字段名称）
             field_mapping = {
-                "session_id": self.config.get("notion", {}).get("session_id_property", "会话ID"),
-                "parent_id": self.config.get("notion", {}).get("parent_id_property", "父消息ID"),
-                "session_status": self.config.get("notion", {}).get("session_status_property", "会话状态"),
-                "conversation_turn": self.config.get("notion", {}).get("conversation_turn_property", "对话轮次"),
-                "session_title": self.config.get("notion", {}).get("session_title_property", "会话标题"),
-                "context_length": self.config.get("notion", {}).get("context_length_property", "上下文长度")
+                "session_id": self.session_id_prop,
+                "parent_id": self.parent_id_prop,
+                "session_status": self.session_status_prop,
+                "conversation_turn": self.conversation_turn_prop,
+                "session_title": self.session_title_prop,
+                "context_length": self.context_length_prop
             }
             
             for field_key, notion_prop in field_mapping.items():
@@ -1203,4 +1997,190 @@ class NotionHandler:
                 
         except Exception as e:
             print(f"❌ 更新会话字段失败: {e}")
-            return False
\ No newline at end of file
+            return False
+
+
+class PendingMessage:
+    """
+    待处理消息（由 NotionHandler._extract_message_data 创建）
+    
+    只保存调度器用到的字段和解析时已提取的连续对话字段，不持有原始页面JSON，
+    积压数千条时内存占用远小于字典。支持 message["page_id"] / message.get(...) 的字典式访问；
+    需要原始页面数据时通过 raw_page_data（或 message["_raw_page_data"]）重新获取。
+    """
+    
+    FIELDS = ("page_id", "title", "content", "template_choice", "tags", "model_choice", "created_time")
+    CONVERSATION_FIELDS = ("session_id", "parent_id", "session_status",
+                           "conversation_turn", "session_title", "context_length")
+    
+    __slots__ = FIELDS + CONVERSATION_FIELDS + ("_notion_handler",)
+    
+    def __init__(self, notion_handler, page_id, title="", content="", template_choice="", tags=None,
+                 model_choice="", created_time="", conversation=None):
+        self._notion_handler = notion_handler
+        self.page_id = page_id
+        self.title = title
+        self.content = content
+        self.template_choice = template_choice
+        self.tags = tags or []
+        self.model_choice = model_choice
+        self.created_time = created_time
+        
+        conversation = conversation or {}
+        for field in self.CONVERSATION_FIELDS:
+            setattr(self, field, conversation.get(field, 0 if field in ("conversation_turn", "context_length") else ""))
+    
+    @property
+    def conversation_fields(self):
+        """连续对话字段字典（与 extract_conversation_fields_from_message 的返回值相同）"""
+        return {field: getattr(self, field) for field in self.CONVERSATION_FIELDS}
+    
+    @property
+    def raw_page_data(self):
+        """按需重新获取原始页面JSON（不缓存）；获取失败时返回空字典"""
+        try:
+            response = self._notion_handler._send_request(
+                "GET", f"https://api.notion.com/v1/pages/{self.page_id}"
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            print(f"获取页面 {self.page_id[:8]}... 原始数据时出错: {e}")
+            return {}
+    
+    def __getitem__(self, key):
+        if key == "_raw_page_data":
+            return self.raw_page_data
+        if key in self.FIELDS or key in self.CONVERSATION_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+    
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def __contains__(self, key):
+        return key == "_raw_page_data" or key in self.FIELDS or key in self.CONVERSATION_FIELDS
+    
+    def to_dict(self):
+        """转换为普通字典（不含原始页面数据）"""
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        data.update(self.conversation_fields)
+        return data
+    
+    def __repr__(self):
+        return f"PendingMessage(page_id={self.page_id!r}, title={self.title!r})"
+
+
+class IncrementalReplyWriter:
+    """
+    流式回复的渐进写入器
+    
+    模型仍在生成时，把已完整的段落（以空行分隔）追加到页面中，
+    用户几秒内即可看到输出；剩余内容与时间戳在 finish 时写入。
+    """
+    
+    def __init__(self, notion_handler, page_id):
+        self.notion_handler = notion_handler
+        self.page_id = page_id
+        self.started = False
+        # 两次写入之间的最短间隔，避免每个段落都单独请求一次
+        self.flush_interval = notion_handler.settings.get("stream_flush_interval", 1.0)
+        self._streamed = []      # 已收到的全部文本
+        self._buffer = ""        # 尚未写入页面的文本
+        self._consumed = 0       # 已写入页面的文本长度（对应 _streamed 的前缀）
+        self._last_flush = 0.0
+        self._last_block_id = None  # 最后写入的内容块ID，作为下一次追加的锚点
+        self._lock = threading.Lock()
+    
+    def _append(self, blocks):
+        """紧接上次写入的内容块追加，返回是否成功"""
+        success, last_block_id = self.notion_handler._append_blocks_at(self.page_id, blocks, self._last_block_id)
+        if success:
+            self._last_block_id = last_block_id
+        return success
+    
+    def start(self):
+        """立即写入分割线与"🤖 AI 回复"标题（失败时由 finish 一并写入）"""
+        try:
+            self.started = self._append(self.notion_handler._build_reply_header_blocks())
+        except Exception as e:
+            print(f"⚠️ 写入回复标题失败，将在生成结束后写入: {e}")
+            self.started = False
+        return self.started
+    
+    def on_delta(self, kind, text):
+        """作为 LLMHandler 的 on_delta 回调使用，仅写入正式内容（不含推理过程）"""
+        if kind == "content":
+            self.feed(text)
+    
+    def feed(self, text):
+        """接收一段增量文本，有完整段落且距上次写入已超过间隔时写入页面"""
+        with self._lock:
+            self._streamed.append(text)
+            self._buffer += text
+            if not self.started:
+                return
+            if time.monotonic() - self._last_flush < self.flush_interval:
+                return
+            
+            boundary = self._buffer.rfind("\n\n")
+            # 末尾的分隔线可能是合并模式标题行前的分隔（最终回复中会被去掉），留到 finish 再决定
+            previous = self._buffer.rfind("\n\n", 0, boundary)
+            if boundary > 0 and self._buffer[previous + 2 if previous >= 0 else 0:boundary].strip() == "---":
+                boundary = previous
+            if boundary <= 0:
+                return
+            
+            complete = self._buffer[:boundary]
+            paragraphs = self.notion_handler._split_content_into_paragraphs(complete)
+            blocks = self.notion_handler._build_paragraph_blocks(paragraphs)
+            try:
+                appended = not blocks or self._append(blocks)
+            except Exception as e:
+                # Notion 暂时不可用不能中断模型生成
+                print(f"⚠️ 渐进写入失败，剩余内容将在生成结束后写入: {e}")
+                appended = False
+            if not appended:
+                return  # 写入失败时保留缓冲，finish 时再写
+            
+            self._consumed += boundary + 2
+            self._buffer = self._buffer[boundary + 2:]
+            self._last_flush = time.monotonic()
+    
+    def finish(self, final_text):
+        """
+        写入剩余内容与时间戳
+        
+        final_text 为最终回复（可能已去除合并模式的标题行，或来自推理内容），
+        只补写尚未写入页面的部分：按段落与已写入内容逐段比对，从第一个不一致的段落开始写入。
+        """
+        with self._lock:
+            streamed = "".join(self._streamed)
+            written = self._paragraphs(streamed[:self._consumed])
+            final = self._paragraphs(final_text)
+            
+            matched = 0
+            while matched < min(len(written), len(final)) and written[matched] == final[matched]:
+                matched += 1
+            remaining = "\n\n".join(final[matched:])
+            
+            blocks = [] if self.started else self.notion_handler._build_reply_header_blocks()
+            paragraphs = self.notion_handler._split_content_into_paragraphs(remaining.strip())
+            blocks.extend(self.notion_handler._build_paragraph_blocks(paragraphs))
+            blocks.append(self.notion_handler._build_timestamp_block())
+            
+            if not self._append(blocks):
+                return False
+            
+            self.started = True
+            self._consumed = len(streamed)
+            self._buffer = ""
+            return True
+    
+    @staticmethod
+    def _paragraphs(text):
+        """按空行分段，去除各段首尾空白与空段"""
+        return [paragraph.strip() for paragraph in text.split("\n\n") if paragraph.strip()]
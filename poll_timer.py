@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自适应轮询计时器
+供 MessageScheduler 与 CloudScheduler 共用，替代固定间隔的 sleep 循环：
+- trigger() 立即发起一轮检查（GUI 同步按钮、/start、/trigger）
+- wake() 仅唤醒调度循环处理推送队列，不打断轮询节奏
+- cancel() 让等待中的调度循环立即退出
+- 有积压时按最短间隔轮询，空闲时间隔按倍数递增直到上限
+"""
+
+import threading
+import time
+
+
+class AdaptivePollTimer:
+    """基于条件变量的可唤醒轮询计时器"""
+
+    def __init__(self, base_interval, min_interval=5, max_interval=600, backoff_factor=2.0):
+        """
+        Args:
+            base_interval: 空闲时的初始轮询间隔（秒），即 settings.check_interval
+            min_interval: 有积压时的轮询间隔（秒）
+            max_interval: 空闲退避的间隔上限（秒）
+            backoff_factor: 连续空闲时间隔的增长倍数
+        """
+        self.base_interval = base_interval
+        self.min_interval = min(min_interval, base_interval)
+        self.max_interval = max(max_interval, base_interval)
+        self.backoff_factor = backoff_factor
+
+        self._condition = threading.Condition()
+        self._next_poll = 0.0          # 下次轮询的 monotonic 时间，0 表示立即
+        self._poll_requested = False
+        self._woken = False
+        self._cancelled = False
+        self._idle_rounds = 0
+        self.current_interval = base_interval
+
+    @classmethod
+    def from_settings(cls, settings):
+        """从配置的 settings 部分创建（check_interval / min_check_interval / max_check_interval / idle_backoff_factor）"""
+        settings = settings or {}
+        return cls(
+            base_interval=settings.get("check_interval", 120),
+            min_interval=settings.get("min_check_interval", 5),
+            max_interval=settings.get("max_check_interval", 600),
+            backoff_factor=settings.get("idle_backoff_factor", 2.0)
+        )
+
+    def reset(self):
+        """重新启动前调用：清除取消状态，下一轮立即检查"""
+        with self._condition:
+            self._cancelled = False
+            self._poll_requested = False
+            self._woken = False
+            self._idle_rounds = 0
+            self._next_poll = 0.0
+            self.current_interval = self.base_interval
+
+    def trigger(self):
+        """请求立即发起一轮检查"""
+        with self._condition:
+            self._poll_requested = True
+            self._condition.notify_all()
+
+    def wake(self):
+        """唤醒等待中的调度循环（不发起检查）"""
+        with self._condition:
+            self._woken = True
+            self._condition.notify_all()
+
+    def cancel(self):
+        """取消等待，调度循环应随即退出"""
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def poll_due(self):
+        """本轮是否应该检查；返回True时同时消费掉 trigger() 的请求"""
+        with self._condition:
+            if self._poll_requested or time.monotonic() >= self._next_poll:
+                self._poll_requested = False
+                return True
+            return False
+
+    def schedule_next(self, has_backlog=False, delay=None):
+        """
+        根据本轮结果安排下次检查
+
+        Args:
+            has_backlog: 本轮是否有待处理消息（有则缩短间隔，否则空闲退避）
+            delay: 显式指定的等待秒数（如出错后的冷却时间），优先于自适应间隔
+        """
+        with self._condition:
+            if delay is not None:
+                interval = delay
+            elif has_backlog:
+                self._idle_rounds = 0
+                interval = self.min_interval
+            else:
+                interval = min(self.max_interval,
+                               self.base_interval * (self.backoff_factor ** self._idle_rounds))
+                self._idle_rounds += 1
+            self.current_interval = interval
+            self._next_poll = time.monotonic() + interval
+
+    def wait(self):
+        """
+        等待到下次检查时间，或被 trigger / wake / cancel 提前唤醒
+
+        Returns:
+            bool: False 表示已取消
+        """
+        with self._condition:
+            while not (self._cancelled or self._poll_requested or self._woken):
+                remaining = self._next_poll - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            self._woken = False
+            return not self._cancelled
+
+    @property
+    def seconds_until_next_poll(self):
+        with self._condition:
+            return max(0.0, self._next_poll - time.monotonic())
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+令牌桶限流器
+Notion 对每个集成大约允许 3 次请求/秒。同一集成（API Key）的所有 NotionHandler
+共用一个令牌桶；收到 429/503 时按 Retry-After 暂停整个桶，而不只是当前请求。
+"""
+
+import random
+import threading
+import time
+
+# Notion 官方给出的平均速率上限
+DEFAULT_RATE = 3.0
+DEFAULT_BURST = 3
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class TokenBucketRateLimiter:
+    """线程安全的令牌桶限流器"""
+
+    def __init__(self, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+        """
+        Args:
+            rate: 每秒补充的令牌数（即平均请求速率）
+            capacity: 桶容量（允许的突发请求数）
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self.total_wait_time = 0.0
+        self.last_wait_time = 0.0
+        self.throttled_count = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    def reserve(self):
+        """
+        预约一个令牌，返回调用方需要等待的秒数（不在此处睡眠，便于异步代码复用）
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate, self._blocked_until - now)
+            self.last_wait_time = wait
+            self.total_wait_time += wait
+            return wait
+
+    def acquire(self):
+        """获取一个令牌，必要时阻塞等待；返回实际等待的秒数"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self, delay):
+        """收到限流响应后，在 delay 秒内暂停所有请求"""
+        with self._lock:
+            self.throttled_count += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+    @property
+    def current_wait_time(self):
+        """此刻发起新请求需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            return max(0.0, (1 - self._tokens) / self.rate, self._blocked_until - now)
+
+    def get_stats(self):
+        """获取限流统计（供状态接口展示）"""
+        return {
+            "rate": self.rate,
+            "current_wait_time": round(self.current_wait_time, 3),
+            "last_wait_time": round(self.last_wait_time, 3),
+            "total_wait_time": round(self.total_wait_time, 3),
+            "throttled_count": self.throttled_count
+        }
+
+
+def get_rate_limiter(key, rate=DEFAULT_RATE, capacity=DEFAULT_BURST):
+    """获取按 key（通常为 API Key）共享的限流器"""
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = TokenBucketRateLimiter(rate, capacity)
+            _limiters[key] = limiter
+        return limiter
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 响应头（秒数），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None, base=1.0, cap=60.0):
+    """
+    计算第 attempt 次重试（从0开始）前的等待时间：指数退避 + 随机抖动
+
+    有 Retry-After 时以其为下限，避免早于服务端要求的时间重试。
+    """
+    delay = min(cap, base * (2 ** attempt))
+    delay += random.uniform(0, delay / 2)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
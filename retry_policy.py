@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+重试策略
+对 LLM 与 Notion 调用统一按错误类型决定是否重试：
+- 可重试：超时、连接错误、HTTP 408/425/429/5xx
+- 不可重试：其余 4xx（参数错误、鉴权失败、资源不存在等）
+重试间隔为指数退避 + 随机抖动，并受单条消息截止时间约束。
+同时支持 requests（同步）与 aiohttp（异步，可选依赖）抛出的异常。
+"""
+
+import asyncio
+import contextvars
+import time
+from contextlib import contextmanager
+
+import requests
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from rate_limiter import backoff_delay, parse_retry_after
+
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# 单条消息的截止时间；线程与 asyncio 任务各自独立
+_deadline = contextvars.ContextVar("message_deadline", default=None)
+
+
+def is_retryable_status(status_code):
+    """判断HTTP状态码是否值得重试"""
+    return status_code in RETRYABLE_STATUS_CODES or 500 <= status_code < 600
+
+
+def is_retryable_error(error):
+    """判断异常是否为可重试的临时错误"""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return is_retryable_status(error.response.status_code)
+    if aiohttp is not None:
+        if isinstance(error, aiohttp.ClientResponseError):
+            return is_retryable_status(error.status)
+        if isinstance(error, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+            return True
+    return isinstance(error, asyncio.TimeoutError)
+
+
+@contextmanager
+def message_deadline(seconds):
+    """
+    为当前线程（或 asyncio 任务）设置单条消息的截止时间，期间所有重试都不会超过该时间
+
+    用法:
+        with message_deadline(300):
+            process(message)
+    """
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """距离消息截止时间的剩余秒数；未设置截止时间时返回 None"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+class RetryPolicy:
+    """按错误分类执行重试的策略"""
+
+    def __init__(self, max_retries=3, base_delay=1.0, max_delay=30.0):
+        self.max_retries = max(0, int(max_retries))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @classmethod
+    def from_settings(cls, settings):
+        """从配置的 settings 部分创建（settings.max_retries / retry_base_delay / retry_max_delay）"""
+        settings = settings or {}
+        return cls(
+            max_retries=settings.get("max_retries", 3),
+            base_delay=settings.get("retry_base_delay", 1.0),
+            max_delay=settings.get("retry_max_delay", 30.0)
+        )
+
+    def run(self, operation, description="请求", should_retry=None):
+        """
+        执行操作，遇到可重试错误时退避后重试
+
+        Args:
+            operation: 可调用对象 operation(attempt)，attempt 从0开始；失败时抛出异常
+            description: 日志中的操作描述
+            should_retry: 额外的判断函数 should_retry(error)，返回False时不再重试
+
+        Returns:
+            operation 的返回值
+
+        Raises:
+            最后一次失败的异常（不可重试、次数用尽或超过消息截止时间）
+        """
+        attempt = 0
+        while True:
+            try:
+                return operation(attempt)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, description, should_retry)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def run_async(self, operation, description="请求", should_retry=None):
+        """run 的异步版本：operation(attempt) 返回协程，退避期间不阻塞事件循环"""
+        attempt = 0
+        while True:
+            try:
+                return await operation(attempt)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, description, should_retry)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _retry_delay(self, error, attempt, description, should_retry=None):
+        """计算下次重试前的等待秒数；不应再重试时返回 None"""
+        if not is_retryable_error(error) or (should_retry and not should_retry(error)):
+            return None
+        if attempt >= self.max_retries:
+            print(f"❌ {description}重试 {self.max_retries} 次后仍失败: {error}")
+            return None
+
+        # requests 的异常带 response，aiohttp 的 ClientResponseError 直接带 headers
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        delay = backoff_delay(attempt, retry_after, base=self.base_delay, cap=self.max_delay)
+
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            print(f"❌ {description}失败且已接近消息处理截止时间，不再重试: {error}")
+            return None
+
+        print(f"🔁 {description}失败（{error}），{delay:.1f} 秒后重试 ({attempt + 1}/{self.max_retries})")
+        return delay
@@ -1,9 +1,12 @@
-import time
 import threading
 from datetime import datetime
 from notion_handler import NotionHandler
 from llm_handler import LLMHandler
 from template_manager import TemplateManager
+from worker_pool import MessageWorkerPool, CompletedPages
+from async_pipeline import MessagePipeline
+from poll_timer import AdaptivePollTimer
+from retry_policy import message_deadline
 
 class MessageScheduler:
     """消息处理调度器"""
@@ -17,7 +20,8 @@ class MessageScheduler:
         self.notion_handler = NotionHandler(config)
         
         self.llm_handler = LLMHandler(
-            config["openrouter"]["api_key"]
+            config["openrouter"]["api_key"],
+            settings=config.get("settings", {})
         )
         
         self.template_manager = TemplateManager()
@@ -26,6 +30,29 @@ class MessageScheduler:
         self.message_count = 0
         self.last_check_time = "从未"
         self.waiting_count = 0
+        self._stats_lock = threading.Lock()
+        
+        # 流水线模式（settings.pipeline_mode）：准备/LLM/写入分阶段并发处理
+        self.pipeline = None
+        if config.get("settings", {}).get("pipeline_mode", False):
+            self.pipeline = MessagePipeline(
+                self.prepare_message, self.generate_reply, self.finish_message,
+                config.get("settings", {}), log=self._log
+            )
+        
+        # 最近处理完成的页面：过期的待处理列表中再次出现时跳过（settings.completed_page_ttl）
+        self.completed_pages = CompletedPages.from_settings(config.get("settings", {}))
+        
+        # 并发处理池（max_concurrency > 1 时启用，否则逐条处理；流水线模式下不使用）
+        self.worker_pool = None
+        max_concurrency = config.get("settings", {}).get("max_concurrency", 1)
+        if max_concurrency > 1 and not self.pipeline:
+            self.worker_pool = MessageWorkerPool(
+                self.process_single_message, max_concurrency, self._emit_log, completed=self.completed_pages
+            )
+        
+        # 调度循环的唤醒计时器：支持立即触发、立即停止与自适应轮询间隔
+        self.poll_timer = AdaptivePollTimer.from_settings(config.get("settings", {}))
         
         # 启动时同步模板（如果配置了）
         if config.get("settings", {}).get("sync_on_startup", True):
@@ -34,29 +61,28 @@ class MessageScheduler:
     def start(self):
         """开始调度"""
         self.is_running = True
+        self.poll_timer.reset()
         
         while self.is_running:
             try:
-                self.check_and_process_messages()
-                
-                # 更新检查时间
-                self.last_check_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                
-                # 更新GUI状态
-                if self.gui:
-                    self.gui.root.after(0, lambda: self.gui.update_status(
-                        self.last_check_time, 
-                        self.message_count
-                    ))
-                
-                # 等待下次检查
-                interval = self.config.get("settings", {}).get("check_interval", 120)
+                if self.poll_timer.poll_due():
+                    processed = self.check_and_process_messages()
+                    # 有积压时缩短间隔，空闲时逐步拉长
+                    self.poll_timer.schedule_next(has_backlog=bool(processed))
+                    
+                    # 更新检查时间
+                    self.last_check_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    
+                    # 更新GUI状态
+                    if self.gui:
+                        self.gui.root.after(0, lambda: self.gui.update_status(
+                            self.last_check_time, 
+                            self.message_count
+                        ))
                 
-                # 分段等待，这样停止时更responsive
-                for _ in range(interval):
-                    if not self.is_running:
-                        break
-                    time.sleep(1)
+                # 等待下次检查；trigger() 或 stop() 会立即唤醒
+                if not self.poll_timer.wait():
+                    break
                     
             except Exception as e:
                 error_msg = f"调度器运行出错: {e}"
@@ -65,90 +91,132 @@ class MessageScheduler:
                     self.gui.root.after(0, lambda: self.gui.add_log(error_msg))
                 
                 # 出错后稍等再继续
-                time.sleep(10)
+                self.poll_timer.schedule_next(delay=10)
+        
+        if self.pipeline:
+            self.pipeline.shutdown()
+    
+    def trigger(self):
+        """立即发起一轮检查（如GUI同步模板后）"""
+        self.poll_timer.trigger()
     
     def check_and_process_messages(self):
-        """检查并处理消息"""
+        """检查并处理消息，返回本轮派发/处理的消息数"""
         try:
-            # 获取待处理消息
-            pending_messages = self.notion_handler.get_pending_messages()
+            # 边翻页边处理：拿到第一页结果即开始处理，无需等待整个积压列表
+            processed = self._dispatch_messages(self.notion_handler.iter_pending_messages())
             
-            # 获取等待处理的数量
-            self.waiting_count = self.notion_handler.get_waiting_count()
+            # 等待数量与待处理消息来自同一次查询（增量轮询时按本轮看到的页面增减，全量核对时整体校正）
+            self.waiting_count = self.notion_handler.last_waiting_count
             
-            if not pending_messages:
+            if not processed:
                 if self.waiting_count > 0:
                     log_msg = f"等待条件满足: {self.waiting_count}条，待处理: 0条"
                 else:
                     log_msg = "没有待处理的消息"
-                print(log_msg)
-                if self.gui:
-                    self.gui.root.after(0, lambda: self.gui.add_log(log_msg))
+                self._log(log_msg)
+                if self.gui and not (self.worker_pool and self.worker_pool.in_flight_count):
                     self.gui.root.after(0, lambda: self.gui.update_current_processing("等待新消息..."))
-                return
+                return 0
             
-            status_msg = f"等待条件满足: {self.waiting_count}条，待处理: {len(pending_messages)}条"
-            print(status_msg)
-            if self.gui:
-                self.gui.root.after(0, lambda: self.gui.add_log(status_msg))
-            
-            # 逐一处理消息
-            for message in pending_messages:
-                if not self.is_running:  # 检查是否要停止
-                    break
-                
-                self.process_single_message(message)
+            if self.worker_pool:
+                self._log(f"本轮共派发: {processed}条（处理中: {self.worker_pool.in_flight_count}条）")
+            else:
+                self._log(f"本轮共处理: {processed}条")
+            return processed
                 
         except Exception as e:
-            error_msg = f"检查消息时出错: {e}"
-            print(error_msg)
-            if self.gui:
-                self.gui.root.after(0, lambda: self.gui.add_log(error_msg))
+            self._log(f"检查消息时出错: {e}")
+            return 0
+    
+    def _dispatch_messages(self, messages):
+        """处理一批消息（流水线、并发池或逐条），返回派发/处理的消息数"""
+        if self.pipeline:
+            # 流水线模式：各阶段并发执行，本批消息全部处理完后返回
+            return self.pipeline.run(messages, lambda: self.is_running)
+        
+        processed = 0
+        for message in messages:
+            if not self.is_running:  # 检查是否要停止
+                break
+            
+            if self.worker_pool and self.worker_pool.is_handled(message["page_id"]):
+                continue  # 仍在处理中或刚处理完（列表可能早于回复写入）
+            
+            if processed == 0:
+                self._log("发现待处理消息，开始处理")
+            
+            if self.worker_pool:
+                # 并发模式：派发给工人，全忙时在此等待空位
+                if not self.worker_pool.dispatch(message, lambda: self.is_running):
+                    continue
+            else:
+                self.process_single_message(message)
+            processed += 1
+        return processed
     
     def process_single_message(self, message):
+        """处理单条消息（所有重试都受单条消息截止时间 settings.message_deadline 约束）"""
+        with message_deadline(self.config.get("settings", {}).get("message_deadline", 300)):
+            self._process_single_message(message)
+    
+    def _process_single_message(self, message):
         """处理单条消息"""
         try:
-            page_id = message["page_id"]
-            title = message["title"] or "无标题"
-            content = message["content"]
-            template_choice = message.get("template_choice", "")
-            tags = message.get("tags", [])
-            model_choice = message.get("model_choice", "")
+            job = self.prepare_message(message)
             
-            process_info = f"正在处理消息:\n模板: {template_choice}\n标签: {tags}\n模型: {model_choice}\n内容: {content[:100]}..."
-            print(f"处理消息: {template_choice} - {content[:50]}...")
+            # 渐进写入：模型生成过程中即把完整段落写入页面（使用流式输出）
+            if self.config.get("settings", {}).get("progressive_write", False):
+                job["writer"] = self.notion_handler.begin_incremental_reply(job["page_id"])
             
-            if self.gui:
-                self.gui.root.after(0, lambda: self.gui.add_log(f"开始处理 [{template_choice}]: {content[:30]}..."))
-                self.gui.root.after(0, lambda: self.gui.update_current_processing(process_info))
+            self.generate_reply(job)
+            self.finish_message(job)
             
-            # 1. 根据标签从知识库获取上下文
-            knowledge_context = self.notion_handler.get_context_from_knowledge_base(tags)
-            if "无" in tags:
-                log_msg = f"📝 已选择'无'背景，不使用知识库上下文"
-                print(log_msg)
-                if self.gui:
-                    self.gui.root.after(0, lambda: self.gui.add_log(log_msg))
-            elif knowledge_context:
-                valid_tags = [tag for tag in tags if tag != "无"]  # 排除"无"标签
-                log_msg = f"📚 已加载知识库上下文: {', '.join(valid_tags)}"
-                print(log_msg)
-                if self.gui:
-                    self.gui.root.after(0, lambda: self.gui.add_log(log_msg))
-            else:
-                valid_tags = [tag for tag in tags if tag != "无"]  # 排除"无"标签
-                if valid_tags:
-                    log_msg = f"⚠️ 知识库文件未找到: {', '.join(valid_tags)}"
-                    print(log_msg)
-                    if self.gui:
-                        self.gui.root.after(0, lambda: self.gui.add_log(log_msg))
+        except Exception as e:
+            self._log(f"处理消息时出错: {e}")
+    
+    def prepare_message(self, message):
+        """
+        准备阶段：加载知识库上下文、组合系统提示词并确定模型
+        
+        Returns:
+            dict: 处理任务，供 generate_reply / finish_message 继续使用
+        """
+        page_id = message["page_id"]
+        title = message["title"] or "无标题"
+        content = message["content"]
+        template_choice = message.get("template_choice", "")
+        tags = message.get("tags", [])
+        model_choice = message.get("model_choice", "")
+        
+        process_info = f"正在处理消息:\n模板: {template_choice}\n标签: {tags}\n模型: {model_choice}\n内容: {content[:100]}..."
+        self._log(f"处理消息: {template_choice} - {content[:50]}...", level="console")
+        self._log(f"开始处理 [{template_choice}]: {content[:30]}...", level="gui")
+        
+        if self.gui:
+            self.gui.root.after(0, lambda: self.gui.update_current_processing(process_info))
+        
+        # 1. 根据标签从知识库获取上下文
+        knowledge_context = self.notion_handler.get_context_from_knowledge_base(tags)
+        if "无" in tags:
+            log_msg = f"📝 已选择'无'背景，不使用知识库上下文"
+            self._log(log_msg)
+        elif knowledge_context:
+            valid_tags = [tag for tag in tags if tag != "无"]  # 排除"无"标签
+            log_msg = f"📚 已加载知识库上下文: {', '.join(valid_tags)}"
+            self._log(log_msg)
+        else:
+            valid_tags = [tag for tag in tags if tag != "无"]  # 排除"无"标签
+            if valid_tags:
+                log_msg = f"⚠️ 知识库文件未找到: {', '.join(valid_tags)}"
+                self._log(log_msg)
 
-            # 2. 获取基础系统提示词
-            base_system_prompt = self._get_system_prompt(template_choice)
-            
-            # 3. 组合系统提示词（优化版本：明确层次和优先级）
-            if knowledge_context:
-                system_prompt = f"""{base_system_prompt}
+        # 2. 获取基础系统提示词
+        base_system_prompt = self._get_system_prompt(template_choice)
+        
+        # 3. 组合系统提示词（优化版本：明确层次和优先级）
+        if knowledge_context:
+            system_prompt = f"""{base_system_prompt}
 
 ---
 
@@ -163,102 +231,145 @@ class MessageScheduler:
 2. 重要：当背景知识与用户问题相关时，深度融合背景信息
 3. 补充：如背景知识不足或不相关，请明确说明并基于角色专业知识回答
 4. 冲突处理：如背景信息与角色设定冲突，优先遵循角色设定"""
-            else:
-                system_prompt = base_system_prompt
-            
-            # 用户消息保持原样
-            final_content = content
+        else:
+            system_prompt = base_system_prompt
+        
+        # 用户消息保持原样
+        final_content = content
 
-            # 4. 确定要使用的模型ID
-            model_mapping = self.config.get("settings", {}).get("model_mapping", {})
-            override_model_id = model_mapping.get(model_choice) # 如果没找到，会是None
+        # 4. 确定要使用的模型ID
+        model_mapping = self.config.get("settings", {}).get("model_mapping", {})
+        override_model_id = model_mapping.get(model_choice) # 如果没找到，会是None
 
-            if model_choice and override_model_id:
-                log_msg = f"检测到模型选择: {model_choice} -> 使用模型: {override_model_id}"
-                print(log_msg)
-                if self.gui:
-                    self.gui.root.after(0, lambda: self.gui.add_log(log_msg))
+        if model_choice and override_model_id:
+            log_msg = f"检测到模型选择: {model_choice} -> 使用模型: {override_model_id}"
+            self._log(log_msg)
 
-            # 检查是否启用自动标题生成
-            auto_title = self.config.get("settings", {}).get("auto_generate_title", True)
-            title_max_length = self.config.get("settings", {}).get("title_max_length", 20)
-            title_min_length = self.config.get("settings", {}).get("title_min_length", 10)
+        return {
+            "page_id": page_id,
+            "content": final_content,
+            "template_choice": template_choice,
+            "system_prompt": system_prompt,
+            "knowledge_context": knowledge_context,
+            "override_model": override_model_id,
+            "writer": None
+        }
+    
+    def generate_reply(self, job):
+        """LLM阶段：生成回复与标题，结果写回 job 的 success / reply / title"""
+        final_content = job["content"]
+        system_prompt = job["system_prompt"]
+        knowledge_context = job["knowledge_context"]
+        override_model_id = job["override_model"]
+        
+        # 检查是否启用自动标题生成
+        auto_title = self.config.get("settings", {}).get("auto_generate_title", True)
+        title_max_length = self.config.get("settings", {}).get("title_max_length", 20)
+        title_min_length = self.config.get("settings", {}).get("title_min_length", 10)
+        
+        writer = job["writer"]
+        on_delta = writer.on_delta if writer else None
+        
+        if auto_title:
+            # 使用新的处理方法（生成回复+标题）
+            success, llm_reply, generated_title = self.llm_handler.process_with_template_and_title(
+                final_content, 
+                system_prompt, 
+                title_max_length, 
+                title_min_length,
+                override_model=override_model_id,
+                on_delta=on_delta
+            )
+        else:
+            # 传统处理方法（只生成回复）
+            success, llm_reply = self.llm_handler.send_message(
+                final_content, 
+                system_prompt,
+                override_model=override_model_id,
+                on_delta=on_delta
+            )
+            generated_title = None
+        
+        # --- 增加详细日志 ---
+        debug_lines = [
+            "---------- LLM Context Debug ----------",
+            "=== System Prompt ===",
+            system_prompt,
+            "\n=== Final Content Sent to LLM ===",
+            final_content,
+            "\n=== Knowledge Context Length ===",
+            f"Background file content length: {len(knowledge_context) if knowledge_context else 0} characters",
+            "\n=== LLM Raw Reply ===",
+            llm_reply,
+            "---------------------------------------"
+        ]
+        self._log("\n".join(debug_lines), level="console")
+        self._log(f"LLM 原始回复: {llm_reply[:100]}...", level="gui")
+        # 添加调试信息到GUI
+        if knowledge_context:
+            self._log(f"🔍 背景文件长度: {len(knowledge_context)} 字符", level="gui")
+        # --- 日志结束 ---
+
+        job["success"] = success
+        job["reply"] = llm_reply
+        job["title"] = generated_title
+        return job
+    
+    def finish_message(self, job):
+        """写入阶段：把回复（或错误信息）写回Notion"""
+        page_id = job["page_id"]
+        content = job["content"]
+        template_choice = job["template_choice"]
+        llm_reply = job["reply"]
+        generated_title = job["title"]
+        writer = job["writer"]
+        
+        if job["success"]:
+            # 成功：更新LLM回复和标题
+            update_success = self.notion_handler.update_message_reply(
+                page_id, 
+                llm_reply, 
+                generated_title,
+                writer=writer
+            )
             
-            if auto_title:
-                # 使用新的处理方法（生成回复+标题）
-                success, llm_reply, generated_title = self.llm_handler.process_with_template_and_title(
-                    final_content, 
-                    system_prompt, 
-                    title_max_length, 
-                    title_min_length,
-                    override_model=override_model_id
-                )
+            if update_success:
+                self._increment_message_count()
+                success_msg = f"✅ 消息处理成功 [{template_choice}]: {content[:30]}..."
+                self._log(success_msg)
             else:
-                # 传统处理方法（只生成回复）
-                success, llm_reply = self.llm_handler.send_message(
-                    final_content, 
-                    system_prompt,
-                    override_model=override_model_id
-                )
-                generated_title = None
-            
-            # --- 增加详细日志 ---
-            print("---------- LLM Context Debug ----------")
-            print("=== System Prompt ===")
-            print(system_prompt)
-            print("\n=== Final Content Sent to LLM ===")
-            print(final_content)
-            print("\n=== Knowledge Context Length ===")
-            print(f"Background file content length: {len(knowledge_context) if knowledge_context else 0} characters")
-            print("\n=== LLM Raw Reply ===")
-            print(llm_reply)
-            print("---------------------------------------")
-            if self.gui:
-                self.gui.root.after(0, lambda: self.gui.add_log(f"LLM 原始回复: {llm_reply[:100]}..."))
-                # 添加调试信息到GUI
-                if knowledge_context:
-                    self.gui.root.after(0, lambda: self.gui.add_log(f"🔍 背景文件长度: {len(knowledge_context)} 字符"))
-            # --- 日志结束 ---
-
-            if success:
-                # 成功：更新LLM回复和标题
-                update_success = self.notion_handler.update_message_reply(
-                    page_id, 
-                    llm_reply, 
-                    generated_title
-                )
+                error_msg = f"❌ 更新Notion失败 [{template_choice}]: {content[:30]}..."
+                self._log(error_msg)
+        else:
+            # LLM处理失败
+            error_msg = f"❌ LLM处理失败 [{template_choice}]: {llm_reply}"
+            self._log(error_msg)
                 
-                if update_success:
-                    self.message_count += 1
-                    success_msg = f"✅ 消息处理成功 [{template_choice}]: {content[:30]}..."
-                    print(success_msg)
-                    if self.gui:
-                        self.gui.root.after(0, lambda: self.gui.add_log(success_msg))
-                else:
-                    error_msg = f"❌ 更新Notion失败 [{template_choice}]: {content[:30]}..."
-                    print(error_msg)
-                    if self.gui:
-                        self.gui.root.after(0, lambda: self.gui.add_log(error_msg))
-            else:
-                # LLM处理失败
-                error_msg = f"❌ LLM处理失败 [{template_choice}]: {llm_reply}"
-                print(error_msg)
-                if self.gui:
-                    self.gui.root.after(0, lambda: self.gui.add_log(error_msg))
-                    
-                # 即使LLM失败，也可以更新一个错误信息到Notion
-                error_reply = f"处理失败：{llm_reply}"
-                self.notion_handler.update_message_reply(page_id, error_reply, "处理失败")
-            
-            # 处理间隔（避免API限制）
-            time.sleep(2)
-            
-        except Exception as e:
-            error_msg = f"处理消息时出错: {e}"
-            print(error_msg)
-            
-            if self.gui:
-                self.gui.root.after(0, lambda: self.gui.add_log(error_msg))
+            # 即使LLM失败，也可以更新一个错误信息到Notion
+            error_reply = f"处理失败：{llm_reply}"
+            self.notion_handler.update_message_reply(page_id, error_reply, "处理失败", writer=writer)
+    
+    def _increment_message_count(self):
+        """线程安全地累加已处理消息数"""
+        with self._stats_lock:
+            self.message_count += 1
+    
+    def _log(self, message, level="info"):
+        """
+        输出日志；并发模式下按消息派发顺序输出
+        
+        level: "info"/"error" 同时输出到控制台和GUI，"console" 仅控制台，"gui" 仅GUI
+        """
+        if self.worker_pool:
+            self.worker_pool.log(level, message)
+        else:
+            self._emit_log(level, message)
+    
+    def _emit_log(self, level, message):
+        if level != "gui":
+            print(message)
+        if level != "console" and self.gui:
+            self.gui.root.after(0, lambda: self.gui.add_log(message))
     
     def _get_system_prompt(self, template_choice):
         """根据模板选择获取系统提示词"""
@@ -298,4 +409,7 @@ class MessageScheduler:
     def stop(self):
         """停止调度"""
         self.is_running = False
+        self.poll_timer.cancel()
+        if self.worker_pool:
+            self.worker_pool.shutdown(wait=False)
         print("调度器已停止") 
\ No newline at end of file
@@ -1,15 +1,29 @@
+import asyncio
+import hashlib
 import json
 import os
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 
 class TemplateManager:
     """提示词模板管理器"""
     
-    def __init__(self, template_file="templates.json", notion_handler=None):
+    def __init__(self, template_file="templates.json", notion_handler=None, async_notion_handler=None):
+        """
+        Args:
+            async_notion_handler: 可选的 AsyncNotionHandler；提供时全量同步与推送使用异步请求
+                （应为模板同步专用的实例，不与流水线共用，各自在自己的事件循环中使用）
+        """
         self.template_file = template_file
         self.notion_handler = notion_handler
+        self.async_notion_handler = async_notion_handler
         self.templates = {}
         self.categories = []
+        # 增量同步游标：只查询该时间之后在Notion中编辑过的模板（随模板文件持久化）
+        self.sync_cursor = None
+        self.last_full_sync = None
+        # 上次推送到Notion时各模板的内容哈希，未变化的模板不再推送
+        self.push_hashes = {}
         self.load_templates()
     
     def load_templates(self):
@@ -20,6 +34,10 @@ class TemplateManager:
                     data = json.load(f)
                     self.templates = data.get("templates", {})
                     self.categories = data.get("categories", ["基础", "商业", "技术", "创意", "教育", "生活"])
+                    metadata = data.get("metadata", {})
+                    self.sync_cursor = metadata.get("notion_sync_cursor")
+                    self.last_full_sync = metadata.get("notion_full_sync")
+                    self.push_hashes = metadata.get("notion_push_hashes", {})
             else:
                 # 如果文件不存在，创建默认模板
                 self.create_default_templates()
@@ -36,7 +54,10 @@ class TemplateManager:
                 "metadata": {
                     "version": "1.0",
                     "last_updated": datetime.now().isoformat(),
-                    "total_templates": len(self.templates)
+                    "total_templates": len(self.templates),
+                    "notion_sync_cursor": self.sync_cursor,
+                    "notion_full_sync": self.last_full_sync,
+                    "notion_push_hashes": self.push_hashes
                 }
             }
             
@@ -130,28 +151,60 @@ class TemplateManager:
             return self.save_templates()
         return True
     
-    def sync_from_notion(self):
-        """从Notion同步模板到本地"""
+    def sync_from_notion(self, full=False):
+        """
+        从Notion同步模板到本地
+
+        已有同步游标时只做增量同步：查询游标之后编辑过的模板页面，仅重新获取这些页面的内容，
+        并按现存页面ID移除已在Notion中删除的模板。
+        首次同步、full=True 或距上次全量同步超过 settings.template_full_sync_hours 时做全量同步。
+        """
         if not self.notion_handler:
             return False, "未配置Notion处理器"
         
+        if full or self._full_sync_due():
+            return self._full_sync_from_notion()
+        return self._delta_sync_from_notion()
+    
+    def _full_sync_due(self):
+        """是否需要全量同步"""
+        if not self.sync_cursor or not self.last_full_sync:
+            return True
+        full_sync_hours = self.notion_handler.settings.get("template_full_sync_hours", 24)
+        try:
+            elapsed = datetime.now(timezone.utc) - datetime.fromisoformat(self.last_full_sync)
+        except ValueError:
+            return True
+        return elapsed.total_seconds() >= full_sync_hours * 3600
+    
+    def _next_sync_cursor(self, sync_started):
+        """本次同步开始时间减去安全余量（last_edited_time 只精确到分钟）"""
+        margin = self.notion_handler.settings.get("watermark_margin", 120)
+        return (sync_started - timedelta(seconds=margin)).isoformat()
+    
+    def _full_sync_from_notion(self):
+        """全量同步：用Notion中启用的模板替换本地模板"""
         try:
             print("🔄 开始从Notion同步模板...")
+            sync_started = datetime.now(timezone.utc)
             
             # 从Notion获取模板数据
-            notion_data = self.notion_handler.get_templates_from_notion()
+            if self.async_notion_handler:
+                notion_data = self._run_async(self.async_notion_handler.get_templates_from_notion())
+            else:
+                notion_data = self.notion_handler.get_templates_from_notion()
             
             if not notion_data:
                 return False, "从Notion获取模板数据失败"
             
             # 更新本地模板数据
             self.templates = notion_data.get('templates', {})
-            notion_categories = notion_data.get('categories', [])
+            self._merge_categories(notion_data.get('categories', []))
+            # 本地内容与Notion一致，记录为已推送状态
+            self.push_hashes = {name: self._content_hash(name, template) for name, template in self.templates.items()}
             
-            # 合并分类，保持现有分类并添加新的
-            for category in notion_categories:
-                if category not in self.categories:
-                    self.categories.append(category)
+            self.sync_cursor = self._next_sync_cursor(sync_started)
+            self.last_full_sync = sync_started.isoformat()
             
             # 保存到本地文件
             success = self.save_templates()
@@ -166,33 +219,196 @@ class TemplateManager:
             print(f"❌ 同步模板失败: {e}")
             return False, f"同步失败: {e}"
     
-    def sync_to_notion(self):
-        """将本地模板同步到Notion"""
+    def _delta_sync_from_notion(self):
+        """增量同步：只处理游标之后编辑过的模板（新增、修改、改名、停用），并移除已在Notion中删除的模板"""
+        try:
+            print("🔄 开始从Notion增量同步模板...")
+            sync_started = datetime.now(timezone.utc)
+            
+            # 先取回全部数据再修改本地模板：任一请求（含页面内容获取）失败时抛出异常，
+            # 本地模板与同步游标保持不变，下次从原游标重试
+            changes = self.notion_handler.get_template_changes(self.sync_cursor)
+            # 在Notion中被删除的模板不会出现在变更查询中，需与现存页面ID比对
+            existing_page_ids = self.notion_handler.get_template_page_id_set()
+            
+            # page_id -> 本地模板名称，用于识别改名与停用
+            names_by_page = {
+                template.get("notion_page_id"): name
+                for name, template in self.templates.items()
+                if template.get("notion_page_id")
+            }
+            
+            updated_count = 0
+            removed_count = 0
+            for change in changes:
+                page_id = change['page_id']
+                old_name = names_by_page.get(page_id)
+                
+                if not change['enabled']:
+                    if old_name and old_name in self.templates:
+                        del self.templates[old_name]
+                        self.push_hashes.pop(old_name, None)
+                        removed_count += 1
+                    continue
+                
+                # 改名：删除旧名称下的记录
+                if old_name and old_name != change['name']:
+                    self.templates.pop(old_name, None)
+                    self.push_hashes.pop(old_name, None)
+                
+                template = {
+                    'category': change['category'],
+                    'prompt': change['prompt'],
+                    'description': change['description'],
+                    'updated': change['updated'],
+                    'notion_page_id': page_id
+                }
+                self.templates[change['name']] = template
+                self.push_hashes[change['name']] = self._content_hash(change['name'], template)
+                names_by_page[page_id] = change['name']
+                self._merge_categories([change['category']])
+                updated_count += 1
+            
+            # 移除在Notion中找不到页面的本地模板
+            for name, template in list(self.templates.items()):
+                page_id = template.get("notion_page_id")
+                if page_id and page_id not in existing_page_ids:
+                    del self.templates[name]
+                    self.push_hashes.pop(name, None)
+                    removed_count += 1
+            
+            self.sync_cursor = self._next_sync_cursor(sync_started)
+            
+            if not self.save_templates():
+                return False, "保存模板到本地文件失败"
+            
+            print(f"✅ 增量同步完成：更新 {updated_count} 个，移除 {removed_count} 个")
+            return True, f"同步成功！更新了 {updated_count} 个模板，移除了 {removed_count} 个，共 {len(self.templates)} 个模板"
+            
+        except Exception as e:
+            print(f"❌ 增量同步模板失败: {e}")
+            return False, f"同步失败: {e}"
+    
+    def _merge_categories(self, categories):
+        """合并分类，保持现有分类并添加新的"""
+        for category in categories:
+            if category not in self.categories:
+                self.categories.append(category)
+    
+    def sync_to_notion(self, progress_callback=None, force=False):
+        """
+        将本地模板同步到Notion
+        
+        只推送内容哈希与上次推送时不同的模板（force=True 时全部推送）；
+        名称到页面ID的映射由一次批量查询得到，改动的模板由有界线程池并发推送
+        （settings.template_push_concurrency，仍受共享限流器约束）。
+        
+        Args:
+            progress_callback: 每推送完一个模板调用 progress_callback(done, total, name, success)
+            force: 忽略内容哈希，推送全部模板
+        """
         if not self.notion_handler:
             return False, "未配置Notion处理器"
         
         try:
             print("🔄 开始向Notion同步模板...")
             
+            hashes = {name: self._content_hash(name, template) for name, template in self.templates.items()}
+            changed = [name for name in self.templates if force or self.push_hashes.get(name) != hashes[name]]
+            
+            if not changed:
+                print("✅ 本地模板没有改动，无需推送")
+                return True, f"同步成功！{len(self.templates)} 个模板均无改动"
+            
+            # 一次查询取得全部模板页面，推送时不再逐个按名称查找
+            page_ids = self.notion_handler.get_template_page_ids()
+            
+            max_workers = max(1, int(self.notion_handler.settings.get("template_push_concurrency", 3)))
+            if self.async_notion_handler:
+                results = self._run_async(self._push_templates_async(changed, page_ids, max_workers))
+            else:
+                results = self._push_templates(changed, page_ids, max_workers)
+            
             success_count = 0
             failed_templates = []
-            
-            for name, template_data in self.templates.items():
-                success = self.notion_handler.sync_template_to_notion(name, template_data)
+            for done, (name, success) in enumerate(results, 1):
                 if success:
                     success_count += 1
+                    self.push_hashes[name] = hashes[name]
                 else:
                     failed_templates.append(name)
+                
+                if progress_callback:
+                    progress_callback(done, len(changed), name, success)
+            
+            self.save_templates()
             
+            skipped = len(self.templates) - len(changed)
             if failed_templates:
                 return False, f"同步完成：成功 {success_count} 个，失败 {len(failed_templates)} 个\n失败的模板：{', '.join(failed_templates)}"
             else:
-                return True, f"同步成功！上传了 {success_count} 个模板到Notion"
+                return True, f"同步成功！上传了 {success_count} 个模板到Notion，{skipped} 个无改动已跳过"
                 
         except Exception as e:
             print(f"❌ 同步模板到Notion失败: {e}")
             return False, f"同步失败: {e}"
     
+    def _push_templates(self, names, page_ids, max_workers):
+        """用有界线程池并发推送模板，按完成顺序逐个产出 (名称, 是否成功)"""
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(names)),
+                                thread_name_prefix="template-push") as executor:
+            futures = {
+                executor.submit(
+                    self.notion_handler.sync_template_to_notion,
+                    name, self.templates[name], page_ids.get(name), False
+                ): name
+                for name in names
+            }
+            
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    success = future.result()
+                except Exception as e:
+                    print(f"推送模板 {name} 失败: {e}")
+                    success = False
+                yield name, success
+    
+    async def _push_templates_async(self, names, page_ids, max_workers):
+        """用异步客户端并发推送模板（同时最多 max_workers 个），返回按完成顺序排列的 (名称, 是否成功)"""
+        semaphore = asyncio.Semaphore(max_workers)
+        
+        async def push(name):
+            async with semaphore:
+                try:
+                    return name, await self.async_notion_handler.sync_template_to_notion(
+                        name, self.templates[name], page_ids.get(name)
+                    )
+                except Exception as e:
+                    print(f"推送模板 {name} 失败: {e}")
+                    return name, False
+        
+        return [await result for result in asyncio.as_completed([push(name) for name in names])]
+    
+    def _run_async(self, coroutine):
+        """在新的事件循环中运行异步客户端的操作，结束后关闭其连接池"""
+        async def run():
+            try:
+                return await coroutine
+            finally:
+                await self.async_notion_handler.close()
+        
+        return asyncio.run(run())
+    
+    @staticmethod
+    def _content_hash(name, template):
+        """模板中会推送到Notion的字段（名称、分类、描述、提示词）的哈希"""
+        content = json.dumps(
+            [name, template.get("category", "基础"), template.get("description", ""), template.get("prompt", "")],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+    
     def auto_sync_from_notion_if_empty(self):
         """如果本地模板为空，自动从Notion同步"""
         if len(self.templates) == 0 and self.notion_handler:
@@ -11,6 +11,8 @@ import sys
 import re
 import requests
 
+from notion_handler import find_property_type_issues
+
 def load_config():
     """加载配置文件"""
     try:
@@ -90,8 +92,15 @@ def validate_notion_config(config):
     try:
         resp = requests.get(url, headers=headers, timeout=10)
         if resp.status_code == 200:
-            print("✅ Notion API连通性检测通过，配置有效！")
-        return True
+            # 用同一次请求返回的Schema检查各属性是否存在、类型是否正确
+            type_issues = find_property_type_issues(notion_config, resp.json().get("properties", {}))
+            if type_issues:
+                print("❌ 数据库属性与配置不一致:")
+                for issue in type_issues:
+                    print(f"  - {issue}")
+                return False
+            print("✅ Notion API连通性与属性类型检测通过，配置有效！")
+            return True
         else:
             print(f"❌ Notion API请求失败，状态码: {resp.status_code}")
             try:
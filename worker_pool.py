@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+消息并发处理池
+供 MessageScheduler 与 CloudScheduler 共用：
+- 有界并发（settings.max_concurrency），工人全忙时派发方阻塞等待
+- 同一 page_id 在处理完成前不会被重复派发；处理完成后的一段时间内（settings.completed_page_ttl）
+  也不会再次派发，避免派发方阻塞期间拿到的过期列表把刚写完回复的页面再处理一遍
+- 日志按派发顺序输出，并发时不同消息的日志不会交错
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OrderedLogger:
+    """按派发顺序输出日志
+
+    排在最前面的消息实时输出日志，其余消息的日志先缓存，
+    等前面的消息全部处理完后再整体输出。
+    """
+
+    def __init__(self, emit):
+        self._emit = emit            # callable(level, message)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._next_seq = 0           # 当前可实时输出的序号
+        self._buffers = {}           # seq -> [(level, message), ...]
+        self._finished = set()
+
+    def bind(self, seq):
+        """将当前线程绑定到某条消息的序号"""
+        self._local.seq = seq
+
+    def unbind(self):
+        self._local.seq = None
+
+    def log(self, level, message):
+        seq = getattr(self._local, "seq", None)
+        with self._lock:
+            if seq is None or seq == self._next_seq:
+                self._emit(level, message)
+            else:
+                self._buffers.setdefault(seq, []).append((level, message))
+
+    def finish(self, seq):
+        """标记某条消息处理完成，并输出已轮到的缓存日志"""
+        with self._lock:
+            self._finished.add(seq)
+            while self._next_seq in self._finished:
+                self._finished.discard(self._next_seq)
+                self._buffers.pop(self._next_seq, None)
+                self._next_seq += 1
+                for level, message in self._buffers.pop(self._next_seq, []):
+                    self._emit(level, message)
+
+
+class CompletedPages:
+    """最近处理完成的 page_id（带过期时间、数量有上限，线程安全）
+
+    待处理列表是逐页拉取的，可能早于回复写入：页面处理完后仍可能出现在
+    稍后取到的列表里。在 ttl 秒内记住已完成的页面，派发前据此跳过。
+    """
+
+    def __init__(self, ttl=600, max_size=10000):
+        self.ttl = ttl
+        self.max_size = max(1, int(max_size))
+        self._lock = threading.Lock()
+        self._completed = OrderedDict()  # page_id -> 完成时间（按完成顺序）
+
+    @classmethod
+    def from_settings(cls, settings):
+        """从配置的 settings 部分创建（settings.completed_page_ttl）"""
+        return cls(ttl=(settings or {}).get("completed_page_ttl", 600))
+
+    def add(self, page_id):
+        with self._lock:
+            self._completed.pop(page_id, None)
+            self._completed[page_id] = time.monotonic()
+            self._prune()
+
+    def __contains__(self, page_id):
+        with self._lock:
+            self._prune()
+            return page_id in self._completed
+
+    def __len__(self):
+        with self._lock:
+            self._prune()
+            return len(self._completed)
+
+    def _prune(self):
+        """丢弃过期与超出数量上限的记录（最早完成的在最前面）"""
+        expired_before = time.monotonic() - self.ttl
+        while self._completed:
+            completed_at = next(iter(self._completed.values()))
+            if completed_at >= expired_before and len(self._completed) <= self.max_size:
+                break
+            self._completed.popitem(last=False)
+
+
+class MessageWorkerPool:
+    """有界并发的消息处理池"""
+
+    def __init__(self, process, max_concurrency, emit_log, completed=None):
+        """
+        Args:
+            process: 处理单条消息的函数 process(message)
+            max_concurrency: 最大并发数
+            emit_log: 实际输出日志的函数 emit_log(level, message)
+            completed: 最近处理完成的页面记录（CompletedPages），可与调度器共用
+        """
+        self.process = process
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.logger = OrderedLogger(emit_log)
+        self.completed = completed if completed is not None else CompletedPages()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="message-worker"
+        )
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._next_seq = 0
+        self._closed = False
+
+    def dispatch(self, message, should_continue=lambda: True):
+        """
+        派发一条消息；所有工人都在忙时阻塞等待空位
+
+        Args:
+            message: 消息数据（需包含 page_id）
+            should_continue: 等待空位期间用于检查是否应放弃派发（如调度器已停止）
+
+        Returns:
+            bool: 是否已派发（处理中、刚处理完或已停止时返回False）
+        """
+        page_id = message["page_id"]
+        with self._lock:
+            # 在锁内检查：处理完成的页面先记入 completed 再移出 _in_flight，两者之间没有空档
+            if self._closed or page_id in self._in_flight or page_id in self.completed:
+                return False
+            self._in_flight.add(page_id)
+
+        # 等待空闲工人（分段等待，停止时能及时退出）
+        while not self._slots.acquire(timeout=1):
+            if self._closed or not should_continue():
+                with self._lock:
+                    self._in_flight.discard(page_id)
+                return False
+
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+
+        try:
+            self._executor.submit(self._run, seq, page_id, message)
+        except RuntimeError:
+            # 线程池已关闭
+            self._release(seq, page_id, completed=False)
+            return False
+        return True
+
+    def _run(self, seq, page_id, message):
+        self.logger.bind(seq)
+        try:
+            self.process(message)
+        except Exception as e:
+            self.logger.log("error", f"处理消息时出错: {e}")
+        finally:
+            self.logger.unbind()
+            self._release(seq, page_id)
+
+    def _release(self, seq, page_id, completed=True):
+        with self._lock:
+            if completed:
+                self.completed.add(page_id)
+            self._in_flight.discard(page_id)
+        self._slots.release()
+        self.logger.finish(seq)
+
+    def log(self, level, message):
+        """在当前消息的顺序上下文中输出日志"""
+        self.logger.log(level, message)
+
+    def is_in_flight(self, page_id):
+        with self._lock:
+            return page_id in self._in_flight
+
+    def is_handled(self, page_id):
+        """页面正在处理或刚处理完成（不应再次派发）"""
+        with self._lock:
+            return page_id in self._in_flight or page_id in self.completed
+
+    @property
+    def in_flight_count(self):
+        with self._lock:
+            return len(self._in_flight)
+
+    def shutdown(self, wait=False):
+        """关闭处理池；未开始的任务会被取消"""
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=True)